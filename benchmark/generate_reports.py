@@ -0,0 +1,174 @@
+"""
+This script generates synthetic Hall and ICP lab reports for benchmarks.
+Reports follow the format of the instrument reports: two header lines and
+one tab separated ID/value line per measured quantity.
+
+Every generated material has a ball milling and a hot press step, and a Hall
+and an ICP report for the output material of both steps, so 1000 files are
+250 materials. With --lineage the matching material_procurement,
+ball_milling and hot_press rows replace the rows of these tables in the
+database so the visualization functions can be benchmarked on the same
+data.
+
+usage: python generate_reports.py FOLDER [--count 1000] [--seed 0] [--lineage]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+# number of report files written for every material
+FILES_PER_MATERIAL = 4
+
+
+def material_ids(i):
+    """Return ids of the lineage of material number i"""
+    return {'ball_milling_uid': 'MATX-BM{:06d}'.format(i),
+            'hot_press_uid': 'MATX-HP{:06d}'.format(i),
+            'bm_output_uid': 'BMOUT-{:06d}'.format(i),
+            'hp_output_uid': 'HPOUT-{:06d}'.format(i)}
+
+
+def hall_report(material_uid, rnd):
+    """Return text of a Hall measurement report"""
+    rows = [('Material UID', material_uid),
+            ('Measurement', 'Hall'),
+            ('Probe Resistance (ohm)', '{:.3f}'.format(rnd.uniform(1, 100))),
+            ('Gas Flow Rate (sccm)', '{:.2f}'.format(rnd.uniform(1, 10))),
+            ('Gas Type', rnd.choice(['Ar', 'N2', 'He'])),
+            ('Probe Material', rnd.choice(['Cu', 'Au', 'Pt'])),
+            ('Current (mA)', '{:.3f}'.format(rnd.uniform(0.1, 5))),
+            ('Field Strength (T)', '{:.3f}'.format(rnd.uniform(0.1, 2))),
+            ('Sample Position', str(rnd.randint(1, 8))),
+            ('Magnet Reversal', rnd.choice(['True', 'False']))]
+    return format_report('Hall Measurement Report', rows)
+
+
+def icp_report(material_uid, rnd):
+    """Return text of an ICP measurement report"""
+    pb, sn = rnd.uniform(0, 0.5), rnd.uniform(0, 0.4)
+    rows = [('Material UID', material_uid),
+            ('Measurement', 'ICP'),
+            ('Pb Concentration', '{:.4f}'.format(pb)),
+            ('Sn Concentration', '{:.4f}'.format(sn)),
+            ('O Concentration', '{:.4f}'.format(1 - pb - sn)),
+            ('Gas Flow Rate (sccm)', '{:.2f}'.format(rnd.uniform(1, 20))),
+            ('Gas Type', rnd.choice(['Ar', 'N2'])),
+            ('Plasma Temperature (K)', '{:.1f}'.format(rnd.uniform(6e3, 1e4))),
+            ('Detector Temperature (K)', '{:.1f}'.format(rnd.uniform(250, 320))),
+            ('Field Strength (T)', '{:.3f}'.format(rnd.uniform(0.1, 2))),
+            ('Plasma Observation', rnd.choice(['Axial', 'Radial'])),
+            ('Radio Frequency (MHz)', rnd.choice(['27.12', '40.68']))]
+    return format_report('ICP Measurement Report', rows)
+
+
+def format_report(title, rows):
+    """Return report text with header and tab separated rows"""
+    lines = [title, '']
+    lines.extend('{}\t {}'.format(row_id, value) for row_id, value in rows)
+    return '\n'.join(lines) + '\n'
+
+
+def generate_reports(folder, count, seed=0):
+    """Write count report files to folder, returns number of materials"""
+    rnd = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    n_materials = (count + FILES_PER_MATERIAL - 1) // FILES_PER_MATERIAL
+    written = 0
+    for i in range(n_materials):
+        ids = material_ids(i)
+        reports = [('Hall-{}.txt', hall_report, ids['bm_output_uid']),
+                   ('ICP-{}.txt', icp_report, ids['bm_output_uid']),
+                   ('Hall-{}.txt', hall_report, ids['hp_output_uid']),
+                   ('ICP-{}.txt', icp_report, ids['hp_output_uid'])]
+        for name, report, material_uid in reports:
+            if written == count:
+                break
+            with open(os.path.join(folder, name.format(material_uid)),
+                      'w') as out:
+                out.write(report(material_uid, rnd))
+            written += 1
+    return n_materials
+
+
+def lineage_rows(n_materials, seed=0):
+    """Return rows of material_procurement, ball_milling and hot_press
+       tables for generated materials"""
+    rnd = random.Random(seed + 1)
+    materials, ball, hot = [], [], []
+    for i in range(n_materials):
+        ids = material_ids(i)
+        cu, se = rnd.uniform(0.1, 0.5), rnd.uniform(0.1, 0.4)
+        for j, (name, fraction) in enumerate([('Cu', cu), ('Se', se),
+                                              ('Zn', 1 - cu - se)]):
+            materials.append({'uid': 'MATX-MP{:06d}-{}'.format(i, j),
+                              'ball_milling_uid': ids['ball_milling_uid'],
+                              'material_name': name,
+                              'mass_fraction': fraction})
+        ball.append({'uid': ids['ball_milling_uid'],
+                     'milling_speed': rnd.choice([200, 300, 400]),
+                     'milling_speed_units': 'rpm',
+                     'milling_time': rnd.choice([1, 2, 4, 8]),
+                     'milling_time_units': 'h',
+                     'output_material_uid': ids['bm_output_uid'],
+                     'hot_press_uid': ids['hot_press_uid']})
+        hot.append({'uid': ids['hot_press_uid'],
+                    'hot_press_temperature': rnd.choice([400, 500, 600]),
+                    'hot_press_temperature_units': 'C',
+                    'hot_press_pressure': rnd.choice([20, 40, 60]),
+                    'hot_press_pressure_units': 'MPa',
+                    'hot_press_time': rnd.choice([30, 60, 120]),
+                    'hot_press_time_units': 'min',
+                    'output_material_name': 'MatX-{}'.format(i),
+                    'output_material_uid': ids['hp_output_uid']})
+    return {'material_procurement': materials, 'ball_milling': ball,
+            'hot_press': hot}
+
+
+def insert_lineage(engine, n_materials, seed=0, chunk_size=5000):
+    """Replace the rows of the material_procurement, ball_milling and
+       hot_press tables with the lineage of generated materials. Missing
+       tables are created with their indexes by schema.py, existing tables
+       are emptied so their indexes are kept."""
+    import pandas as pd
+    from sqlalchemy import text
+    import schema
+
+    tables = lineage_rows(n_materials, seed)
+    schema.create_tables(engine, [schema.meta.tables[table]
+                                  for table in tables])
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        conn.execute(text('TRUNCATE {}'.format(
+            ', '.join(quote(table) for table in tables))))
+        for table, rows in tables.items():
+            pd.DataFrame(rows).to_sql(table, conn, if_exists='append',
+                                      index=False, chunksize=chunk_size,
+                                      method='multi')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('folder')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of report files, 1k to 1M')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lineage', action='store_true',
+                        help='insert lineage tables into the database')
+    args = parser.parse_args()
+
+    n_materials = generate_reports(args.folder, args.count, args.seed)
+    print('{} reports of {} materials written to {}'.format(
+        args.count, n_materials, args.folder))
+
+    if args.lineage:
+        sys.path.insert(0, os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), '..', 'processing'))
+        import processing as process
+        if process.postgresql_host not in ('localhost', '127.0.0.1', '::1'):
+            sys.exit('lineage tables are replaced, only a local database '
+                     'is allowed, host in config.ini is {}'.format(
+                         process.postgresql_host))
+        insert_lineage(process.get_engine(), n_materials, args.seed)
+        print('lineage of {} materials inserted'.format(n_materials))
@@ -0,0 +1,267 @@
+"""
+This script runs repeatable ingest and visualization benchmarks on reports
+made by generate_reports.py and saves the results as JSON so versions can be
+compared.
+
+Benchmarks:
+    process_report  parse time per report file
+    report_handler  parse and insert time per report file (--db)
+    startup_*       throughput of the serial, bulk and parallel load (--db)
+    merge_tables, compare_materials, getFigure  read side (--read)
+    import_*        start of a new python process importing processing.py
+                    or app.py or printing the help of ingest.py
+
+Database benchmarks write to the database of config.ini and are only run
+against a local PostgreSQL server.
+
+The import benchmarks of processing.py and ingest.py are checked against
+IMPORT_BUDGET_S, the script exits with status 1 if they are slower.
+
+usage: python run_benchmarks.py FOLDER [--db] [--read] [--sample 1000]
+       python run_benchmarks.py --imports
+       python run_benchmarks.py --compare OLD.json NEW.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'processing'))
+sys.path.insert(0, os.path.join(here, '..', 'visualize'))
+
+import processing as process  # noqa: E402
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# a benchmark is reported as a regression when it is this much slower
+REGRESSION_THRESHOLD = 1.10
+
+# seconds a new python process may take to import processing.py or app.py
+# or to print the help of ingest.py, a restarted watchdog waits at least
+# this long
+IMPORT_BUDGET_S = 0.25
+IMPORT_BUDGETED = ('import_processing', 'import_ingest_help', 'import_app')
+
+
+def summarize(name, timings, items=1):
+    """Return result dict of list of durations in seconds"""
+    total = sum(timings)
+    return {'name': name,
+            'runs': len(timings),
+            'items_per_run': items,
+            'total_s': total,
+            'mean_s': total / len(timings),
+            'p50_s': statistics.median(timings),
+            'p95_s': sorted(timings)[int(0.95 * (len(timings) - 1))],
+            'items_per_s': items * len(timings) / total if total else None}
+
+
+def list_reports(folder, sample=None):
+    """Return sorted report paths of folder, at most sample paths"""
+    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                   if process.get_reporttype(f))
+    return paths[:sample] if sample else paths
+
+
+def bench_process_report(paths):
+    """Time process_report per file"""
+    timings = []
+    for path in paths:
+        report_type = process.get_reporttype(os.path.basename(path))
+        start = time.perf_counter()
+        process.process_report(path, report_type)
+        timings.append(time.perf_counter() - start)
+    return summarize('process_report', timings)
+
+
+def bench_report_handler(paths):
+    """Time report_handler per file, includes the insert"""
+    timings = []
+    for path in paths:
+        filename = os.path.basename(path)
+        report_type = process.get_reporttype(filename)
+        start = time.perf_counter()
+        process.report_handler(path, filename, report_type)
+        timings.append(time.perf_counter() - start)
+    return summarize('report_handler', timings)
+
+
+def bench_startup(paths):
+    """Time serial, bulk and parallel load of all files"""
+    loaders = [('startup_serial', lambda: [process.reporttype_detect(p)
+                                           for p in paths]),
+               ('startup_bulk', lambda: process.bulk_load(paths)),
+               ('startup_parallel', lambda: process.parallel_load(paths))]
+    results = []
+    for name, load in loaders:
+        clear_report_tables()
+        start = time.perf_counter()
+        load()
+        results.append(summarize(name, [time.perf_counter() - start],
+                                 len(paths)))
+    return results
+
+
+def bench_imports(repeat):
+    """Time new python processes importing the scripts, the best of repeat
+       runs is compared with IMPORT_BUDGET_S"""
+    processing_dir = os.path.join(here, '..', 'processing')
+    commands = [
+        ('import_processing', ['-c', 'import processing']),
+        ('import_ingest_help', [os.path.join(processing_dir, 'ingest.py'),
+                                '--help']),
+        ('import_app', ['-c', 'import app'])]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [processing_dir, os.path.join(here, '..', 'visualize')]))
+    results = []
+    for name, command in commands:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+        result = summarize(name, timings)
+        result['best_s'] = min(timings)
+        results.append(result)
+    return results
+
+
+def over_budget(results):
+    """Return names of import benchmarks slower than IMPORT_BUDGET_S"""
+    return [r['name'] for r in results if r['name'] in IMPORT_BUDGETED
+            and r['best_s'] > IMPORT_BUDGET_S]
+
+
+def bench_read(repeat):
+    """Time visualization functions of app.py"""
+    import app
+    ids = list(app.merge_tables()['BM-uid'].head(3))
+    calls = [('merge_tables', app.merge_tables),
+             ('compare_materials', lambda: app.compare_materials(ids)),
+             ('getFigure', app.getFigure)]
+    results = []
+    for name, call in calls:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+        results.append(summarize(name, timings))
+    return results
+
+
+def clear_report_tables():
+    """Empty Hall and ICP tables so every load inserts all reports"""
+    from sqlalchemy import text
+    tables = [process.prepare_table(t) for t in ('HALL', 'ICP')]
+    with process.get_engine().begin() as conn:
+        for table in tables:
+            conn.execute(text('DELETE FROM {}'.format(table)))
+
+
+def check_local_db():
+    """Refuse to run database benchmarks against a remote server"""
+    if process.postgresql_host not in LOCAL_HOSTS:
+        sys.exit('database benchmarks only run against a local server, '
+                 'host in config.ini is {}'.format(process.postgresql_host))
+
+
+def environment():
+    """Return versions and machine information stored with results"""
+    import pandas as pd
+    import sqlalchemy
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=here,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'python': platform.python_version(),
+            'pandas': pd.__version__, 'sqlalchemy': sqlalchemy.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'date': datetime.now().isoformat(timespec='seconds')}
+
+
+def compare(old_path, new_path):
+    """Print change of mean time per benchmark between two result files.
+       Returns number of regressions."""
+    with open(old_path) as f:
+        old = {r['name']: r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {r['name']: r for r in json.load(f)['results']}
+    regressions = 0
+    for name in sorted(old.keys() & new.keys()):
+        ratio = new[name]['mean_s'] / old[name]['mean_s']
+        flag = ''
+        if ratio > REGRESSION_THRESHOLD:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{:<20} {:>12.6f} s {:>12.6f} s {:>7.2f}x{}'.format(
+            name, old[name]['mean_s'], new[name]['mean_s'], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('folder', nargs='?')
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='files used for per file benchmarks')
+    parser.add_argument('--db', action='store_true',
+                        help='run benchmarks that write to the database')
+    parser.add_argument('--read', action='store_true',
+                        help='run visualization benchmarks')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repetitions of visualization benchmarks')
+    parser.add_argument('--output', default=os.path.join(here, 'results'))
+    parser.add_argument('--imports', action='store_true',
+                        help='only run import benchmarks')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+    if not args.folder and not args.imports:
+        parser.error('folder of generated reports is required')
+
+    process.setup_logging()
+    warnings.simplefilter('ignore', FutureWarning)
+    all_paths = [] if args.imports else list_reports(args.folder)
+    sample = all_paths[:args.sample]
+
+    results = bench_imports(args.repeat)
+    if not args.imports:
+        results.append(bench_process_report(sample))
+    if args.db or args.read:
+        check_local_db()
+    if args.db:
+        clear_report_tables()
+        results.append(bench_report_handler(sample))
+        results.extend(bench_startup(all_paths))
+    if args.read:
+        results.extend(bench_read(args.repeat))
+
+    for r in results:
+        print('{:<20} {:>6} runs  mean {:>10.6f} s  p95 {:>10.6f} s'.format(
+            r['name'], r['runs'], r['mean_s'], r['p95_s']))
+
+    # save results with environment for comparison between versions
+    os.makedirs(args.output, exist_ok=True)
+    out_path = os.path.join(args.output, 'bench-{}.json'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(out_path, 'w') as out:
+        json.dump({'environment': environment(), 'files': len(all_paths),
+                   'results': results}, out, indent=2)
+    print('results saved to {}'.format(out_path))
+
+    slow = over_budget(results)
+    if slow:
+        sys.exit('import time budget of {} s exceeded: {}'.format(
+            IMPORT_BUDGET_S, ', '.join(slow)))
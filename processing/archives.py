@@ -0,0 +1,120 @@
+"""
+This script reads lab reports straight from .zip, .tar, .tar.gz and .tgz
+archives without extracting them to disk. Members are read one at a time in
+archive order, compressed tar archives are streamed, and every member is
+named <archive path>/<member name> so its file name is recognised like the
+name of an extracted report.
+"""
+
+import logging
+import tarfile
+import zipfile
+import zlib
+import metrics
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# errors of archives and members that cannot be read: broken or truncated
+# files, corrupt compressed data, unsupported compression methods such as
+# Deflate64 (NotImplementedError) and encrypted zip members (RuntimeError)
+READ_ERRORS = (OSError, EOFError, RuntimeError, NotImplementedError,
+               zlib.error, zipfile.BadZipFile, tarfile.TarError)
+
+# number of report members read from every archive, None if the archive
+# could not be read to the end. Used to check that all reports of an
+# archive were inserted before it is recorded as ingested.
+member_counts = {}
+
+
+def is_archive(filename):
+    """Return True if file name has an archive suffix"""
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def source_of(path):
+    """Return path of the archive of an archive member, path otherwise"""
+    lower = path.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        index = lower.find(suffix + '/')
+        if index >= 0:
+            return path[:index + len(suffix)]
+    return path
+
+
+def zip_members(archive):
+    """Yield (member name, function reading content) of zip archive"""
+    with zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            if not info.is_dir():
+                yield info.filename, lambda info=info: zip_file.read(info)
+
+
+def tar_members(archive):
+    """Yield (member name, function reading content) of tar archive,
+       compressed archives are decompressed while they are streamed"""
+    with tarfile.open(archive, 'r|*') as tar_file:
+        for info in tar_file:
+            if info.isfile():
+                yield info.name, lambda info=info: \
+                    tar_file.extractfile(info).read()
+
+
+def members(archive, match):
+    """Yield (member path, report type, content) of the members of archive
+       whose file name match(name) returns a report type for. Other members
+       are skipped without reading them, so are members that cannot be
+       read. The archive is not recorded as ingested then."""
+
+    count = 0
+    skipped = 0
+    read_members = zip_members if archive.lower().endswith('.zip') \
+        else tar_members
+    try:
+        for name, read in read_members(archive):
+            report_type = match(name.rsplit('/', 1)[-1])
+            if not report_type:
+                continue
+            try:
+                with metrics.timer('archive', report_type):
+                    content = read()
+            except READ_ERRORS as member_error:
+                skipped += 1
+                logging.error('cannot read {} of archive {}: {}'.format(
+                    name, archive, member_error))
+                metrics.failure('archive', member_error, report_type)
+                continue
+            count += 1
+            yield archive + '/' + name, report_type, content
+        member_counts[archive] = None if skipped else count
+    except READ_ERRORS as archive_error:
+        member_counts[archive] = None
+        logging.error('cannot read archive {}: {}'.format(archive,
+                                                          archive_error))
+        metrics.failure('archive', archive_error)
+    logging.info('{} reports read from archive {}'.format(count, archive))
+
+
+def discard(paths):
+    """Drop the member counts of the archives of paths, used when ingested
+       archives are not recorded"""
+    for path in paths:
+        member_counts.pop(path, None)
+
+
+def ingested_sources(inserted_paths):
+    """Return the report files of inserted paths and the archives read
+       since the last call whose report members were all inserted"""
+
+    sources = []
+    inserted_members = {}
+    for path in inserted_paths:
+        source = source_of(path)
+        if source == path:
+            sources.append(path)
+        else:
+            inserted_members[source] = inserted_members.get(source, 0) + 1
+    for archive in list(member_counts):
+        count = member_counts.pop(archive)
+        if count is not None and inserted_members.get(archive, 0) == count:
+            sources.append(archive)
+    return sources
@@ -0,0 +1,141 @@
+"""
+This script contains the record batch used by the bulk and parallel loads
+to buffer parsed reports before they are inserted. Values are appended
+column by column into typed buffers in the column order of the report
+table: arrays of doubles for float columns, arrays of bytes for boolean
+columns and lists for text columns. A batch is turned into a DataFrame
+column by column without building a DataFrame per report.
+"""
+
+import logging
+import sys
+from array import array
+import numpy as np
+import pandas as pd
+import schema
+
+# byte stored for a missing boolean value
+BOOL_NULL = -1
+
+
+def to_float(value):
+    """Convert value of float column, missing values are NaN"""
+    if value is None:
+        return float('nan')
+    return float(value)
+
+
+def to_bool(value):
+    """Convert value of boolean column to byte, missing values are -1"""
+    if value is True or value == 'True':
+        return 1
+    if value is False or value == 'False':
+        return 0
+    if value is None or value != value:
+        return BOOL_NULL
+    raise ValueError('not a boolean value: {!r}'.format(value))
+
+
+def to_text(value):
+    """Convert value of text column, repeated values such as units share
+       one string object"""
+    if value is None or value != value:
+        return None
+    return sys.intern(str(value))
+
+
+class RecordBatch:
+    """Parsed reports of one report type buffered in typed columns.
+       Every appended record can carry a key, such as its file path, to
+       map inserted rows back to their source."""
+
+    def __init__(self, report_type):
+        self.report_type = report_type
+        spec = schema.FIELD_SPECS[report_type]
+        self.columns = list(spec)
+        self.converters = []
+        self.buffers = {}
+        for name, (field_type, _) in spec.items():
+            if field_type == 'float':
+                self.converters.append(to_float)
+                self.buffers[name] = array('d')
+            elif field_type == 'bool':
+                self.converters.append(to_bool)
+                self.buffers[name] = array('b')
+            else:
+                self.converters.append(to_text)
+                self.buffers[name] = []
+        self.keys = []
+        self.info = []
+        self.ignored_fields = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, record, key=None, info=None):
+        """Append record dict, raises ValueError if a value does not fit
+           its column, the batch is unchanged then. info is kept with the
+           record for the ingest event log."""
+
+        values = [convert(record.get(name))
+                  for name, convert in zip(self.columns, self.converters)]
+        for name, value in zip(self.columns, values):
+            self.buffers[name].append(value)
+        self.keys.append(key)
+        self.info.append(info)
+        if len(record) > len(self.columns):
+            self.ignored_fields.update(set(record) - set(self.columns))
+
+    def extend(self, other):
+        """Append all records of another batch of the same report type"""
+        for name in self.columns:
+            self.buffers[name].extend(other.buffers[name])
+        self.keys.extend(other.keys)
+        self.info.extend(other.info)
+        self.ignored_fields.update(other.ignored_fields)
+
+    def column(self, name, start=0, stop=None):
+        """Return values of column as numpy array, float and boolean
+           columns are views of the buffers"""
+
+        buffer = self.buffers[name]
+        if isinstance(buffer, list):
+            return np.array(buffer[start:stop], dtype=object)
+        if buffer.typecode == 'd':
+            return np.frombuffer(buffer, dtype=np.float64)[start:stop]
+        values = np.frombuffer(buffer, dtype=np.int8)[start:stop]
+        if (values == BOOL_NULL).any():
+            return np.where(values == BOOL_NULL, None, values == 1)
+        return values == 1
+
+    def to_frame(self, start=0, stop=None):
+        """Return records start to stop as DataFrame in table column order"""
+        return pd.DataFrame({name: self.column(name, start, stop)
+                             for name in self.columns}, columns=self.columns)
+
+    def rows(self, start=0, stop=None):
+        """Yield (key, record dict) of records start to stop"""
+        columns = [self.column(name, start, stop).tolist()
+                   for name in self.columns]
+        for key, values in zip(self.keys[start:stop], zip(*columns)):
+            yield key, dict(zip(self.columns, values))
+
+    def frames(self, batch_size):
+        """Yield (start index, DataFrame) of batch_size records"""
+        if self.ignored_fields:
+            logging.warning('{} fields not in table ignored: {}'.format(
+                self.report_type, ', '.join(sorted(self.ignored_fields))))
+        for start in range(0, len(self), batch_size):
+            yield start, self.to_frame(start, start + batch_size)
+
+    def nbytes(self):
+        """Return approximate memory of buffered values in bytes"""
+        size = 0
+        for buffer in self.buffers.values():
+            if isinstance(buffer, list):
+                unique = {id(value): value for value in buffer}
+                size += sys.getsizeof(buffer) + sum(
+                    sys.getsizeof(value) for value in unique.values())
+            else:
+                size += buffer.itemsize * len(buffer)
+        return size
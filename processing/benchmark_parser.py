@@ -0,0 +1,83 @@
+"""
+This script benchmarks the single pass report parser process_report against
+the Pandas reference implementation process_report_pandas. Every report in
+the target directory is processed by both functions, outputs are checked to
+be identical and the average time per file is printed.
+
+usage: python benchmark_parser.py [folder] [repeat]
+"""
+
+import sys
+import time
+import warnings
+from os import listdir, path
+import processing as process
+
+
+def time_parser(parser, reports, repeat):
+    """Return average seconds per file of parser over all reports"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for filepath, report_type in reports:
+            parser(filepath, report_type)
+    return (time.perf_counter() - start) / (repeat * len(reports))
+
+
+def check_output(reports):
+    """Compare output of both parsers on every report.
+       Returns reports processed by both and list of reports where
+       the parsers differ, reports rejected by both are left out."""
+    valid, mismatches = [], []
+    for filepath, report_type in reports:
+        try:
+            df_ref = process.process_report_pandas(filepath, report_type)
+        except Exception:
+            df_ref = None
+        try:
+            df_fast = process.process_report(filepath, report_type)
+        except Exception:
+            df_fast = None
+
+        if df_ref is None and df_fast is None:
+            continue
+        if df_ref is None or df_fast is None \
+                or df_fast.to_csv() != df_ref.to_csv() \
+                or list(df_fast.dtypes) != list(df_ref.dtypes):
+            mismatches.append(filepath)
+        else:
+            valid.append((filepath, report_type))
+    return valid, mismatches
+
+
+if __name__ == '__main__':
+    process.setup_logging()
+    folder = sys.argv[1] if len(sys.argv) > 1 else process.config[
+        'FolderPath']['path']
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    # collect Hall and ICP reports of target directory
+    reports = []
+    for file in sorted(listdir(folder)):
+        report_type = process.get_reporttype(file)
+        if report_type:
+            reports.append((path.join(folder, file), report_type))
+    if not reports:
+        sys.exit('no Hall or ICP reports found in {}'.format(folder))
+
+    # DataFrame.append of the reference implementation is deprecated
+    warnings.simplefilter('ignore', FutureWarning)
+
+    reports, mismatches = check_output(reports)
+    for filepath in mismatches:
+        print('output differs for {}'.format(filepath))
+    if not reports:
+        sys.exit('no report could be processed')
+
+    t_ref = time_parser(process.process_report_pandas, reports, repeat)
+    t_fast = time_parser(process.process_report, reports, repeat)
+
+    print('reports: {}, identical output: {}'.format(
+        len(reports) + len(mismatches), not mismatches))
+    print('pandas pipeline: {:.3f} ms/file'.format(t_ref * 1000))
+    print('single pass:     {:.3f} ms/file'.format(t_fast * 1000))
+    print('speedup:         {:.1f}x'.format(t_ref / t_fast))
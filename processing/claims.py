@@ -0,0 +1,273 @@
+"""
+This script lets several ingest workers, on one or on different machines,
+share a report folder. Every worker registers the files it finds in the
+claims table of the database and then claims batches of pending files:
+
+    pending     found and not ingested yet, or changed since, or not
+                inserted because the database was unavailable
+    claimed     being ingested by worker until lease_until
+    done        ingested, or skipped as already ingested by the manifest
+    failed      not inserted, or claimed max_attempts times by workers that
+                stopped before they finished
+
+Files are claimed with UPDATE ... WHERE path IN (SELECT ... FOR UPDATE SKIP
+LOCKED), so concurrent workers never claim the same file and never wait for
+each other. A worker renews the leases of its claims in the background, the
+claims of a worker that crashed expire and are claimed by the next worker
+looking for files. Lease times are taken from the database clock, so the
+clocks of the worker machines do not matter.
+"""
+
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+from sqlalchemy import (Table, Column, String, BigInteger, Integer, DateTime,
+                        MetaData, and_, func, or_, select)
+from sqlalchemy.dialects import postgresql
+import processing as process
+import schema
+
+claims_enabled = process.config.getboolean('Claims', 'enabled',
+                                           fallback=False)
+lease_time = process.config.getfloat('Claims', 'lease', fallback=60.0)
+claim_size = process.config.getint('Claims', 'claim_size', fallback=100)
+max_attempts = process.config.getint('Claims', 'max_attempts', fallback=3)
+claims_table_name = process.config.get('PostgresTables', 'claims_table',
+                                       fallback='ingest_claims')
+
+# rows are registered per chunk to keep statements small
+REGISTER_CHUNK_SIZE = 1000
+
+meta = MetaData()
+claims_table = Table(
+    claims_table_name,
+    meta,
+    Column('path', String(length=500), primary_key=True, nullable=False),
+    Column('size', BigInteger),
+    Column('mtime_ns', BigInteger),
+    Column('state', String(length=10), nullable=False, index=True),
+    Column('worker', String(length=100)),
+    Column('lease_until', DateTime(timezone=True)),
+    Column('attempts', Integer, nullable=False),
+    )
+
+_table_ready = False
+_stop = threading.Event()
+_heartbeat = None
+
+
+def worker_id():
+    """Return name of this worker in the claims table: host and process"""
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def get_engine():
+    """Return shared engine, claims table is created on first use"""
+    global _table_ready
+    engine = process.get_engine()
+    if not _table_ready:
+        with schema.ddl_lock(engine):
+            meta.create_all(engine, tables=[claims_table])
+        _table_ready = True
+    return engine
+
+
+def register(paths):
+    """Add found files as pending claims. Files already registered with
+       the same size and modification time are unchanged, changed files are
+       pending again. paths can be os.DirEntry objects of a folder scan.
+       Returns number of new or changed files."""
+
+    rows = []
+    for item in paths:
+        path = os.fspath(item)
+        try:
+            stat = item.stat() if isinstance(item, os.DirEntry) \
+                else os.stat(path)
+        except OSError as stat_error:
+            logging.error('cannot read file {}: {}'.format(path, stat_error))
+            continue
+        rows.append({'path': path, 'size': stat.st_size,
+                     'mtime_ns': stat.st_mtime_ns, 'state': 'pending',
+                     'attempts': 0})
+
+    registered = 0
+    engine = get_engine()
+    for start in range(0, len(rows), REGISTER_CHUNK_SIZE):
+        stmt = postgresql.insert(claims_table).values(
+            rows[start:start + REGISTER_CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['path'],
+            set_={'size': stmt.excluded.size,
+                  'mtime_ns': stmt.excluded.mtime_ns,
+                  'state': 'pending', 'worker': None, 'lease_until': None,
+                  'attempts': 0},
+            where=or_(claims_table.c.size.is_distinct_from(stmt.excluded.size),
+                      claims_table.c.mtime_ns.is_distinct_from(
+                          stmt.excluded.mtime_ns)))
+        with engine.begin() as conn:
+            registered += conn.execute(stmt).rowcount
+    logging.info('claims: {} new or changed files of {} registered'.format(
+        registered, len(rows)))
+    return registered
+
+
+def claim(size=claim_size):
+    """Claim up to size pending files and files whose lease expired.
+       Returns list of claimed paths."""
+
+    table = claims_table
+    expired = and_(table.c.state == 'claimed',
+                   table.c.lease_until < func.now())
+    claimable = select([table.c.path]).where(
+        or_(table.c.state == 'pending',
+            and_(expired, table.c.attempts < max_attempts))
+        ).order_by(table.c.path).limit(size).with_for_update(skip_locked=True)
+
+    with get_engine().begin() as conn:
+
+        # files whose workers stopped max_attempts times are not retried
+        failed = conn.execute(table.update().where(
+            and_(expired, table.c.attempts >= max_attempts)).values(
+                state='failed', lease_until=None)).rowcount
+        if failed:
+            logging.error('claims: {} files failed after {} attempts'
+                          .format(failed, max_attempts))
+
+        paths = [row[0] for row in conn.execute(
+            table.update().where(table.c.path.in_(claimable)).values(
+                state='claimed', worker=worker_id(),
+                lease_until=func.now() + timedelta(seconds=lease_time),
+                attempts=table.c.attempts + 1).returning(table.c.path))]
+    if paths:
+        logging.info('claims: {} files claimed'.format(len(paths)))
+    return paths
+
+
+def renew():
+    """Extend the leases of all claims of this worker"""
+    table = claims_table
+    with get_engine().begin() as conn:
+        conn.execute(table.update().where(
+            and_(table.c.worker == worker_id(),
+                 table.c.state == 'claimed')).values(
+                     lease_until=func.now() + timedelta(seconds=lease_time)))
+
+
+def finish(paths, state):
+    """Set state of claims of this worker, claims that expired and were
+       taken over by another worker are left to it.
+       Returns number of updated claims."""
+
+    if not paths:
+        return 0
+    table = claims_table
+    with get_engine().begin() as conn:
+        updated = conn.execute(table.update().where(
+            and_(table.c.path.in_(paths), table.c.worker == worker_id(),
+                 table.c.state == 'claimed')).values(
+                     state=state, lease_until=None)).rowcount
+    if updated < len(paths):
+        logging.warning('claims: {} of {} files were taken over by other '
+                        'workers'.format(len(paths) - updated, len(paths)))
+    return updated
+
+
+def complete(paths, failed_paths, retry_paths=()):
+    """Mark claimed paths done, except failed_paths which are marked
+       failed and retried once the file changes. retry_paths, failed
+       because the database was unavailable, are pending again."""
+    failed = set(failed_paths)
+    retry = set(retry_paths)
+    finish([path for path in paths if path not in failed], 'done')
+    finish([path for path in paths if path in failed and path not in retry],
+           'failed')
+    release([path for path in paths if path in retry])
+
+
+def release(paths):
+    """Return claims of this worker to pending, used when ingest stopped
+       before the files were processed"""
+    finish(paths, 'pending')
+
+
+def claimed_elsewhere():
+    """Return number of files claimed by other workers"""
+    table = claims_table
+    with get_engine().connect() as conn:
+        return conn.execute(select([func.count()]).where(
+            and_(table.c.state == 'claimed',
+                 table.c.worker != worker_id()))).scalar()
+
+
+def run(ingest, wait=True):
+    """Claim files and process them with ingest(paths), which returns the
+       paths that were not ingested and of these the paths to retry because
+       the database was unavailable, until no file is left to claim. With
+       wait, files claimed by other workers are waited for, so the files of
+       a worker that crashed are taken over once their lease expired.
+       Files to retry are claimed again by the next run.
+       Returns number of files processed by this worker."""
+
+    processed = 0
+    while not _stop.is_set():
+        paths = claim()
+        if not paths:
+            if wait and claimed_elsewhere():
+                _stop.wait(min(lease_time / 4, 1.0))
+                continue
+            break
+        try:
+            failed, retry = ingest(paths)
+        except BaseException:
+            release(paths)
+            raise
+        complete(paths, failed, retry)
+        processed += len(paths) - len(retry)
+        if retry:
+            break
+    return processed
+
+
+def poll(ingest, stop, interval=None):
+    """Process claimable files now and every interval seconds until stop
+       is set, used by the watchdog to take over files of crashed workers"""
+    interval = interval or lease_time / 2
+    while True:
+        try:
+            run(ingest, wait=False)
+        except Exception as claim_error:
+            logging.error('claims: {}'.format(claim_error))
+        if stop.wait(interval):
+            return
+
+
+def _renew_leases():
+    """Renew leases every third of the lease time until stopped"""
+    while not _stop.wait(lease_time / 3):
+        try:
+            renew()
+        except Exception as renew_error:
+            logging.warning('claims: leases not renewed: {}'.format(
+                renew_error))
+
+
+def start():
+    """Start renewing the leases of this worker in a background thread"""
+    global _heartbeat
+    if not claims_enabled or _heartbeat is not None:
+        return
+    _stop.clear()
+    _heartbeat = threading.Thread(target=_renew_leases, daemon=True)
+    _heartbeat.start()
+
+
+def stop():
+    """Stop renewing leases"""
+    global _heartbeat
+    if _heartbeat is not None:
+        _stop.set()
+        _heartbeat.join()
+        _heartbeat = None
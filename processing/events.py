@@ -0,0 +1,223 @@
+"""
+This script writes the ingest event log, one JSON record per processed file
+with its name, report type, uid, size in bytes, duration of every ingest
+stage and outcome, and sets up the text log of the ingest scripts. Both logs
+are written from a queue by a background thread so the ingest never waits
+for the disk, the event log is rotated when it reaches max_mb.
+
+Run as a script it summarises throughput, failures and the slowest files of
+the events of the last minutes.
+
+usage: python events.py [--minutes 60] [--slowest 10] [--file FILE]
+"""
+
+import argparse
+import atexit
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import statistics
+import time
+from collections import Counter
+import settings
+
+# parse configuration file to get parameters
+config = settings.get()
+
+events_enabled = config.getboolean('EventLog', 'enabled', fallback=False)
+events_file = settings.resolve(config.get('EventLog', 'file',
+                                          fallback='ingest_events.jsonl'))
+events_max_mb = config.getfloat('EventLog', 'max_mb', fallback=50.0)
+events_backup_count = config.getint('EventLog', 'backup_count', fallback=5)
+
+LOG_FORMAT = '%(asctime)s  :%(levelname)s  :%(message)s'
+
+event_logger = logging.getLogger('ingest.events')
+event_logger.propagate = False
+event_logger.setLevel(logging.INFO)
+
+# (logger, queue handler, listener) of every log written from a queue
+_listeners = []
+
+
+def attach_queue(logger, handler):
+    """Send records of logger through a queue to handler, which is called
+       from a background thread"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, handler,
+                                              respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    _listeners.append((logger, queue_handler, listener))
+
+
+def setup_logging(log_filename, level=logging.INFO):
+    """Write text log to log_filename and, if enabled, the event log to
+       the events file, both from background threads. Like
+       logging.basicConfig nothing is changed if the root logger already
+       has handlers."""
+
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    root.setLevel(level)
+    file_handler = logging.FileHandler(log_filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    attach_queue(root, file_handler)
+
+    if events_enabled:
+        event_handler = logging.handlers.RotatingFileHandler(
+            events_file, maxBytes=int(events_max_mb * 1024 * 1024),
+            backupCount=events_backup_count, encoding='utf-8')
+        event_handler.setFormatter(logging.Formatter('%(message)s'))
+        attach_queue(event_logger, event_handler)
+
+
+def stop():
+    """Write queued records and stop the background threads"""
+    while _listeners:
+        logger, queue_handler, listener = _listeners.pop()
+        listener.stop()
+        logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            handler.close()
+
+
+def write_directly():
+    """Forked worker processes have no listener threads, they write their
+       records with the handlers directly"""
+    while _listeners:
+        logger, queue_handler, listener = _listeners.pop()
+        logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            logger.addHandler(handler)
+
+
+atexit.register(stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=write_directly)
+
+
+def file_event(path, report_type, outcome, uid=None, info=None, error=None,
+               **fields):
+    """Log event of one processed file. outcome is inserted, failed or
+       spooled, info holds the file size in bytes and the durations of
+       the ingest stages in seconds."""
+
+    if not events_enabled:
+        return
+    info = info or {}
+    event = {'time': round(time.time(), 3),
+             'file': os.path.basename(path or ''),
+             'report_type': report_type,
+             'uid': uid,
+             'bytes': info.get('bytes'),
+             'stages': {stage: round(seconds, 6) for stage, seconds
+                        in info.get('stages', {}).items()},
+             'outcome': outcome}
+    if isinstance(error, Exception):
+        error = '{}: {}'.format(type(error).__name__, error)
+    if error is not None:
+        event['error'] = str(error)
+    event.update(fields)
+    event_logger.info(json.dumps(event))
+
+
+def rotated_files(path):
+    """Return rotated files path.N to path.1 of log path, oldest first"""
+    numbered = []
+    for log_path in glob.glob(glob.escape(path) + '.*'):
+        suffix = log_path[len(path) + 1:]
+        if suffix.isdigit():
+            numbered.append((int(suffix), log_path))
+    return [log_path for _, log_path in sorted(numbered, reverse=True)]
+
+
+def read_events(path=None, since=None):
+    """Read events of the event log and its rotated files, optionally
+       only events logged after since (epoch seconds)"""
+
+    path = path or events_file
+    events = []
+    for log_path in rotated_files(path) + [path]:
+        if not os.path.exists(log_path):
+            continue
+        with open(log_path, encoding='utf-8') as log:
+            for line in log:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if since is None or event.get('time', 0) >= since:
+                    events.append(event)
+    return events
+
+
+def summarize(events, slowest=10):
+    """Return summary of events: throughput, outcomes, failures by error,
+       stage durations and the slowest files"""
+
+    if not events:
+        return {'files': 0}
+    times = [event['time'] for event in events]
+    span = max(max(times) - min(times), 1e-9)
+    stages = {}
+    for event in events:
+        for stage, seconds in event.get('stages', {}).items():
+            stages.setdefault(stage, []).append(seconds)
+    total_bytes = sum(event.get('bytes') or 0 for event in events)
+
+    def duration(event):
+        return sum(event.get('stages', {}).values())
+
+    return {
+        'files': len(events),
+        'span_s': span,
+        'files_per_s': len(events) / span,
+        'mb_per_s': total_bytes / span / 1e6,
+        'outcomes': Counter(event['outcome'] for event in events),
+        'errors': Counter(event['error'] for event in events
+                          if event.get('error')),
+        'stages': {stage: (statistics.mean(values),
+                           sorted(values)[int(0.95 * (len(values) - 1))])
+                   for stage, values in sorted(stages.items())},
+        'slowest': sorted(events, key=duration, reverse=True)[:slowest],
+    }
+
+
+def print_summary(summary):
+    """Print summary of summarize()"""
+    if not summary['files']:
+        print('no events in time window')
+        return
+    print('{} files in {:.1f} s, {:.1f} files/s, {:.2f} MB/s'.format(
+        summary['files'], summary['span_s'], summary['files_per_s'],
+        summary['mb_per_s']))
+    print('outcomes: ' + ', '.join('{} {}'.format(outcome, n) for outcome, n
+                                   in summary['outcomes'].most_common()))
+    for error, n in summary['errors'].most_common(10):
+        print('  {:>6}  {}'.format(n, error))
+    print('stage            mean s       p95 s')
+    for stage, (mean, p95) in summary['stages'].items():
+        print('{:<14} {:>8.6f}  {:>10.6f}'.format(stage, mean, p95))
+    print('slowest files:')
+    for event in summary['slowest']:
+        print('  {:>10.6f} s  {:<10} {}  {}'.format(
+            sum(event.get('stages', {}).values()), event['outcome'],
+            event['file'], event.get('error', '')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--minutes', type=float, default=60,
+                        help='time window of events, 0 reads all events')
+    parser.add_argument('--slowest', type=int, default=10)
+    parser.add_argument('--file', default=events_file)
+    args = parser.parse_args()
+
+    since = time.time() - 60 * args.minutes if args.minutes else None
+    print_summary(summarize(read_events(args.file, since), args.slowest))
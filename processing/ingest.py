@@ -0,0 +1,74 @@
+"""
+This script is the command line entry point of the ingest scripts and can be
+started from any directory:
+
+    startup [FOLDER]    ingest all new reports of the folder and exit
+    watch [FOLDER]      insert new reports of the folder until interrupted
+    query               summarise the ingest event log
+
+FOLDER defaults to [FolderPath] path of the configuration file, --config
+reads another file than config.ini. The configuration file is read before
+any other script is imported and every command only imports the modules it
+needs, so a restarted watchdog watches the folder within a fraction of a
+second.
+
+usage: python ingest.py [--config FILE] {startup,watch,query} ...
+"""
+
+import argparse
+import os
+import time
+import settings
+
+
+def run_startup(args):
+    """Ingest all new reports of folder"""
+    import startup
+    startup.main(args.folder or startup.folder_path)
+
+
+def run_watch(args):
+    """Insert new reports of folder until interrupted"""
+    import watchdog_script
+    watchdog_script.main(args.folder or watchdog_script.folder_path)
+
+
+def run_query(args):
+    """Print summary of the ingest events of the last minutes"""
+    import events
+    since = time.time() - 60 * args.minutes if args.minutes else None
+    events.print_summary(events.summarize(
+        events.read_events(args.file, since), args.slowest))
+
+
+def main(argv=None):
+    """Parse command line, read configuration file and run command"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--config', help='configuration file, default {}'
+                        .format(settings.DEFAULT_PATH))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('startup', help='ingest all new reports')
+    command.add_argument('folder', nargs='?', type=os.path.abspath)
+    command.set_defaults(run=run_startup)
+
+    command = commands.add_parser('watch', help='insert new reports until '
+                                  'interrupted')
+    command.add_argument('folder', nargs='?', type=os.path.abspath)
+    command.set_defaults(run=run_watch)
+
+    command = commands.add_parser('query', help='summarise ingest events')
+    command.add_argument('--minutes', type=float, default=60,
+                         help='time window of events, 0 reads all events')
+    command.add_argument('--slowest', type=int, default=10)
+    command.add_argument('--file', type=os.path.abspath,
+                         help='event log, default [EventLog] file')
+    command.set_defaults(run=run_query)
+
+    args = parser.parse_args(argv)
+    settings.load(args.config)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+This script maintains the material lineage table, a denormalized table with
+one row per ball milling run that holds the material composition, the ball
+milling and hot press steps and the Hall and ICP reports of both output
+materials. Its columns are the columns of merge_tables in visualize/app.py
+(BM-, MT-, HP-, BM-HA-, BM-ICP-, HP-HA-, HP-ICP-), so the visualization reads
+one table instead of joining five.
+
+The table is rebuilt from scratch with rebuild(), run this script after the
+material procurement, ball milling or hot press tables change. Hall and ICP
+reports inserted by the ingest path are added with update_reports().
+
+usage: python lineage.py
+"""
+
+import logging
+import threading
+import settings
+from sqlalchemy import bindparam, inspect, text
+import schema
+
+# parse configuration file to get parameters
+config = settings.get()
+
+lineage_enabled = config.getboolean('Lineage', 'enabled', fallback=False)
+lineage_table = config.get('PostgresTables', 'lineage_table',
+                           fallback='material_lineage')
+hall_table = config.get('PostgresTables', 'hall_table',
+                        fallback='hall_measurement')
+icp_table = config.get('PostgresTables', 'icp_table',
+                       fallback='icp_measurement')
+
+# column prefixes of the lineage table reports of a type are merged into,
+# with the lineage column holding the material id of the report. Reports
+# of other types are not part of the lineage table.
+REPORT_PREFIXES = {
+    'HALL': [('BM-HA-', 'BM-output_material_uid'),
+             ('HP-HA-', 'HP-output_material_uid')],
+    'ICP': [('BM-ICP-', 'BM-output_material_uid'),
+            ('HP-ICP-', 'HP-output_material_uid')],
+    }
+
+# indexed lineage columns: lookups by ball milling id and report updates
+INDEXED_COLUMNS = ['BM-uid', 'BM-output_material_uid', 'HP-output_material_uid']
+
+# lineage columns, read once per process after the table was built
+_columns = None
+_columns_lock = threading.Lock()
+
+
+def lineage_select(engine):
+    """Return SELECT statement and parameters joining all tables into the
+       columns of merge_tables"""
+
+    insp = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+
+    def columns(table, alias, prefix):
+        return ['{}.{} AS {}'.format(alias, quote(c['name']),
+                                     quote(prefix + c['name']))
+                for c in insp.get_columns(table)]
+
+    # materials are pivoted to one column per material name, sorted like
+    # the columns of DataFrame.pivot
+    with engine.connect() as conn:
+        names = sorted(row[0] for row in conn.execute(text(
+            'SELECT DISTINCT material_name FROM material_procurement')))
+    params = {'m{}'.format(i): name for i, name in enumerate(names)}
+    pivot = ['MAX(CASE WHEN material_name = :m{} THEN mass_fraction END) '
+             'AS {}'.format(i, quote('MT-' + name))
+             for i, name in enumerate(names)]
+
+    select = (columns('ball_milling', 'b', 'BM-')
+              + ['m.ball_milling_uid AS {}'.format(quote('MT-ball_milling_uid'))]
+              + ['m.{}'.format(quote('MT-' + name)) for name in names]
+              + columns('hot_press', 'h', 'HP-')
+              + columns(hall_table, 'bha', 'BM-HA-')
+              + columns(icp_table, 'bicp', 'BM-ICP-')
+              + columns(hall_table, 'hha', 'HP-HA-')
+              + columns(icp_table, 'hicp', 'HP-ICP-'))
+
+    sql = '''SELECT {select}
+        FROM ball_milling b
+        LEFT JOIN (SELECT ball_milling_uid{pivot}
+                   FROM material_procurement GROUP BY ball_milling_uid) m
+               ON m.ball_milling_uid = b.uid
+        LEFT JOIN hot_press h ON h.uid = b.hot_press_uid
+        LEFT JOIN {hall} bha ON bha.material_uid = b.output_material_uid
+        LEFT JOIN {icp} bicp ON bicp.material_uid = b.output_material_uid
+        LEFT JOIN {hall} hha ON hha.material_uid = h.output_material_uid
+        LEFT JOIN {icp} hicp ON hicp.material_uid = h.output_material_uid
+        '''.format(select=',\n            '.join(select),
+                   pivot=''.join(', ' + p for p in pivot),
+                   hall=quote(hall_table), icp=quote(icp_table))
+    return sql, params
+
+
+def rebuild(engine):
+    """Rebuild lineage table from all tables.
+       The new table is built next to the old one and swapped in one
+       transaction, readers see either the old or the new table."""
+
+    global _columns
+    quote = engine.dialect.identifier_preparer.quote
+    sql, params = lineage_select(engine)
+    new_table = lineage_table + '_new'
+
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS {}'.format(quote(new_table))))
+        conn.execute(text('CREATE TABLE {} AS {}'.format(quote(new_table),
+                                                          sql)), params)
+        conn.execute(text('DROP TABLE IF EXISTS {}'.format(
+            quote(lineage_table))))
+        conn.execute(text('ALTER TABLE {} RENAME TO {}'.format(
+            quote(new_table), quote(lineage_table))))
+        for column in INDEXED_COLUMNS:
+            conn.execute(text('CREATE INDEX {} ON {} ({})'.format(
+                quote('ix_{}_{}'.format(lineage_table, column)),
+                quote(lineage_table), quote(column))))
+
+    with _columns_lock:
+        _columns = None
+    logging.info('lineage table {} rebuilt'.format(lineage_table))
+
+
+def get_columns(engine):
+    """Return lineage table columns, empty list if table does not exist.
+       Only the columns of an existing table are kept, so a table built
+       after the first report was inserted is found."""
+    global _columns
+    with _columns_lock:
+        if _columns is None:
+            if not engine.has_table(lineage_table):
+                return []
+            _columns = [c['name'] for c in
+                        inspect(engine).get_columns(lineage_table)]
+        return _columns
+
+
+def update_reports(engine, report_type, uids):
+    """Copy inserted Hall or ICP reports into the lineage rows of their
+       material, matched on the ball milling or hot press output material"""
+
+    if report_type not in REPORT_PREFIXES:
+        return
+    columns = get_columns(engine)
+    if not columns or not uids:
+        return
+    quote = engine.dialect.identifier_preparer.quote
+    table = schema.REPORT_TABLES[report_type].name
+    uid = report_type.lower() + '_uid'
+
+    with engine.begin() as conn:
+        for prefix, material_column in REPORT_PREFIXES[report_type]:
+            assignments = ', '.join(
+                '{} = r.{}'.format(quote(c), quote(c[len(prefix):]))
+                for c in columns if c.startswith(prefix))
+            stmt = text('UPDATE {lineage} SET {assignments} FROM {table} r '
+                        'WHERE r.{uid} IN :uids AND {lineage}.{material} = '
+                        'r.material_uid'.format(
+                            lineage=quote(lineage_table),
+                            assignments=assignments, table=quote(table),
+                            uid=quote(uid), material=quote(material_column)))
+            conn.execute(stmt.bindparams(bindparam('uids', expanding=True)),
+                         {'uids': list(uids)})
+
+
+if __name__ == '__main__':
+    import processing as process
+    process.setup_logging()
+
+    # report tables may not exist before the first report is inserted
+    for report_type in REPORT_PREFIXES:
+        process.prepare_table(report_type)
+    rebuild(process.get_engine())
+    print('lineage table {} rebuilt'.format(lineage_table))
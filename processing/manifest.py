@@ -0,0 +1,178 @@
+"""
+This script keeps a manifest of ingested lab report files in the database.
+Every file is recorded with its path, size, modification time and content
+hash so startup only processes files that are new or changed since the last
+run and skips byte-identical copies of reports stored under other names.
+"""
+
+import hashlib
+import logging
+import os
+from sqlalchemy import Table, Column, String, BigInteger, MetaData, select
+import processing as process
+import archives
+import schema
+
+manifest_table_name = process.config.get('PostgresTables', 'manifest_table',
+                                         fallback='ingest_manifest')
+
+# rows are inserted per chunk to keep statements small
+RECORD_CHUNK_SIZE = 1000
+
+# files are hashed in blocks so memory does not grow with the file size
+HASH_BLOCK_SIZE = 1 << 20
+
+meta = MetaData()
+manifest_table = Table(
+    manifest_table_name,
+    meta,
+    Column('path', String(length=500), primary_key=True, nullable=False),
+    Column('size', BigInteger),
+    Column('mtime_ns', BigInteger),
+    Column('sha256', String(length=64), index=True),
+    Column('duplicate_of', String(length=500)),
+    )
+
+
+def file_hash(path):
+    """Return sha256 hex digest of file content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as report:
+        for block in iter(lambda: report.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def create_table(engine):
+    """Create manifest table if it does not exist"""
+    with schema.ddl_lock(engine):
+        meta.create_all(engine, tables=[manifest_table])
+
+
+def load_manifest(engine):
+    """Read manifest from database.
+       Returns dict of path to (size, mtime_ns) and dict of content hash
+       to path of the ingested original."""
+
+    create_table(engine)
+    files, hashes = {}, {}
+    with engine.connect() as conn:
+        for row in conn.execute(select([manifest_table])):
+            files[row['path']] = (row['size'], row['mtime_ns'])
+            if not row['duplicate_of']:
+                hashes[row['sha256']] = row['path']
+    return files, hashes
+
+
+def changed_files(paths, manifest=None):
+    """Compare files against the manifest.
+       Files with unchanged size and modification time are skipped without
+       reading them, new or changed files are hashed and skipped if their
+       content was already ingested under another name.
+       paths can be os.DirEntry objects of a folder scan, their cached stat
+       is used. manifest is (files, hashes) of load_manifest, it is read
+       from the database if None.
+       Returns dict of path to manifest entry of the files to process and
+       list of manifest entries of duplicates found in this run."""
+
+    files, hashes = manifest or load_manifest(process.get_engine())
+    entries, duplicates = {}, []
+    skipped = 0
+    seen = {}
+
+    for item in paths:
+        path = os.fspath(item)
+        try:
+            if isinstance(item, os.DirEntry):
+                stat = item.stat()
+            else:
+                stat = os.stat(path)
+        except OSError as stat_error:
+            logging.error('cannot read file {}: {}'.format(path, stat_error))
+            continue
+
+        # unchanged files are skipped based on stat information only
+        if files.get(path) == (stat.st_size, stat.st_mtime_ns):
+            skipped += 1
+            continue
+
+        entry = {'path': path, 'size': stat.st_size,
+                 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(path),
+                 'duplicate_of': None}
+
+        # same content already ingested or queued under another name
+        original = hashes.get(entry['sha256']) or seen.get(entry['sha256'])
+        if original and original != path:
+            entry['duplicate_of'] = original
+            duplicates.append(entry)
+            logging.info('{} skipped, same content as {}'.format(
+                os.path.basename(path), os.path.basename(original)))
+            continue
+
+        seen[entry['sha256']] = path
+        entries[path] = entry
+
+    logging.info('manifest: {} new or changed files, {} unchanged, {} '
+                 'duplicates'.format(len(entries), skipped, len(duplicates)))
+    return entries, duplicates
+
+
+def record_files(entries):
+    """Add or replace manifest entries of ingested files"""
+
+    entries = list(entries)
+    engine = process.get_engine()
+    for start in range(0, len(entries), RECORD_CHUNK_SIZE):
+        chunk = entries[start:start + RECORD_CHUNK_SIZE]
+
+        # delete old entries of changed files and insert new ones at once
+        with engine.begin() as conn:
+            conn.execute(manifest_table.delete().where(
+                manifest_table.c.path.in_([e['path'] for e in chunk])))
+            conn.execute(manifest_table.insert(), chunk)
+
+
+def record_ingested(entries, duplicates, inserted_paths, manifest=None):
+    """Record inserted files and the duplicates of inserted or already
+       ingested files in the manifest. Recorded files are added to the
+       (files, hashes) manifest of load_manifest if given, so files
+       compared later in the same run are checked against them."""
+
+    inserted = set(inserted_paths)
+    ingested = [entries[path] for path in inserted if path in entries]
+    ingested.extend(entry for entry in duplicates
+                    if entry['duplicate_of'] not in entries
+                    or entry['duplicate_of'] in inserted)
+    record_files(ingested)
+    logging.info('manifest: recorded {} files'.format(len(ingested)))
+
+    if manifest is not None:
+        files, hashes = manifest
+        for entry in ingested:
+            files[entry['path']] = (entry['size'], entry['mtime_ns'])
+            if not entry['duplicate_of']:
+                hashes[entry['sha256']] = entry['path']
+
+
+def record_replayed(paths):
+    """Record report files whose spooled reports were inserted. Entries
+       are taken from the files as they are now. Reports of archives are
+       left out, an archive is only recorded when all of its reports were
+       inserted in one run."""
+
+    entries = []
+    for path in sorted(set(paths)):
+        if archives.source_of(path) != path:
+            continue
+        try:
+            stat = os.stat(path)
+            entries.append({'path': path, 'size': stat.st_size,
+                            'mtime_ns': stat.st_mtime_ns,
+                            'sha256': file_hash(path), 'duplicate_of': None})
+        except OSError as stat_error:
+            logging.warning('{} not recorded in manifest: {}'.format(
+                path, stat_error))
+    if entries:
+        create_table(process.get_engine())
+        record_files(entries)
+    logging.info('manifest: recorded {} replayed files'.format(len(entries)))
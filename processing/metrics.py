@@ -0,0 +1,236 @@
+"""
+This script collects ingest metrics: latency histograms of every ingest stage,
+counters of processed files, inserted records and failures, and queue depths.
+Metrics are rendered in Prometheus text format and served on a local HTTP
+/metrics endpoint or written to a file periodically.
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+import settings
+
+# parse configuration file
+config = settings.get()
+
+# http_port 0 disables the endpoint, an empty file disables the metrics file
+metrics_enabled = config.getboolean('Metrics', 'enabled', fallback=False)
+metrics_host = config.get('Metrics', 'http_host', fallback='127.0.0.1')
+metrics_port = config.getint('Metrics', 'http_port', fallback=0)
+metrics_file = settings.resolve(config.get('Metrics', 'file', fallback=''))
+metrics_interval = config.getfloat('Metrics', 'write_interval', fallback=15.0)
+
+# histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_start_time = time.time()
+
+# (stage, report_type) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+# (name, labels tuple) -> value
+_counters = {}
+_gauges = {}
+
+
+def observe(stage, seconds, report_type=''):
+    """Record duration of an ingest stage"""
+    with _lock:
+        hist = _histograms.get((stage, report_type))
+        if hist is None:
+            hist = _histograms[(stage, report_type)] = \
+                [0] * (len(BUCKETS) + 1) + [0.0]
+        hist[bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[-1] += seconds
+
+
+@contextmanager
+def timer(stage, report_type='', durations=None):
+    """Time the enclosed block as an ingest stage, the duration is also
+       stored under stage in the durations dict if one is given"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe(stage, seconds, report_type)
+        if durations is not None:
+            durations[stage] = seconds
+
+
+def count(name, value=1, **labels):
+    """Increase counter by value"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def failure(stage, error, report_type=''):
+    """Count failed file or batch by stage and exception type"""
+    count('ingest_failures_total', stage=stage, report_type=report_type,
+          error=type(error).__name__)
+
+
+def set_gauge(name, value, **labels):
+    """Set gauge to value"""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+def snapshot():
+    """Return and reset metrics collected in this process.
+       Used by worker processes to hand their metrics to the writer."""
+    with _lock:
+        data = (dict(_histograms), dict(_counters))
+        _histograms.clear()
+        _counters.clear()
+    return data
+
+
+def merge(data):
+    """Add metrics snapshot of another process"""
+    histograms, counters = data
+    with _lock:
+        for key, hist in histograms.items():
+            own = _histograms.setdefault(key, [0] * len(hist[:-1]) + [0.0])
+            for i, value in enumerate(hist):
+                own[i] += value
+        for key, value in counters.items():
+            _counters[key] = _counters.get(key, 0) + value
+
+
+def _reset_after_fork():
+    """Start a forked worker process with empty metrics and a new lock. The
+       worker hands its own metrics to the parent with snapshot(), metrics
+       inherited from the parent would be counted twice, and the lock may
+       have been held by another thread of the parent at the fork."""
+    global _lock
+    _lock = threading.Lock()
+    _histograms.clear()
+    _counters.clear()
+    _gauges.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _labels(pairs):
+    """Format label pairs in Prometheus text format"""
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in pairs) + '}'
+
+
+def render():
+    """Return all metrics in Prometheus text format"""
+    lines = []
+    with _lock:
+        lines.append('# TYPE ingest_stage_seconds histogram')
+        for (stage, report_type), hist in sorted(_histograms.items()):
+            labels = [('stage', stage), ('report_type', report_type)]
+            cumulative = 0
+            for bound, value in zip(BUCKETS + ('+Inf',), hist[:-1]):
+                cumulative += value
+                lines.append('ingest_stage_seconds_bucket{} {}'.format(
+                    _labels(labels + [('le', bound)]), cumulative))
+            lines.append('ingest_stage_seconds_sum{} {}'.format(
+                _labels(labels), hist[-1]))
+            lines.append('ingest_stage_seconds_count{} {}'.format(
+                _labels(labels), cumulative))
+
+        for name in sorted({key[0] for key in _counters}):
+            lines.append('# TYPE {} counter'.format(name))
+            for (key_name, labels), value in sorted(_counters.items()):
+                if key_name == name:
+                    lines.append('{}{} {}'.format(name, _labels(labels),
+                                                  value))
+
+        # average file rate since the process started
+        files = sum(value for (name, _), value in _counters.items()
+                    if name == 'ingest_files_total')
+        gauges = dict(_gauges)
+        gauges[('ingest_files_per_second', ())] = \
+            files / max(time.time() - _start_time, 1e-9)
+        for name in sorted({key[0] for key in gauges}):
+            lines.append('# TYPE {} gauge'.format(name))
+            for (key_name, labels), value in sorted(gauges.items()):
+                if key_name == name:
+                    lines.append('{}{} {}'.format(name, _labels(labels),
+                                                  value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(path=None):
+    """Write metrics to file, replaced atomically for scrapers"""
+    path = path or metrics_file
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as out:
+        out.write(render())
+    os.replace(path + '.tmp', path)
+
+
+def metrics_server(host, port):
+    """Return HTTP server of the /metrics endpoint, http.server is only
+       imported when the endpoint is enabled"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            """Serve metrics on /metrics"""
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            """Do not print every scrape to stderr"""
+
+    return ThreadingHTTPServer((host, port), MetricsHandler)
+
+
+_stop = threading.Event()
+_threads = []
+
+
+def _file_writer():
+    """Write metrics file every metrics_interval seconds"""
+    while not _stop.wait(metrics_interval):
+        try:
+            write_file()
+        except OSError as write_error:
+            logging.error('metrics file not written: {}'.format(write_error))
+
+
+def start():
+    """Start HTTP endpoint and file writer configured in config.ini"""
+    if not metrics_enabled or _threads:
+        return
+    if metrics_port:
+        server = metrics_server(metrics_host, metrics_port)
+        _threads.append(threading.Thread(target=server.serve_forever,
+                                         daemon=True))
+        logging.info('metrics served on http://{}:{}/metrics'.format(
+            metrics_host, metrics_port))
+    if metrics_file:
+        _threads.append(threading.Thread(target=_file_writer, daemon=True))
+    for thread in _threads:
+        thread.start()
+
+
+def stop():
+    """Stop file writer and write final metrics"""
+    if not metrics_enabled:
+        return
+    _stop.set()
+    write_file()
@@ -5,36 +5,134 @@ to database.
 @author: Anvitha Kandiraju
 """
 
-import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy import Table, Column, Float, String, MetaData, Boolean
-import fnmatch
 import logging
-import configparser
+import threading
+import csv
+import os
+from itertools import islice
+from io import StringIO
 
-# parse configuration file to get parameters
-config = configparser.ConfigParser()
-config.sections()
-config.read('../config.ini')
+# the configuration file is read by load_settings when a setting is first
+# used. pandas, SQLAlchemy, the table definitions and the metrics, event
+# log, archive and spool modules are imported by the functions using them,
+# so importing this module stays fast.
+SETTING_NAMES = ('config', 'postgresql_dbname', 'postgresql_host',
+                 'postgresql_port', 'postgresql_user', 'postgresql_pw',
+                 'log_filename', 'postgresql_hall_table',
+                 'postgresql_icp_table', 'bulk_batch_size',
+                 'bulk_insert_method', 'on_conflict', 'parallel_workers',
+                 'parallel_chunk_size', 'parallel_queue_size', 'pool_size',
+                 'pool_max_overflow', 'pool_timeout', 'pool_recycle',
+                 'pool_pre_ping', 'manifest_enabled', 'cache_notify')
+_settings_loaded = False
 
-postgresql_dbname = config['PostgresDB']['db_name']
-postgresql_host = config['PostgresDB']['host']
-postgresql_port = config['PostgresDB']['port']
-postgresql_user = config['PostgresDB']['user']
-postgresql_pw = config['PostgresDB']['pw']
 
-log_filename = config['logfile']['log_filename']
-postgresql_hall_table = config['PostgresTables']['hall_table']
-postgresql_icp_table = config['PostgresTables']['icp_table']
+def load_settings():
+    """Read the settings of this module from the configuration file once,
+       they are module variables afterwards"""
+    global _settings_loaded, config, log_filename
+    global postgresql_dbname, postgresql_host, postgresql_port
+    global postgresql_user, postgresql_pw
+    global postgresql_hall_table, postgresql_icp_table
+    global bulk_batch_size, bulk_insert_method, on_conflict
+    global parallel_workers, parallel_chunk_size, parallel_queue_size
+    global pool_size, pool_max_overflow, pool_timeout, pool_recycle
+    global pool_pre_ping, manifest_enabled, cache_notify
+    if _settings_loaded:
+        return
+    import settings
+    config = settings.get()
+
+    postgresql_dbname = config['PostgresDB']['db_name']
+    postgresql_host = config['PostgresDB']['host']
+    postgresql_port = config['PostgresDB']['port']
+    postgresql_user = config['PostgresDB']['user']
+    postgresql_pw = config['PostgresDB']['pw']
+
+    log_filename = settings.resolve(config['logfile']['log_filename'])
+    postgresql_hall_table = config['PostgresTables']['hall_table']
+    postgresql_icp_table = config['PostgresTables']['icp_table']
+
+    # bulk load settings used by startup, insert method can be multi or copy
+    bulk_batch_size = config.getint('BulkLoad', 'batch_size', fallback=1000)
+    bulk_insert_method = config.get('BulkLoad', 'insert_method',
+                                    fallback='multi')
+
+    # what to do when a report with an existing uid is inserted again:
+    # error fails the insert, skip keeps the stored record, update replaces
+    # it
+    on_conflict = config.get('Upsert', 'on_conflict', fallback='error')
+
+    # parallel load settings used by startup, 0 workers means one per cpu
+    # core, queue_size bounds the number of parsed chunks waiting for the
+    # writer
+    parallel_workers = config.getint('ParallelLoad', 'workers', fallback=0)
+    parallel_chunk_size = config.getint('ParallelLoad', 'chunk_size',
+                                        fallback=64)
+    parallel_queue_size = config.getint('ParallelLoad', 'queue_size',
+                                        fallback=0)
+
+    # connection pool settings for the shared database engine
+    pool_size = config.getint('EnginePool', 'pool_size', fallback=5)
+    pool_max_overflow = config.getint('EnginePool', 'max_overflow',
+                                      fallback=10)
+    pool_timeout = config.getfloat('EnginePool', 'pool_timeout',
+                                   fallback=30.0)
+    pool_recycle = config.getint('EnginePool', 'pool_recycle', fallback=1800)
+    pool_pre_ping = config.getboolean('EnginePool', 'pool_pre_ping',
+                                      fallback=True)
+
+    # manifest of ingested files, see manifest.py
+    manifest_enabled = config.getboolean('Manifest', 'enabled',
+                                         fallback=False)
+
+    # notify the visualization cache that reports were inserted
+    cache_notify = config.getboolean('Cache', 'notify', fallback=False)
+    _settings_loaded = True
+
+
+def __getattr__(name):
+    """Return setting name such as process.config, read on first use"""
+    if name in SETTING_NAMES:
+        load_settings()
+        return globals()[name]
+    raise AttributeError('module {} has no attribute {}'.format(__name__,
+                                                               name))
+
 
-# database connection
-engine_url = 'postgresql://{}:{}@{}:{}/{}'.format(postgresql_user,
-        postgresql_pw, postgresql_host, postgresql_port,
-        postgresql_dbname)
+NOTIFY_CHANNEL = 'lab_data_changed'
 
-# log file format
-logging.basicConfig(filename=log_filename, level=logging.INFO,
-                    format='%(asctime)s  :%(levelname)s  :%(message)s')
+# report type of file name prefix, reports are named <prefix>-<id>.txt.
+# Every report type needs a table in schema.REPORT_TABLES.
+REPORT_PREFIXES = {'Hall': 'HALL', 'ICP': 'ICP'}
+REPORT_SUFFIX = '.txt'
+
+# shared engine and report types whose table is known to exist,
+# both are set up once per process
+_engine = None
+_tables_ready = set()
+_engine_lock = threading.Lock()
+_tables_lock = threading.Lock()
+
+
+def setup_logging():
+    """Write log file and ingest event log from a background thread,
+       called once by the ingest scripts before they start"""
+    import events
+    load_settings()
+    events.setup_logging(log_filename)
+
+
+def preload():
+    """Import the modules used to parse and insert reports and create the
+       shared engine. The watchdog calls it in a background thread so it
+       watches the folder right away and the first report does not wait."""
+    import pandas  # noqa: F401
+    import batch  # noqa: F401
+    import lineage  # noqa: F401
+    import snapshot  # noqa: F401
+    from sqlalchemy.dialects import postgresql  # noqa: F401
+    get_engine()
 
 
 def clean_df(df, colnames=['ID', 'Value']):
@@ -47,6 +145,7 @@ def clean_df(df, colnames=['ID', 'Value']):
 
 def add_uniqueid(df, p_type,colnames=['ID', 'Value'],uid='material_uid'):
     """Add a unique ID for each entry based on Material ID"""
+    import pandas as pd
     uniqueid_name = p_type.lower() + '_uid'
     uniqueid_val = p_type + '-' + list(df.loc[df[colnames[0]] == uid,
             colnames[1]])[0]
@@ -59,6 +158,7 @@ def add_uniqueid(df, p_type,colnames=['ID', 'Value'],uid='material_uid'):
 def add_processtype(df,colnames=['ID', 'Value'],uid='material_uid'):
     """Add process type of sample into DataFrame 
         processes can be BM: Ball Milling or HP: Hot Press"""
+    import pandas as pd
 
     id_name = 'process_type'
     
@@ -76,6 +176,7 @@ def add_processtype(df,colnames=['ID', 'Value'],uid='material_uid'):
 
 def get_units(row_id, colnames=['ID', 'Value']):
     """Extract units from quantitative columns in DataFrame"""
+    import pandas as pd
     if '(' in row_id:
         row_id = row_id.split('(')
         units_id = row_id[0] + 'units'
@@ -95,27 +196,205 @@ def rename_row(row_id):
     return row_id
 
 
-def set_valuetype(dicts):
-    """Assign numerical and boolean data proper data type"""
-    for keys in dicts:
-        if dicts[keys] == 'True':
-            dicts[keys] = True
-        else:
-            try:
-                dicts[keys] = float(dicts[keys])
-            except:
-                pass
+def guess_valuetype(value):
+    """Convert value of a field without field spec: True and numbers are
+       converted, other values are kept as read"""
+    if value == 'True':
+        return True
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def is_number(value):
+    """Return True if text value is read as a number"""
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def to_bool(value):
+    """Convert value of boolean field, missing values stay NaN"""
+    if value == 'True':
+        return True
+    if value == 'False':
+        return False
+    if value != value:
+        return value
+    raise ValueError('not a boolean value: {!r}'.format(value))
+
+
+# converter of each field type, text values are kept as read
+TYPE_CONVERTERS = {'float': float, 'bool': to_bool, 'text': None}
+
+# converters of the fields of every report type, compiled once per report
+# type from the field specs in schema.py
+_field_converters = {}
+
+
+def field_converters(report_type):
+    """Return {field: converter} of report type, empty for other types"""
+    converters = _field_converters.get(report_type)
+    if converters is None:
+        import schema
+        spec = schema.FIELD_SPECS.get(report_type, {})
+        converters = {name: TYPE_CONVERTERS[field_type]
+                      for name, (field_type, _) in spec.items()}
+        _field_converters[report_type] = converters
+    return converters
+
+
+def set_valuetype(dicts, report_type=None):
+    """Assign numerical and boolean data proper data type.
+       Fields of the field spec of report type are converted to their
+       type, a value that does not fit raises ValueError. Other fields
+       are converted if they look like numbers or True."""
+    converters = field_converters(report_type)
+    for keys, value in dicts.items():
+        convert = converters.get(keys, guess_valuetype)
+        if convert is None:
+            continue
+        try:
+            dicts[keys] = convert(value)
+        except ValueError as type_error:
+            raise ValueError('{}: {}'.format(keys, type_error))
     return dicts
 
 
-def process_report(filepath, report_type, colnames=['ID', 'Value']):
+# strings read as missing values, same as default na_values of pandas
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN',
+             '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN',
+             'n/a', 'nan', 'null'}
+
+
+def parse_report(filepath, report_type, info=None, content=None):
+    """Read lab report file into a dict of processed values.
+       content is the report read from an archive, the file is read if
+       it is None.
+       Time of the read and transform stages is recorded in metrics and,
+       if an info dict is given, with the file size in info for the
+       ingest event log."""
+    import metrics
+
+    stages = None if info is None else info.setdefault('stages', {})
+    with metrics.timer('read', report_type, stages):
+        if content is None:
+            with open(filepath, 'rb') as report:
+                data = report.read()
+        else:
+            data = content
+        text = data.decode('utf-8')
+    if info is not None:
+        info['bytes'] = len(data)
+    with metrics.timer('transform', report_type, stages):
+        return parse_report_text(text, report_type)
+
+
+def parse_report_text(text, report_type, uid='material_uid'):
+    """Process lab report text line by line into a dict of values.
+       Produces the same record as the pandas pipeline of
+       process_report_pandas in a single pass over the text:
+       units columns, unique id, process type and typed values."""
+
+    data_dict = {}
+    units = []
+    material_id = None
+
+    report = StringIO(text, newline='')
+
+    # skip report header, then split ID and value on tabs
+    for _ in range(2):
+        report.readline()
+    reader = csv.reader(report, delimiter='\t', skipinitialspace=True)
+    for row in reader:
+
+        # ignore blank and whitespace only lines, a line with a tab
+        # is a row even if it holds only whitespace
+        if not row or (len(row) == 1 and not row[0].strip()):
+            continue
+
+        # rows with more than ID and value or without ID are invalid
+        if len(row) > 2:
+            raise ValueError('expected 2 fields in line {}, saw {}'.format(
+                reader.line_num + 2, len(row)))
+        if row[0] in NA_VALUES:
+            raise ValueError('row without ID in line {}'.format(
+                reader.line_num + 2))
+
+        # a missing value field is read as None, an empty or NA value
+        # as NaN
+        row_id = row[0].strip().replace(' ', '_')
+        if len(row) < 2:
+            value = None
+        elif row[1] in NA_VALUES:
+            value = float('nan')
+        else:
+            value = row[1].strip()
+
+        # collect units of quantitative rows, added after all rows
+        if '(' in row_id:
+            split_id = row_id.split('(')
+            units.append((split_id[0] + 'units', split_id[1][:-1]))
+
+        row_id = rename_row(row_id)
+        if row_id == uid and uid not in data_dict:
+            material_id = value
+        data_dict[row_id] = value
+
+    # pandas reads the values as numbers if none of them is text, the
+    # pandas pipeline cannot process such a report
+    if not any(isinstance(value, str) and not is_number(value)
+               for value in data_dict.values()):
+        raise ValueError('no text values found in report')
+
+    # a report without any units is not a valid lab report
+    if not units:
+        raise ValueError('no values with units found in report')
+    for units_id, units_val in units:
+        data_dict[rename_row(units_id)] = units_val
+
+    # add unique id and process type based on first material id
+    if uid not in data_dict:
+        raise ValueError('{} not found in report'.format(uid))
+    if not isinstance(material_id, str):
+        raise ValueError('{} has no value'.format(uid))
+    data_dict[report_type.lower() + '_uid'] = report_type + '-' + material_id
+    if 'BM' in material_id:
+        data_dict['process_type'] = 'Ball milling'
+    elif 'HP' in material_id:
+        data_dict['process_type'] = 'Hot process'
+    else:
+        data_dict['process_type'] = 'unknown'
+
+    # convert numerical values and boolean values to appropriate type
+    return set_valuetype(data_dict, report_type)
+
+
+def process_report(filepath, report_type, info=None, content=None):
     """Read data from text file and process it.
+    Returns a Pandas DF with one row built from parse_report"""
+    import metrics
+    import pandas as pd
+    data_dict = parse_report(filepath, report_type, info, content)
+    stages = None if info is None else info['stages']
+    with metrics.timer('dataframe', report_type, stages):
+        df_processed = pd.DataFrame.from_dict([data_dict])
+    metrics.count('ingest_files_total', report_type=report_type)
+    return df_processed
+
+
+def process_report_pandas(filepath, report_type, colnames=['ID', 'Value']):
+    """Read data from text file and process it with Pandas.
+    Reference implementation of process_report, kept for benchmarking.
     This function does the following: 
         1) read from text file into a Pandas DataFrame
         2) cleans and organizes the data in the DataFrame
         3) assigns a process type to the lab report
         4) returns the Pandas DF"""
-
+    import pandas as pd
 
    # read lab report to data frame
     df = pd.read_table(filepath, engine='python', skiprows=2,
@@ -143,160 +422,713 @@ def process_report(filepath, report_type, colnames=['ID', 'Value']):
    # change dataframe to dict for easy conversion of
    # numerical values and boolean values to appropriate type
     data_dict = df.set_index(colnames[0])[colnames[1]].to_dict()
-    set_valuetype(data_dict)
+    set_valuetype(data_dict, report_type)
 
    # obtain processed dataframe
     df_processed = pd.DataFrame.from_dict([data_dict])
     return df_processed
 
 
-def insert_hallreport(df_processed):
-    """Insert Hall lab report into database.
-       This function takes a prepared DF from process_report 
-       pertaining to a Hall measurement and inserts that into
-       a PostgreSQL table. """
+def create_hall_table(engine):
+    """Create Hall measurement table in database if it does not exist,
+       missing columns and indexes are added to an existing table"""
+    import schema
+    schema.create_tables(engine, [schema.hall_table])
 
-    # create connection to sql database
-    engine = create_engine(engine_url)
-
-    # if table doesnot exist create a new table
-    if not engine.has_table(postgresql_hall_table):
-        meta = MetaData()
-        Table(
-            postgresql_hall_table,
-            meta,
-            Column('hall_uid', String(length=20), primary_key=True,
-                   nullable=False),
-            Column('material_uid', String(length=20)),
-            Column('process_type', String(length=20)),
-            Column('measurement', String(length=10)),
-            Column('probe_resistance', Float),
-            Column('gas_flow_rate', Float),
-            Column('gas_type', String(length=10)),
-            Column('probe_material', String(length=10)),
-            Column('current', Float),
-            Column('field_strength', Float),
-            Column('sample_position', Float),
-            Column('magnet_reversal', Boolean),
-            Column('probe_resistance_units', String(length=10)),
-            Column('gas_flow_rate_units', String(length=10)),
-            Column('current_units', String(length=10)),
-            Column('field_strength_units', String(length=10)),
-            )
-        meta.create_all(engine)
-
-    # add processed dataframe to SQL database
-    df_processed.to_sql(postgresql_hall_table, engine,
-                        if_exists='append', index=False)
 
-    # after adding the record to database, return unique id for logging
-    hall_uid = df_processed.iloc[0]['hall_uid']
-    return hall_uid
+def create_icp_table(engine):
+    """Create ICP measurement table in database if it does not exist,
+       missing columns and indexes are added to an existing table"""
+    import schema
+    schema.create_tables(engine, [schema.icp_table])
 
 
-def insert_icpreport(df_processed):
-    """Insert ICP lab report into database."""
+def get_engine():
+    """Return shared SQLAlchemy engine, created on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            from sqlalchemy import create_engine
+            load_settings()
+            engine_url = 'postgresql://{}:{}@{}:{}/{}'.format(
+                postgresql_user, postgresql_pw, postgresql_host,
+                postgresql_port, postgresql_dbname)
+            _engine = create_engine(engine_url, pool_size=pool_size,
+                                    max_overflow=pool_max_overflow,
+                                    pool_timeout=pool_timeout,
+                                    pool_recycle=pool_recycle,
+                                    pool_pre_ping=pool_pre_ping)
+        return _engine
+
+
+def new_batches():
+    """Return an empty RecordBatch of every report type of
+       schema.REPORT_TABLES"""
+    import schema
+    from batch import RecordBatch
+    return {report_type: RecordBatch(report_type)
+            for report_type in schema.REPORT_TABLES}
+
+
+def prepare_table(report_type):
+    """Create table of report type if needed, checked once per process.
+       Returns name of the table."""
 
-    # create connection to sql database
-    engine = create_engine(engine_url)
+    import schema
+    table = schema.REPORT_TABLES[report_type]
+
+    # only query database catalog if table was not seen before
+    if report_type not in _tables_ready:
+        with _tables_lock:
+            if report_type not in _tables_ready:
+                schema.create_tables(get_engine(), [table])
+                _tables_ready.add(report_type)
+    return table.name
+
+
+def update_lineage(report_type, uids):
+    """Add inserted reports to material lineage table if it is enabled.
+       A failed update is logged, the table is fixed by a rebuild."""
+    import metrics
+    import lineage
+    if not lineage.lineage_enabled:
+        return
+    try:
+        with metrics.timer('lineage', report_type):
+            lineage.update_reports(get_engine(), report_type, list(uids))
+    except Exception as lineage_error:
+        logging.error('lineage update failed: {}'.format(lineage_error))
+        metrics.failure('lineage', lineage_error, report_type)
+
+
+def update_snapshot(report_type, df_reports):
+    """Append inserted reports to the table snapshots if they are enabled.
+       A failed update is logged, the snapshot is fixed by a full export."""
+    import metrics
+    import snapshot
+    if not snapshot.snapshot_enabled:
+        return
+    load_settings()
+    try:
+        with metrics.timer('snapshot', report_type):
+            snapshot.append_reports(get_engine(), report_type, df_reports,
+                                    skip_existing=on_conflict == 'skip')
+    except Exception as snapshot_error:
+        logging.error('snapshot update failed: {}'.format(snapshot_error))
+        metrics.failure('snapshot', snapshot_error, report_type)
+
+
+def after_insert(report_type, df_reports):
+    """Update lineage table and snapshots and notify readers after
+       reports were inserted"""
+    update_lineage(report_type, df_reports[report_type.lower() + '_uid'])
+    update_snapshot(report_type, df_reports)
+    notify_changed(report_type)
+
+
+def notify_changed(report_type):
+    """Send NOTIFY so cached query results of the visualization are
+       dropped. A failed notification is logged, the cache still notices
+       new reports by its periodic fingerprint check."""
+    load_settings()
+    if not cache_notify:
+        return
+    from sqlalchemy import text
+    try:
+        with get_engine().begin() as conn:
+            conn.execute(text('SELECT pg_notify(:channel, :payload)'),
+                         {'channel': NOTIFY_CHANNEL, 'payload': report_type})
+    except Exception as notify_error:
+        logging.error('change notification failed: {}'.format(notify_error))
+
+
+def insert_report(df_processed, report_type, durations=None):
+    """Insert processed lab report into the table of its report type.
+       Returns unique id of the inserted record."""
+    import metrics
 
     # if table does not exist create a new table
-    if not engine.has_table(postgresql_icp_table):
-        meta = MetaData()
-        Table(
-            postgresql_icp_table,
-            meta,
-            Column('icp_uid', String(length=20), primary_key=True,
-                   nullable=False),
-            Column('material_uid', String(length=20)),
-            Column('process_type', String(length=20)),
-            Column('measurement', String(length=10)),
-            Column('pb_concentration', Float),
-            Column('sn_concentration', Float),
-            Column('o_concentration', Float),
-            Column('gas_flow_rate', Float),
-            Column('gas_type', String(length=10)),
-            Column('plasma_temperature', Float),
-            Column('detector_temperature', Float),
-            Column('field_strength', Float),
-            Column('plasma_observation', String(length=10)),
-            Column('radio_frequency', Float),
-            Column('gas_flow_rate_units', String(length=10)),
-            Column('plasma_temperature_units', String(length=10)),
-            Column('detector_temperature_units', String(length=10)),
-            Column('field_strength_units', String(length=10)),
-            Column('radio_frequency_units', String(length=10)),
-            )
-        meta.create_all(engine)
-
-    # add processed dataframe to SQL database
-    df_processed.to_sql(postgresql_icp_table, engine, if_exists='append'
-                        , index=False)
+    table_name = prepare_table(report_type)
+
+    # add processed dataframe to SQL database using shared engine
+    with metrics.timer('insert', report_type, durations):
+        df_processed.to_sql(table_name, get_engine(),
+                            if_exists='append', index=False,
+                            method=get_write_method(report_type, None))
+    metrics.count('ingest_records_inserted_total', report_type=report_type)
+    after_insert(report_type, df_processed)
 
     # after adding the record to database, return unique id for logging
-    icp_uid = df_processed.iloc[0]['icp_uid']
-    return icp_uid
+    return df_processed.iloc[0][report_type.lower() + '_uid']
 
 
-def reporttype_detect(path):
-    """Determine type of record: Hall or ICP based on file prefix."""
+def insert_hallreport(df_processed, durations=None):
+    """Insert Hall lab report into database.
+       This function takes a prepared DF from process_report 
+       pertaining to a Hall measurement and inserts that into
+       a PostgreSQL table. """
+    return insert_report(df_processed, 'HALL', durations)
+
+
+def insert_icpreport(df_processed, durations=None):
+    """Insert ICP lab report into database."""
+    return insert_report(df_processed, 'ICP', durations)
+
+
+def reporttype_detect(path, content=None):
+    """Determine type of record: Hall or ICP based on file prefix.
+       content is the report read from an archive, None for files.
+       Returns unique id of inserted record, None if not inserted"""
+    import metrics
+    import events
 
     # obtain file name for processing
-    filename = path.split('/')[-1]
+    filename = os.path.basename(path)
 
     # log obtained file name for record
     logging.info('{} file received for processing'.format(filename))
 
     # detect if the report is Hall type or ICP type and call report handler function
     # log error if file format is not Hall or ICP type
-    if fnmatch.fnmatch(filename, 'Hall-*.txt'):
-        report_handler(path, filename, 'HALL')
-    elif fnmatch.fnmatch(filename, 'ICP-*.txt'):
-        report_handler(path, filename, 'ICP')
+    report_type = get_reporttype(filename)
+    if report_type:
+        return report_handler(path, filename, report_type, content)
     else:        
         logging.error('cannot detect report type in file: {}'.format(filename))
+        metrics.count('ingest_failures_total', stage='detect',
+                      report_type='', error='UnknownReportType')
+        events.file_event(path, '', 'failed', stage='detect',
+                          error='cannot detect report type')
+
 
+def get_reporttype(filename):
+    """Return report type such as HALL or ICP of file name, None if unknown.
+       Report types are looked up by file name prefix in
+       REPORT_PREFIXES."""
+    prefix, separator, _ = filename.partition('-')
+    if separator and filename.endswith(REPORT_SUFFIX):
+        return REPORT_PREFIXES.get(prefix)
+    return None
 
 
-def report_handler(path, filename, report_type):
-    """Handle report based on type of measurement"""
+def is_report_source(filename):
+    """Return True for report files and archives of reports"""
+    import archives
+    return bool(get_reporttype(filename)) or archives.is_archive(filename)
+
+
+def report_sources(paths):
+    """Yield (path, report type, content) of the report files in paths and
+       of the report members of the archives in paths. Content is None for
+       files, they are read when they are parsed. Report type is None for
+       files of unknown type."""
+    import archives
+    for path in paths:
+        if archives.is_archive(path):
+            yield from archives.members(path, get_reporttype)
+        else:
+            yield path, get_reporttype(os.path.basename(path)), None
+
+
+def report_handler(path, filename, report_type, content=None):
+    """Handle report based on type of measurement.
+       Returns unique id of inserted record, None if not inserted"""
+    import metrics
+    import events
+    import spool
    
      # try to process report to create a processed data frame
      # log info if the file is processed succefully.
      # If any exception arises in processing data record it in the log file     
+    info = {}
     try:
-        df_processed = process_report(path, report_type)       
+        df_processed = process_report(path, report_type, info, content)       
         logging.info('{} processed succesfully'.format(filename))
     except Exception as processing_error:   
         logging.error('processing failed with error: {}'.format(processing_error))
+        metrics.failure('process', processing_error, report_type)
+        events.file_event(path, report_type, 'failed', info=info,
+                          error=processing_error, stage='process')
         return
+    uid = df_processed.iloc[0][report_type.lower() + '_uid']
 
-    # if report type is Hall insert into Hall table
-    if report_type == 'HALL':
+    # while reports are spooled new reports are spooled behind them
+    if spool.active():
+        spool_report(path, report_type, df_processed)
+        events.file_event(path, report_type, 'spooled', uid, info)
+        return
 
-        # try insertion of processed data frame to hall table
-        # log succesful insertion with uid
-        # If exception arises in inserting the record log the error
+    # try insertion of processed data frame to the table of its type
+    # log succesful insertion with uid
+    # If exception arises in inserting the record log the error
+    try:
+        uid = insert_report(df_processed, report_type, info['stages'])
+        logging.info('file inserted succesfully with record_uid: {}'.format(uid))
+        events.file_event(path, report_type, 'inserted', uid, info)
+        return uid
+    except Exception as insertion_error:
+        logging.error('insertion failed: {}'.format(str(insertion_error)))
+        metrics.failure('insert', insertion_error, report_type)
+        insert_failed(path, report_type, df_processed, info,
+                      insertion_error)
+
+
+def db_unavailable(error):
+    """Return True if error means the database could not be reached or did
+       not answer in time, rather than that the data was rejected"""
+    from sqlalchemy import exc
+    return isinstance(error, (exc.OperationalError, exc.InterfaceError,
+                              exc.DisconnectionError, exc.TimeoutError))
+
+
+def spool_failed(error):
+    """Return True if reports that failed with error are spooled"""
+    import spool
+    return spool.spool_enabled and db_unavailable(error)
 
-        try:
-            uid = insert_hallreport(df_processed)               
-            logging.info('file inserted succesfully with record_uid: {}'.format(uid))
-        except Exception as insertion_error:         
-            logging.error('insertion failed: {}'.format(str(insertion_error)))
 
-    # if report type is ICP insert into ICP table
+def spool_report(path, report_type, df_processed):
+    """Keep processed report in the local spool until it can be inserted"""
+    import spool
+    spool.append(report_type, [(path, record) for record in
+                               df_processed.to_dict('records')])
+
+
+def insert_failed(path, report_type, df_processed, info, error):
+    """Spool report whose insert failed because the database is
+       unavailable and log its file event"""
+    import events
+    uid = df_processed.iloc[0][report_type.lower() + '_uid']
+    if spool_failed(error):
+        spool_report(path, report_type, df_processed)
+        events.file_event(path, report_type, 'spooled', uid, info,
+                          error=error)
     else:
+        events.file_event(path, report_type, 'failed', uid, info,
+                          error=error, stage='insert')
+
+
+def batch_events(records, report_type, start, stop, outcome, seconds=None,
+                 error=None, **fields):
+    """Log file events of records start to stop of a RecordBatch, seconds
+       is the duration of the batch insert"""
+    import events
+    if not events.events_enabled:
+        return
+    uids = records.buffers[report_type.lower() + '_uid']
+    for i in range(start, stop):
+        info = records.info[i] or {}
+        if seconds is not None:
+            info = dict(info, stages=dict(info.get('stages', {}),
+                                          insert_batch=seconds))
+        events.file_event(records.keys[i], report_type, outcome, uids[i],
+                          info, error=error, batch=stop - start, **fields)
+
+
+def replay_insert(report_type, records):
+    """Insert spooled records, stops with spool.ReplayInterrupted if the
+       database goes away. Inserted report files are recorded in the
+       manifest, so the next startup does not process them again."""
+    import spool
+    try:
+        inserted = insert_batches(records, report_type, replay=True)
+    except spool.ReplayInterrupted as interrupted:
+        record_replayed([records.keys[i] for i in interrupted.inserted])
+        raise
+    record_replayed([records.keys[i] for i in inserted])
+
+
+def record_replayed(paths):
+    """Record replayed report files in the manifest if it is enabled. The
+       reports are in the database already, so a failure is only logged
+       and the files are compared again at the next startup."""
+    load_settings()
+    if not paths or not manifest_enabled:
+        return
+    import manifest
+    try:
+        manifest.record_replayed(paths)
+    except Exception as manifest_error:
+        logging.warning('replayed files not recorded in manifest: {}'.format(
+            manifest_error))
+
+
+def probe_database():
+    """Raise if the database can not be reached"""
+    from sqlalchemy import text
+    with get_engine().connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+
+def replay_spool():
+    """Insert spooled reports once if the database is reachable.
+       Returns True if the spool is empty afterwards."""
+    import spool
+    if not spool.active():
+        return True
+    try:
+        probe_database()
+        return spool.replay(replay_insert)
+    except Exception as replay_error:
+        logging.warning('spool replay failed: {}'.format(replay_error))
+        return False
+
+
+def start_spool_replay():
+    """Replay spooled reports in a background thread with backoff"""
+    import spool
+    spool.start(replay_insert, probe_database)
+
+
+def stop_spool_replay():
+    """Stop background replay of spooled reports"""
+    import spool
+    spool.stop()
+
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """Insert rows into PostgreSQL table using COPY.
+       Used as method argument of DataFrame.to_sql"""
+
+    # write rows to an in memory csv buffer
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(data_iter)
+    buf.seek(0)
+
+    # stream buffer to database with COPY using raw psycopg2 cursor
+    columns = ', '.join('"{}"'.format(k) for k in keys)
+    if table.schema:
+        table_name = '{}.{}'.format(table.schema, table.name)
+    else:
+        table_name = table.name
+    sql = 'COPY {} ({}) FROM STDIN WITH CSV'.format(table_name, columns)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(sql=sql, file=buf)
+
 
-        # try insertion of processed data frame to hall table
-        # log succesful insertion with uid
-        # If exception arrises in inserting the record log the error
+def upsert_rows(keys, rows, uid):
+    """Drop rows with repeated uid, one statement can not touch a row twice.
+       Keeps the last row of a uid so updates store the latest report."""
+    uid_index = keys.index(uid)
+    unique_rows = {}
+    for row in rows:
+        unique_rows[row[uid_index]] = row
+    return list(unique_rows.values())
 
+
+def psql_upsert_method(uid, mode):
+    """Return DataFrame.to_sql method inserting all rows in one
+       INSERT ... ON CONFLICT statement on the uid primary key.
+       mode skip keeps stored records, update overwrites them."""
+    from sqlalchemy.dialects import postgresql
+
+    def psql_upsert(table, conn, keys, data_iter):
+        rows = upsert_rows(keys, list(data_iter), uid)
+        stmt = postgresql.insert(table.table).values(
+            [dict(zip(keys, row)) for row in rows])
+        if mode == 'update':
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[uid],
+                set_={k: stmt.excluded[k] for k in keys if k != uid})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[uid])
+        conn.execute(stmt)
+
+    return psql_upsert
+
+
+def psql_copy_upsert_method(uid, mode):
+    """Return DataFrame.to_sql method that loads rows with COPY into a
+       temporary table and moves them with one INSERT ... ON CONFLICT"""
+
+    def psql_copy_upsert(table, conn, keys, data_iter):
+        buf = StringIO()
+        csv.writer(buf).writerows(upsert_rows(keys, list(data_iter), uid))
+        buf.seek(0)
+
+        columns = ', '.join('"{}"'.format(k) for k in keys)
+        if table.schema:
+            table_name = '{}.{}'.format(table.schema, table.name)
+        else:
+            table_name = table.name
+        if mode == 'update':
+            action = 'DO UPDATE SET ' + ', '.join(
+                '"{0}" = EXCLUDED."{0}"'.format(k) for k in keys if k != uid)
+        else:
+            action = 'DO NOTHING'
+
+        with conn.connection.cursor() as cur:
+            cur.execute('CREATE TEMP TABLE upsert_batch (LIKE {}) '
+                        'ON COMMIT DROP'.format(table_name))
+            cur.copy_expert('COPY upsert_batch ({}) FROM STDIN WITH CSV'
+                            .format(columns), buf)
+            cur.execute('INSERT INTO {0} ({1}) SELECT {1} FROM upsert_batch '
+                        'ON CONFLICT ("{2}") {3}'.format(table_name, columns,
+                                                        uid, action))
+
+    return psql_copy_upsert
+
+
+def get_write_method(report_type, method, mode=None):
+    """Return DataFrame.to_sql method for report type.
+       method multi or copy, None for a plain INSERT, combined with the
+       on conflict mode error, skip or update, on_conflict of config.ini
+       if mode is None"""
+
+    if mode is None:
+        load_settings()
+        mode = on_conflict
+    uid = report_type.lower() + '_uid'
+    if mode in ('skip', 'update'):
+        if method == 'copy':
+            return psql_copy_upsert_method(uid, mode)
+        return psql_upsert_method(uid, mode)
+    if method == 'copy':
+        return psql_insert_copy
+    return method
+
+
+def insert_batches(records, report_type, batch_size=None, method=None,
+                   replay=False, unavailable=None):
+    """Insert RecordBatch of processed reports of one type into database
+       in batches. Each batch is written in one transaction with a
+       multi-row INSERT or COPY, success or failure is logged per batch.
+       With the spool enabled records are spooled while the database is
+       unavailable, replay is set when spooled records are inserted.
+       Otherwise the indexes of records not inserted because the database
+       was unavailable are added to the list unavailable if it is given.
+       batch_size and method are read from config.ini if they are None.
+       Returns list of indexes in records of inserted records."""
+    import metrics
+    import spool
+    load_settings()
+    batch_size = batch_size or bulk_batch_size
+    method = method or bulk_insert_method
+
+    # while reports are spooled new reports are spooled behind them
+    if spool.active() and not replay:
+        spool.append(report_type, records.rows())
+        batch_events(records, report_type, 0, len(records), 'spooled')
+        return []
+
+    # make sure table exists and get shared engine
+    try:
+        table_name = prepare_table(report_type)
+    except Exception as table_error:
+        if not spool_failed(table_error):
+            raise
+        if replay:
+            raise spool.ReplayInterrupted(0) from table_error
+        spool.append(report_type, records.rows())
+        batch_events(records, report_type, 0, len(records), 'spooled',
+                     error=table_error)
+        return []
+    engine = get_engine()
+
+    method = get_write_method(report_type, method)
+
+    inserted = []
+    n_batches = (len(records) + batch_size - 1) // batch_size
+    for batch_no, (start, df_batch) in enumerate(records.frames(batch_size),
+                                                 1):
+
+        # insert batch and log result, a failed batch does not stop the load
+        stop = start + len(df_batch)
+        durations = {}
+        try:
+            with metrics.timer('insert_batch', report_type, durations):
+                df_batch.to_sql(table_name, engine, if_exists='append',
+                                index=False, method=method)
+            inserted.extend(range(start, stop))
+            metrics.count('ingest_records_inserted_total', len(df_batch),
+                          report_type=report_type)
+            after_insert(report_type, df_batch)
+            logging.info('{} batch {}/{} inserted succesfully with {} records'
+                         .format(report_type, batch_no, n_batches,
+                                 len(df_batch)))
+            batch_events(records, report_type, start, stop, 'inserted',
+                         durations['insert_batch'], replayed=replay)
+        except Exception as insertion_error:
+            logging.error('{} batch {}/{} insertion failed: {}'.format(
+                report_type, batch_no, n_batches, str(insertion_error)))
+            metrics.failure('insert_batch', insertion_error, report_type)
+
+            # keep this and the following batches until database is back
+            if spool_failed(insertion_error):
+                if replay:
+                    raise spool.ReplayInterrupted(start, inserted) \
+                        from insertion_error
+                spool.append(report_type, records.rows(start))
+                batch_events(records, report_type, start, len(records),
+                             'spooled', durations.get('insert_batch'),
+                             error=insertion_error)
+                break
+            if unavailable is not None and db_unavailable(insertion_error):
+                unavailable.extend(range(start, stop))
+            batch_events(records, report_type, start, stop, 'failed',
+                         durations.get('insert_batch'), error=insertion_error,
+                         stage='insert')
+
+    return inserted
+
+
+def bulk_load(paths, batch_size=None, method=None, unavailable=None):
+    """Process all reports first, group them by report type and insert
+       each group into database in batches. Reports in archives are read
+       without extracting them. Paths of reports not inserted because the
+       database was unavailable are added to the list unavailable if it is
+       given, see insert_batches.
+       Returns list of paths of inserted reports."""
+    import metrics
+    import events
+
+    grouped = new_batches()
+    inserted_paths = []
+
+    # parse every report and group processed records by type
+    for path, report_type, content in report_sources(paths):
+        filename = os.path.basename(path)
+        if not report_type:
+            logging.error('cannot detect report type in file: {}'.format(filename))
+            metrics.count('ingest_failures_total', stage='detect',
+                          report_type='', error='UnknownReportType')
+            events.file_event(path, '', 'failed', stage='detect',
+                              error='cannot detect report type')
+            continue
+        info = {} if events.events_enabled else None
+        try:
+            grouped[report_type].append(
+                parse_report(path, report_type, info, content), path, info)
+            metrics.count('ingest_files_total', report_type=report_type)
+        except Exception as processing_error:
+            logging.error('processing failed for {} with error: {}'.format(
+                filename, processing_error))
+            metrics.failure('process', processing_error, report_type)
+            events.file_event(path, report_type, 'failed', info=info,
+                              error=processing_error, stage='process')
+
+    logging.info('bulk load processed {} reports'.format(', '.join(
+        '{} {}'.format(len(records), report_type)
+        for report_type, records in grouped.items())))
+
+    # insert each group of reports in batches
+    for report_type, records in grouped.items():
+        if len(records):
+            failed = None if unavailable is None else []
+            inserted = insert_batches(records, report_type, batch_size,
+                                      method, unavailable=failed)
+            inserted_paths.extend(records.keys[i] for i in inserted)
+            if failed:
+                unavailable.extend(records.keys[i] for i in failed)
+            logging.info('bulk load inserted {} of {} {} reports'.format(
+                len(inserted), len(records), report_type))
+
+    return inserted_paths
+
+
+def parse_files(sources):
+    """Process a chunk of (path, report type, content) of report_sources
+       in a worker process.
+       Returns a RecordBatch of processed reports per report type, a list
+       of (path, report type, error, info) of failed files and the metrics
+       of the chunk, errors are logged by the writer process."""
+    import metrics
+    import events
+
+    records = new_batches()
+    errors = []
+    for path, report_type, content in sources:
+        if not report_type:
+            errors.append((path, '', 'cannot detect report type', None))
+            metrics.count('ingest_failures_total', stage='detect',
+                          report_type='', error='UnknownReportType')
+            continue
+        info = {} if events.events_enabled else None
         try:
-            uid = insert_icpreport(df_processed)            
-            logging.info('file inserted succesfully with record_uid: {}'.format(uid))
-        except Exception as insertion_error:        
-            logging.error('insertion failed: {}'.format(str(insertion_error)))
-  
+            records[report_type].append(
+                parse_report(path, report_type, info, content), path, info)
+            metrics.count('ingest_files_total', report_type=report_type)
+        except Exception as processing_error:
+            errors.append((path, report_type, '{}: {}'.format(
+                type(processing_error).__name__, processing_error), info))
+            metrics.failure('process', processing_error, report_type)
+    return records, errors, metrics.snapshot()
+
+
+def parallel_load(paths, workers=None, chunk_size=None, queue_size=None,
+                  batch_size=None, method=None):
+    """Process reports concurrently in a process pool and insert them
+       from this process in batches.
+       At most queue_size chunks are parsed or waiting at any time so
+       memory stays bounded no matter how many files are loaded. Reports
+       in archives are read by this process and parsed by the workers.
+       Settings that are None are read from config.ini.
+       Returns list of paths of inserted reports."""
+    import metrics
+    import events
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from batch import RecordBatch
+    load_settings()
+    workers = workers or parallel_workers or os.cpu_count() or 1
+    chunk_size = chunk_size or parallel_chunk_size
+    queue_size = queue_size or parallel_queue_size or 2 * workers
+    batch_size = batch_size or bulk_batch_size
+
+    pending = new_batches()
+    inserted_paths = []
+    counts = {'processed': 0, 'failed': 0}
+
+    def flush(report_type):
+        """Insert collected reports of report type"""
+        records = pending[report_type]
+        inserted = insert_batches(records, report_type, batch_size, method)
+        inserted_paths.extend(records.keys[i] for i in inserted)
+        pending[report_type] = RecordBatch(report_type)
+
+    def write(chunk_result):
+        """Collect parsed reports and insert every full batch"""
+        records, errors, chunk_metrics = chunk_result
+        metrics.merge(chunk_metrics)
+        for path, report_type, error, info in errors:
+            counts['failed'] += 1
+            logging.error('processing failed for {} with error: {}'
+                          .format(os.path.basename(path), error))
+            events.file_event(path, report_type, 'failed', info=info,
+                              error=error,
+                              stage='process' if report_type else 'detect')
+        for report_type, chunk_records in records.items():
+            counts['processed'] += len(chunk_records)
+            pending[report_type].extend(chunk_records)
+            if len(pending[report_type]) >= batch_size:
+                flush(report_type)
+
+    sources = report_sources(paths)
+    chunks = iter(lambda: list(islice(sources, chunk_size)), [])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = set()
+        for chunk in chunks:
+
+            # wait for the writer to catch up when the queue is full
+            if len(futures) >= queue_size:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+            futures.add(executor.submit(parse_files, chunk))
+            metrics.set_gauge('ingest_queue_depth', len(futures),
+                              queue='parallel')
 
+        for future in futures:
+            write(future.result())
+    metrics.set_gauge('ingest_queue_depth', 0, queue='parallel')
 
+    # insert remaining records of last partial batches
+    for report_type in pending:
+        if len(pending[report_type]):
+            flush(report_type)
 
+    logging.info('parallel load with {} workers processed {} reports, '
+                 '{} failed, {} inserted'.format(workers, counts['processed'],
+                                                  counts['failed'],
+                                                  len(inserted_paths)))
+    return inserted_paths
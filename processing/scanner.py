@@ -0,0 +1,117 @@
+"""
+This script scans the report folder for lab report files. Folders are read
+with os.scandir by a pool of threads, so subfolders such as per instrument
+or per day folders are scanned concurrently, and matching files are yielded
+as soon as they are found. Ingest starts right away and memory does not grow
+with the number of files in the folder. The directory entries themselves are
+yielded so their cached file type and stat information can be reused.
+"""
+
+import logging
+import os
+import queue
+import threading
+import settings
+
+# parse configuration file to get parameters
+config = settings.get()
+
+scan_recursive = config.getboolean('Scan', 'recursive', fallback=True)
+scan_workers = config.getint('Scan', 'workers', fallback=4)
+scan_chunk_size = config.getint('Scan', 'chunk_size', fallback=5000)
+
+# found entries are queued in lists of up to ENTRY_BATCH entries, at most
+# QUEUE_SIZE lists wait to be consumed which bounds the memory of a scan
+ENTRY_BATCH = 256
+QUEUE_SIZE = 64
+
+# put in the queue of found entries when all folders were scanned
+_DONE = object()
+
+
+def scan(folder, match=None, recursive=scan_recursive, workers=scan_workers):
+    """Yield os.DirEntry of the files in folder, and its subfolders if
+       recursive, whose name match(name) accepts, all files if match is
+       None. Folders are scanned by worker threads while entries are
+       consumed. Symbolic links to folders are not followed."""
+
+    found = queue.Queue(QUEUE_SIZE)
+    folders = queue.Queue()
+    stop = threading.Event()
+
+    def put(item):
+        """Wait for room in the queue unless the consumer stopped"""
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_folders():
+        """Scan folders until a None folder arrives"""
+        while True:
+            path = folders.get()
+            if path is None:
+                return
+            batch = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if stop.is_set():
+                            break
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if recursive:
+                                    folders.put(entry.path)
+                            elif entry.is_file() and (match is None
+                                                      or match(entry.name)):
+                                batch.append(entry)
+                        except OSError as entry_error:
+                            logging.error('cannot read {}: {}'.format(
+                                entry.path, entry_error))
+                        if len(batch) >= ENTRY_BATCH:
+                            put(batch)
+                            batch = []
+            except OSError as scan_error:
+                logging.error('cannot scan folder {}: {}'.format(
+                    path, scan_error))
+            finally:
+                if batch:
+                    put(batch)
+                folders.task_done()
+
+    def finish():
+        """Stop workers and the consumer when all folders were scanned"""
+        folders.join()
+        for _ in threads:
+            folders.put(None)
+        put(_DONE)
+
+    folders.put(folder)
+    threads = [threading.Thread(target=scan_folders, daemon=True)
+               for _ in range(max(workers, 1))]
+    for thread in threads:
+        thread.start()
+    threading.Thread(target=finish, daemon=True).start()
+
+    try:
+        while True:
+            batch = found.get()
+            if batch is _DONE:
+                return
+            yield from batch
+    finally:
+        stop.set()
+
+
+def chunks(entries, size=scan_chunk_size):
+    """Yield lists of up to size entries as they are scanned"""
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,254 @@
+"""
+This script declares the database tables shared by the processing and the
+visualization scripts: the Hall and ICP report tables written by the ingest
+path and the material procurement, ball milling and hot press tables they
+are joined with, together with the indexes on the columns the lineage
+queries filter and join on.
+
+create_tables() creates missing tables and migrates existing ones by adding
+missing columns and indexes. check_indexes() explains queries with
+sequential scans disabled and reports the tables that are still scanned,
+their filters have no usable index.
+
+usage: python schema.py
+"""
+
+import logging
+from contextlib import contextmanager
+from sqlalchemy import (Table, Column, Float, String, MetaData, Boolean,
+                        Index, inspect, text)
+import settings
+
+# parse configuration file to get parameters
+config = settings.get()
+
+hall_table_name = config.get('PostgresTables', 'hall_table',
+                             fallback='hall_measurement')
+icp_table_name = config.get('PostgresTables', 'icp_table',
+                            fallback='icp_measurement')
+
+meta = MetaData()
+
+material_procurement = Table(
+    'material_procurement',
+    meta,
+    Column('uid', String(length=20), primary_key=True, nullable=False),
+    Column('ball_milling_uid', String(length=20), index=True),
+    Column('material_name', String(length=20)),
+    Column('mass_fraction', Float),
+    )
+
+ball_milling = Table(
+    'ball_milling',
+    meta,
+    Column('uid', String(length=20), primary_key=True, nullable=False),
+    Column('milling_speed', Float),
+    Column('milling_speed_units', String(length=10)),
+    Column('milling_time', Float),
+    Column('milling_time_units', String(length=10)),
+    Column('output_material_uid', String(length=20), index=True),
+    Column('hot_press_uid', String(length=20), index=True),
+    )
+
+hot_press = Table(
+    'hot_press',
+    meta,
+    Column('uid', String(length=20), primary_key=True, nullable=False),
+    Column('hot_press_temperature', Float),
+    Column('hot_press_temperature_units', String(length=10)),
+    Column('hot_press_pressure', Float),
+    Column('hot_press_pressure_units', String(length=10)),
+    Column('hot_press_time', Float),
+    Column('hot_press_time_units', String(length=10)),
+    Column('output_material_name', String(length=20)),
+    Column('output_material_uid', String(length=20), index=True),
+    )
+
+hall_table = Table(
+    hall_table_name,
+    meta,
+    Column('hall_uid', String(length=20), primary_key=True, nullable=False),
+    Column('material_uid', String(length=20), index=True),
+    Column('process_type', String(length=20)),
+    Column('measurement', String(length=10)),
+    Column('probe_resistance', Float),
+    Column('gas_flow_rate', Float),
+    Column('gas_type', String(length=10)),
+    Column('probe_material', String(length=10)),
+    Column('current', Float),
+    Column('field_strength', Float),
+    Column('sample_position', Float),
+    Column('magnet_reversal', Boolean),
+    Column('probe_resistance_units', String(length=10)),
+    Column('gas_flow_rate_units', String(length=10)),
+    Column('current_units', String(length=10)),
+    Column('field_strength_units', String(length=10)),
+    )
+
+icp_table = Table(
+    icp_table_name,
+    meta,
+    Column('icp_uid', String(length=20), primary_key=True, nullable=False),
+    Column('material_uid', String(length=20), index=True),
+    Column('process_type', String(length=20)),
+    Column('measurement', String(length=10)),
+    Column('pb_concentration', Float),
+    Column('sn_concentration', Float),
+    Column('o_concentration', Float),
+    Column('gas_flow_rate', Float),
+    Column('gas_type', String(length=10)),
+    Column('plasma_temperature', Float),
+    Column('detector_temperature', Float),
+    Column('field_strength', Float),
+    Column('plasma_observation', String(length=10)),
+    Column('radio_frequency', Float),
+    Column('gas_flow_rate_units', String(length=10)),
+    Column('plasma_temperature_units', String(length=10)),
+    Column('detector_temperature_units', String(length=10)),
+    Column('field_strength_units', String(length=10)),
+    Column('radio_frequency_units', String(length=10)),
+    )
+
+# key of the PostgreSQL advisory lock held while tables are created or
+# migrated, so ingest workers starting together do not create a table twice
+DDL_LOCK_KEY = 72541001
+
+# A new report type is added by declaring its table, adding it to
+# REPORT_TABLES, or with add_report_type(), and adding its file name prefix
+# to REPORT_PREFIXES of processing.py. The table needs a <type>_uid primary
+# key and a material_uid column.
+REPORT_TABLES = {'HALL': hall_table, 'ICP': icp_table}
+
+
+def field_type(column):
+    """Return type of report field stored in column: float, bool or text"""
+    if isinstance(column.type, Float):
+        return 'float'
+    if isinstance(column.type, Boolean):
+        return 'bool'
+    return 'text'
+
+
+def field_spec(table):
+    """Return {field: (type, units column)} of the fields of a report
+       table, units column is None for fields without units"""
+    names = set(table.columns.keys())
+    spec = {}
+    for column in table.columns:
+        units = column.name + '_units'
+        spec[column.name] = (field_type(column),
+                             units if units in names else None)
+    return spec
+
+
+FIELD_SPECS = {report_type: field_spec(table)
+               for report_type, table in REPORT_TABLES.items()}
+
+
+def add_report_type(report_type, table):
+    """Add report table of report type declared outside of this module"""
+    REPORT_TABLES[report_type] = table
+    FIELD_SPECS[report_type] = field_spec(table)
+
+
+def migrate_table(engine, table):
+    """Add columns and indexes of table definition missing in database"""
+
+    insp = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    existing_columns = {c['name'] for c in insp.get_columns(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing_columns:
+                conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    quote(table.name), quote(column.name),
+                    column.type.compile(engine.dialect))))
+                logging.info('column {}.{} added'.format(table.name,
+                                                         column.name))
+
+    # an index is there if an index on the same columns exists,
+    # whatever its name is. Tables created outside of this module may
+    # lack the primary key, its columns are indexed instead.
+    existing_indexes = {tuple(i['column_names'])
+                        for i in insp.get_indexes(table.name)}
+    primary_key = insp.get_pk_constraint(table.name)['constrained_columns']
+    if primary_key:
+        existing_indexes.add(tuple(primary_key))
+    indexes = list(table.indexes)
+    key_columns = list(table.primary_key.columns)
+    key_names = [c.name for c in key_columns]
+    if tuple(key_names) not in existing_indexes:
+        key_index = Index('ix_{}_{}'.format(table.name, '_'.join(key_names)),
+                          *key_columns)
+        # the index is created in this database only, it is not added to
+        # the table definition on every migration
+        table.indexes.discard(key_index)
+        indexes.append(key_index)
+    for index in indexes:
+        if tuple(c.name for c in index.columns) not in existing_indexes:
+            index.create(engine)
+            logging.info('index {} created'.format(index.name))
+
+
+@contextmanager
+def ddl_lock(engine):
+    """Hold the advisory lock on table changes of all ingest workers"""
+    with engine.connect() as conn:
+        conn.execute(text('SELECT pg_advisory_lock(:key)'),
+                     {'key': DDL_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text('SELECT pg_advisory_unlock(:key)'),
+                         {'key': DDL_LOCK_KEY})
+
+
+def create_tables(engine, tables=None):
+    """Create missing tables, add missing columns and indexes to existing
+       tables. All declared tables are checked if tables is None."""
+
+    with ddl_lock(engine):
+        for table in tables or meta.sorted_tables:
+            if engine.has_table(table.name):
+                migrate_table(engine, table)
+            else:
+                table.create(engine)
+                logging.info('table {} created'.format(table.name))
+
+
+def seq_scans(plan):
+    """Return (table, filter) of sequential scans in EXPLAIN JSON plan"""
+    scans = []
+    if plan.get('Node Type') == 'Seq Scan':
+        scans.append((plan['Relation Name'], plan.get('Filter', '')))
+    for child in plan.get('Plans', []):
+        scans.extend(seq_scans(child))
+    return scans
+
+
+def check_indexes(conn, queries):
+    """Explain queries with sequential scans disabled and return
+       (query name, table, filter) of tables that are still scanned.
+       conn is a DB-API connection, queries a list of (name, sql, params)
+       with the parameters the queries are run with."""
+
+    missing = []
+    cur = conn.cursor()
+    try:
+        cur.execute('SET LOCAL enable_seqscan = off')
+        for name, sql, params in queries:
+            cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cur.fetchone()[0][0]['Plan']
+            missing.extend((name, table, condition)
+                           for table, condition in seq_scans(plan))
+    finally:
+        conn.rollback()
+    return missing
+
+
+if __name__ == '__main__':
+    import processing as process
+    process.setup_logging()
+
+    create_tables(process.get_engine())
+    print('tables and indexes are up to date')
@@ -0,0 +1,50 @@
+"""
+This script reads the configuration file shared by the processing scripts.
+config.ini is found next to the processing folder, so the scripts can be
+started from any directory. Another file is chosen with load(path), as the
+--config option of ingest.py does, or with the LAB_CONFIG environment
+variable. The file is read once per process when it is first needed, every
+script reads its settings when it is imported, so load() is called before
+the scripts are imported.
+
+Relative paths in the configuration file are resolved against the
+processing folder, where the scripts used to be started from.
+"""
+
+import configparser
+import os
+
+PROCESSING_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(os.path.dirname(PROCESSING_DIR), 'config.ini')
+
+_config = None
+
+
+def load(path=None):
+    """Read configuration file path, the file of LAB_CONFIG or the default
+       config.ini and use it in this process. Worker processes started
+       afterwards read the same file."""
+    global _config
+    path = os.path.abspath(path or os.environ.get('LAB_CONFIG')
+                           or DEFAULT_PATH)
+    os.environ['LAB_CONFIG'] = path
+    config = configparser.ConfigParser()
+    config.read(path)
+    _config = config
+    return config
+
+
+def get():
+    """Return configuration, read on first use"""
+    if _config is None:
+        load()
+    return _config
+
+
+def resolve(path):
+    """Return path of configuration file resolved against the processing
+       folder, empty paths stay empty"""
+    if not path:
+        return path
+    return os.path.normpath(os.path.join(PROCESSING_DIR,
+                                         os.path.expanduser(path)))
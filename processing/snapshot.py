@@ -0,0 +1,253 @@
+"""
+This script writes snapshots of the database tables as Arrow IPC files so
+the visualization can read them memory-mapped instead of querying the
+database. Every table is a folder of part files in the snapshot folder:
+
+    material_procurement, ball_milling, hot_press  lineage tables
+    hall_measurement, icp_measurement              lab report tables
+    material_lineage                               merged dataset, written
+                                                   when [Lineage] is enabled
+
+A full export replaces all parts of a table. Reports inserted by the ingest
+path are appended as new parts, parts are compacted into one file once a
+table has compact_parts parts. Rows of later parts replace rows with the
+same key of earlier parts.
+
+Requires pyarrow.
+
+usage: python snapshot.py
+"""
+
+import glob
+import logging
+import os
+import threading
+import time
+import settings
+import pandas as pd
+from sqlalchemy import bindparam, text
+import lineage
+
+# parse configuration file to get parameters
+config = settings.get()
+
+snapshot_enabled = config.getboolean('Snapshot', 'enabled', fallback=False)
+snapshot_dir = settings.resolve(config.get('Snapshot', 'dir',
+                                           fallback='../snapshot'))
+compact_parts = config.getint('Snapshot', 'compact_parts', fallback=50)
+hall_table = config.get('PostgresTables', 'hall_table',
+                        fallback='hall_measurement')
+icp_table = config.get('PostgresTables', 'icp_table',
+                       fallback='icp_measurement')
+
+# snapshot tables and the key column rows are replaced by
+TABLE_KEYS = {'material_procurement': 'uid',
+              'ball_milling': 'uid',
+              'hot_press': 'uid',
+              hall_table: 'hall_uid',
+              icp_table: 'icp_uid',
+              lineage.lineage_table: 'BM-uid'}
+
+REPORT_TABLES = {'HALL': hall_table, 'ICP': icp_table}
+
+# parts of a table are written and compacted by one thread at a time
+_write_lock = threading.RLock()
+
+# table -> (part files, set of keys in them) of the report snapshots,
+# only parts added since the keys were read are read again
+_keys = {}
+
+
+def table_dir(table):
+    """Return folder of snapshot table"""
+    return os.path.join(snapshot_dir, table)
+
+
+def list_parts(table):
+    """Return part files of snapshot table in the order they were written"""
+    return sorted(glob.glob(os.path.join(table_dir(table), 'part-*.arrow')))
+
+
+def to_arrow(df, schema=None):
+    """Return DataFrame as Arrow table, with a schema columns are converted
+       to the types of the schema like the database converts inserted
+       values to the column types"""
+
+    import pyarrow as pa
+
+    if schema is None:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    arrays = []
+    for field in schema:
+        if field.name not in df.columns:
+            arrays.append(pa.nulls(len(df), field.type))
+            continue
+        try:
+            arrays.append(pa.array(df[field.name], type=field.type,
+                                   from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # mixed values such as True and 'False' are cast from text
+            values = [None if pd.isna(v) else str(v) for v in df[field.name]]
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_schema(path):
+    """Return Arrow schema of part file"""
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.memory_map(path)).schema
+
+
+def write_part(table, df, schema=None):
+    """Write DataFrame as new part of snapshot table, returns its path.
+       The part is written to a temporary file and renamed when complete
+       so readers never see a partly written file."""
+
+    import pyarrow as pa
+
+    os.makedirs(table_dir(table), exist_ok=True)
+    path = os.path.join(table_dir(table),
+                        'part-{:020d}.arrow'.format(time.time_ns()))
+
+    # key column is stored with the part so readers can replace rows
+    arrow_table = to_arrow(df, schema)
+    arrow_table = arrow_table.replace_schema_metadata(
+        {'key': TABLE_KEYS.get(table, '')})
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_part(path, columns=None):
+    """Read part file memory-mapped into a DataFrame"""
+    import pyarrow as pa
+    arrow_table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if columns:
+        arrow_table = arrow_table.select(columns)
+    return arrow_table.to_pandas()
+
+
+def read_table(table, columns=None):
+    """Read all parts of snapshot table, None if there is no snapshot"""
+    parts = list_parts(table)
+    if not parts:
+        return None
+    df = pd.concat([read_part(path, columns) for path in parts],
+                   ignore_index=True, sort=False)
+    key = TABLE_KEYS.get(table)
+    if len(parts) > 1 and key in df.columns:
+        df = df.drop_duplicates(key, keep='last').reset_index(drop=True)
+    return df
+
+
+def replace_table(table, df):
+    """Write DataFrame as the only part of snapshot table, returns its
+       path"""
+    with _write_lock:
+        old_parts = list_parts(table)
+        path = write_part(table, df)
+        for old_path in old_parts:
+            os.remove(old_path)
+        return path
+
+
+def compact(table):
+    """Merge all parts of snapshot table into one part"""
+    with _write_lock:
+        parts = list_parts(table)
+        if len(parts) > 1:
+            path = replace_table(table, read_table(table))
+            logging.info('snapshot {} compacted'.format(table))
+
+            # the compacted part holds the same keys
+            if table in _keys and _keys[table][0] == parts:
+                _keys[table] = ([path], _keys[table][1])
+
+
+def existing_keys(table, key):
+    """Return set of the keys in snapshot table. The set is kept in memory,
+       only the key column of parts written since the last call is read.
+       All parts are read again after the table was replaced."""
+    with _write_lock:
+        parts = list_parts(table)
+        known_parts, keys = _keys.get(table, ([], set()))
+        if parts[:len(known_parts)] != known_parts:
+            known_parts, keys = [], set()
+        for path in parts[len(known_parts):]:
+            keys.update(read_part(path, [key])[key])
+        _keys[table] = (parts, keys)
+        return keys
+
+
+def export_table(engine, table):
+    """Replace snapshot of table with its content in the database"""
+    if not engine.has_table(table):
+        return
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.connect() as conn:
+        df = pd.read_sql_query(text('SELECT * FROM {}'.format(quote(table))),
+                               conn)
+    replace_table(table, df)
+    logging.info('snapshot {} exported with {} rows'.format(table, len(df)))
+
+
+def export_all(engine):
+    """Export all tables to the snapshot folder"""
+    for table in TABLE_KEYS:
+        export_table(engine, table)
+
+
+def append_reports(engine, report_type, df_reports, skip_existing=False):
+    """Append inserted reports to snapshot of their table and the lineage
+       rows of their materials to the merged dataset.
+       With skip_existing reports whose uid is already in the snapshot are
+       left out, they were not written to the database either."""
+
+    table = REPORT_TABLES.get(report_type)
+    if table is None or not list_parts(table):
+        # tables are exported in full once before parts are appended,
+        # other report tables are not part of the snapshot
+        return
+    key = TABLE_KEYS[table]
+
+    # appended parts have the column types of the full export
+    with _write_lock:
+        if skip_existing:
+            existing = existing_keys(table, key)
+            df_reports = df_reports[[uid not in existing
+                                     for uid in df_reports[key]]]
+        if df_reports.empty:
+            return
+        write_part(table, df_reports, read_schema(list_parts(table)[-1]))
+        lineage_parts = list_parts(lineage.lineage_table)
+        if lineage.lineage_enabled and lineage_parts:
+            df_lineage = lineage_rows(engine,
+                                      df_reports['material_uid'].unique())
+            if not df_lineage.empty:
+                write_part(lineage.lineage_table, df_lineage,
+                           read_schema(lineage_parts[-1]))
+    for name in (table, lineage.lineage_table):
+        if len(list_parts(name)) >= compact_parts:
+            compact(name)
+
+
+def lineage_rows(engine, material_uids):
+    """Read lineage rows of ball milling or hot press output materials"""
+    quote = engine.dialect.identifier_preparer.quote
+    stmt = text('SELECT * FROM {} WHERE {} IN :uids OR {} IN :uids'.format(
+        quote(lineage.lineage_table), quote('BM-output_material_uid'),
+        quote('HP-output_material_uid')))
+    with engine.connect() as conn:
+        return pd.read_sql_query(
+            stmt.bindparams(bindparam('uids', expanding=True)), conn,
+            params={'uids': list(material_uids)})
+
+
+if __name__ == '__main__':
+    import processing as process
+    process.setup_logging()
+
+    export_all(process.get_engine())
+    print('snapshot written to {}'.format(os.path.abspath(snapshot_dir)))
@@ -0,0 +1,228 @@
+"""
+This script keeps a local spool of parsed reports that could not be inserted
+because the database is down or too slow to answer. Records are appended as
+JSON lines to the open segment of their report type in the spool folder:
+
+    HALL/open.jsonl                 records appended by the ingest path
+    HALL/segment-<time>.jsonl       sealed segments waiting for replay
+
+While the spool holds records new reports are spooled behind them, so the
+ingest does not wait for the database during an outage and reports are
+inserted in the order they arrived. The replayer checks the database with
+exponential backoff and inserts sealed segments in bulk batches once it is
+back. Only one process should replay a spool folder.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import settings
+import metrics
+
+# parse configuration file to get parameters
+config = settings.get()
+
+spool_enabled = config.getboolean('Spool', 'enabled', fallback=False)
+spool_dir = settings.resolve(config.get('Spool', 'dir',
+                                        fallback='../spool'))
+spool_fsync = config.getboolean('Spool', 'fsync', fallback=True)
+retry_min = config.getfloat('Spool', 'retry_min', fallback=1.0)
+retry_max = config.getfloat('Spool', 'retry_max', fallback=60.0)
+
+# appends and sealing of open segments by one thread at a time
+_lock = threading.Lock()
+# True while the spool holds records, None until the spool folder was read
+_pending = None
+_replayer = None
+_stop = threading.Event()
+
+
+class ReplayInterrupted(Exception):
+    """Database went away while spooled records were inserted, records
+       from start on were not inserted. inserted holds the indexes of the
+       records inserted before."""
+
+    def __init__(self, start, inserted=()):
+        super().__init__('replay interrupted at record {}'.format(start))
+        self.start = start
+        self.inserted = list(inserted)
+
+
+def type_dir(report_type):
+    """Return spool folder of report type"""
+    return os.path.join(spool_dir, report_type)
+
+
+def open_segment(report_type):
+    """Return path of the segment records of report type are appended to"""
+    return os.path.join(type_dir(report_type), 'open.jsonl')
+
+
+def list_segments(report_type):
+    """Return sealed segments of report type in the order they were written"""
+    return sorted(glob.glob(os.path.join(type_dir(report_type),
+                                         'segment-*.jsonl')))
+
+
+def has_records():
+    """Return True if any open or sealed segment holds records"""
+    import schema
+    for report_type in schema.REPORT_TABLES:
+        path = open_segment(report_type)
+        if list_segments(report_type) or (os.path.exists(path)
+                                          and os.path.getsize(path)):
+            return True
+    return False
+
+
+def active():
+    """Return True if the spool is enabled and holds records that were not
+       replayed yet, new records are spooled behind them then"""
+    global _pending
+    if not spool_enabled:
+        return False
+    if _pending is None:
+        with _lock:
+            if _pending is None:
+                _pending = has_records()
+    return _pending
+
+
+def append(report_type, rows):
+    """Append (key, record) rows to the open segment of report type.
+       Returns number of spooled records."""
+
+    global _pending
+    lines = [json.dumps({'key': key, 'record': record})
+             for key, record in rows]
+    if not lines:
+        return 0
+    with _lock:
+        os.makedirs(type_dir(report_type), exist_ok=True)
+        with open(open_segment(report_type), 'a', encoding='utf-8') as segment:
+            segment.write('\n'.join(lines) + '\n')
+            if spool_fsync:
+                segment.flush()
+                os.fsync(segment.fileno())
+        _pending = True
+    metrics.count('ingest_records_spooled_total', len(lines),
+                  report_type=report_type)
+    logging.warning('{} {} records spooled'.format(report_type, len(lines)))
+    return len(lines)
+
+
+def seal(report_type):
+    """Close open segment of report type so it can be replayed, records
+       appended later go to a new open segment"""
+    with _lock:
+        path = open_segment(report_type)
+        if os.path.exists(path) and os.path.getsize(path):
+            os.replace(path, os.path.join(
+                type_dir(report_type),
+                'segment-{:020d}.jsonl'.format(time.time_ns())))
+
+
+def read_segment(report_type, path):
+    """Read sealed segment into a RecordBatch. A line cut off because the
+       process stopped while writing it is skipped."""
+
+    from batch import RecordBatch
+    records = RecordBatch(report_type)
+    with open(path, encoding='utf-8') as segment:
+        for line_no, line in enumerate(segment, 1):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                logging.warning('spool {} line {} skipped, incomplete record'
+                                .format(path, line_no))
+                continue
+            records.append(row['record'], row['key'])
+    return records
+
+
+def write_segment(path, rows):
+    """Replace sealed segment with (key, record) rows"""
+    with open(path + '.tmp', 'w', encoding='utf-8') as segment:
+        for key, record in rows:
+            segment.write(json.dumps({'key': key, 'record': record}) + '\n')
+        if spool_fsync:
+            segment.flush()
+            os.fsync(segment.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def replay(insert):
+    """Insert all spooled records with insert(report_type, records), which
+       raises ReplayInterrupted if the database goes away. Inserted
+       segments are removed, an interrupted segment keeps the records that
+       were not inserted. Returns True if the spool was drained."""
+
+    global _pending
+    import schema
+    for report_type in schema.REPORT_TABLES:
+        seal(report_type)
+        for path in list_segments(report_type):
+            records = read_segment(report_type, path)
+            try:
+                insert(report_type, records)
+            except ReplayInterrupted as interrupted:
+                write_segment(path, records.rows(interrupted.start))
+                metrics.count('ingest_records_replayed_total',
+                              interrupted.start, report_type=report_type)
+                return False
+            os.remove(path)
+            metrics.count('ingest_records_replayed_total', len(records),
+                          report_type=report_type)
+            logging.info('{} {} spooled records replayed'.format(
+                report_type, len(records)))
+
+    # records spooled during the replay are replayed in the next round
+    with _lock:
+        _pending = has_records()
+        return not _pending
+
+
+def run_replayer(insert, probe):
+    """Replay spooled records until stopped. probe() raises while the
+       database is unavailable, the wait between attempts doubles from
+       retry_min to retry_max seconds until a replay drains the spool."""
+
+    delay = retry_min
+    while not _stop.is_set():
+        if not active():
+            _stop.wait(retry_min)
+            continue
+        try:
+            probe()
+            drained = replay(insert)
+        except Exception as replay_error:
+            logging.warning('spool replay failed: {}'.format(replay_error))
+            drained = False
+        if drained:
+            delay = retry_min
+            continue
+        _stop.wait(delay)
+        delay = min(delay * 2, retry_max)
+
+
+def start(insert, probe):
+    """Start replayer thread if the spool is enabled"""
+    global _replayer
+    if not spool_enabled or _replayer is not None:
+        return
+    _stop.clear()
+    _replayer = threading.Thread(target=run_replayer, args=(insert, probe),
+                                 daemon=True)
+    _replayer.start()
+
+
+def stop():
+    """Stop replayer thread"""
+    global _replayer
+    if _replayer is not None:
+        _stop.set()
+        _replayer.join()
+        _replayer = None
@@ -2,27 +2,149 @@
 This script extracts lab record file names present in the target directory and 
 sends it to reporttype_detect function
 
+The target directory and its subfolders are scanned while the files found so
+far are ingested in chunks of [Scan] chunk_size files. Reports in .zip, .tar,
+.tar.gz and .tgz archives are read without extracting them.
+
+With [Claims] enabled several startups, on one or on different machines, can
+load the same folder: found files are registered in the claims table and
+every worker ingests the batches of files it claimed.
+
+While the database is unavailable the folder is ingested without the
+manifest and without claims, reports that cannot be inserted are spooled
+if [Spool] is enabled and recorded in the manifest once they are replayed.
+
 @author: Anvitha Kandiraju
 """
 
-import configparser
-from os import walk
+import logging
+import os
+import settings
 import processing as process
+import archives
+import claims
+import manifest
+import metrics
+import scanner
 
 # get target folder name from config file
-config = configparser.ConfigParser()
-config.sections()
-config.read('../config.ini')
-folder_path = config['FolderPath']['path']
+config = settings.get()
+folder_path = settings.resolve(config['FolderPath']['path'])
+
+
+def ingest(items, known_files=None):
+    """Ingest the report files and archives of items, paths or os.DirEntry
+       of a folder scan. With the manifest (known_files of load_manifest)
+       only new or changed files are processed.
+       Returns paths of the files and archives that were not ingested."""
+
+    if known_files is not None:
+        entries, duplicates = manifest.changed_files(items, known_files)
+        paths = list(entries)
+    else:
+        paths = [os.fspath(item) for item in items]
+
+    # parallel mode parses files in a process pool, bulk mode parses all
+    # files first and inserts them in batches, otherwise send each file
+    # to reporttype_detect function
+    if config.getboolean('ParallelLoad', 'enabled', fallback=False):
+        inserted_paths = process.parallel_load(paths)
+    elif config.getboolean('BulkLoad', 'enabled', fallback=False):
+        inserted_paths = process.bulk_load(paths)
+    else:
+        inserted_paths = [path for path, _, content
+                          in process.report_sources(paths)
+                          if process.reporttype_detect(path, content)]
+
+    # remember ingested files for the next startup, an archive once
+    # all of its reports were inserted
+    ingested = archives.ingested_sources(inserted_paths)
+    if known_files is not None:
+        try:
+            manifest.record_ingested(entries, duplicates, ingested,
+                                     known_files)
+        except Exception as manifest_error:
+            if not process.db_unavailable(manifest_error):
+                raise
+            logging.error('manifest not updated, database unavailable: {}'
+                          .format(manifest_error))
+    return sorted(set(paths) - set(ingested))
+
+
+def scan(folder):
+    """Return generator of the report files and archives of folder"""
+    return scanner.scan(folder, match=process.is_report_source)
+
+
+def load_manifest():
+    """Return manifest of ingested files, None if the manifest is disabled
+       or the database is unavailable, all files are processed then"""
+    if not process.manifest_enabled:
+        return None
+    try:
+        return manifest.load_manifest(process.get_engine())
+    except Exception as manifest_error:
+        if not process.db_unavailable(manifest_error):
+            raise
+        logging.error('manifest not read, database unavailable, all files '
+                      'are processed: {}'.format(manifest_error))
+        return None
+
+
+def register_claims(folder):
+    """Register the files of folder in the claims table.
+       Returns False if the database is unavailable, the folder is then
+       ingested without claims."""
+    try:
+        for chunk in scanner.chunks(scan(folder)):
+            claims.register(chunk)
+    except Exception as claims_error:
+        if not process.db_unavailable(claims_error):
+            raise
+        logging.error('claims not registered, database unavailable, folder '
+                      'is ingested without claims: {}'.format(claims_error))
+        return False
+    return True
+
+
+def main(folder=folder_path):
+    """Ingest all new reports of folder, used by python startup.py and
+       the startup command of ingest.py"""
+
+    process.setup_logging()
+
+    # serve or write ingest metrics while startup runs
+    metrics.start()
+
+    # reports spooled while the database was unavailable go first
+    process.replay_spool()
+
+    # with the manifest only new or changed files are processed,
+    # the manifest is read once for all chunks
+    known_files = load_manifest()
+
+    # scan target directory for Hall and ICP reports and ingest the files
+    # found so far in chunks while the scan goes on
+    if claims.claims_enabled and register_claims(folder):
+
+        # ingest the files this worker claims until other workers
+        # finished or gave up theirs
+        claims.start()
+        try:
+            claims.run(lambda paths: (ingest(paths, known_files), []))
+        finally:
+            claims.stop()
+    else:
+        for chunk in scanner.chunks(scan(folder)):
+            ingest(chunk, known_files)
 
-# read all the files from target directory and create a list
-file_names = []
-for (dirpath, dirnames, filenames) in walk(folder_path):
-    file_names.extend(filenames)
-    break
+    # insert reports spooled during this run if the database is back
+    process.replay_spool()
 
-# send each file from the file_names list to reporttype_detect function
-for file in file_names:
-    process.reporttype_detect(folder_path + file)
+    metrics.stop()
 
 
+# guard is required so worker processes of the parallel load
+# do not run the startup again when they import this script
+if __name__ == '__main__':
+    main()
@@ -2,41 +2,269 @@
 This script monitors a directory for new files and triggers a reporttype_detect
 function
 
+New, modified or renamed report files are collected until their size and
+modification time stop changing, then a pool of worker threads inserts them
+into the database in micro batches.
+
+With [Claims] enabled several watchdogs, on one or on different machines,
+can watch the same folder: files are registered in the claims table and
+inserted by the watchdog that claims them. Files claimed by a watchdog that
+crashed are taken over after their lease expired.
+
 @author: Anvitha Kandiraju
 """
 
+import logging
+import os
+import queue
+import threading
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import configparser
+import settings
 import processing as process
+import archives
+import metrics
+import scanner
 
 # parse configuration file
-config = configparser.ConfigParser()
-config.sections()
-config.read('../config.ini')
-folder_path = config['FolderPath']['path']
+config = settings.get()
+folder_path = settings.resolve(config['FolderPath']['path'])
+
+# worker pool settings: a micro batch is flushed when it has batch_size files
+# or flush_interval seconds after its first file, files are read only after
+# their size and mtime did not change for stable_time seconds, files that
+# are still empty after empty_timeout seconds are dropped
+workers = config.getint('Watchdog', 'workers', fallback=2)
+batch_size = config.getint('Watchdog', 'batch_size', fallback=100)
+flush_interval = config.getfloat('Watchdog', 'flush_interval', fallback=1.0)
+stable_time = config.getfloat('Watchdog', 'stable_time', fallback=1.0)
+poll_interval = config.getfloat('Watchdog', 'poll_interval', fallback=0.25)
+empty_timeout = config.getfloat('Watchdog', 'empty_timeout', fallback=60.0)
+use_claims = config.getboolean('Claims', 'enabled', fallback=False)
+
+
+class PendingFiles:
+    """Files that were created or changed but may still be written"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # path -> (size, mtime, time size or mtime last changed)
+        self.files = {}
+
+    def add(self, path):
+        """Start or restart waiting for file to be completely written"""
+        with self.lock:
+            self.files[path] = (None, None, time.monotonic())
+
+    def pop_stable(self):
+        """Return files whose size and mtime were stable for stable_time.
+           Files that stayed empty for empty_timeout are dropped, they are
+           added again when they are written."""
+        now = time.monotonic()
+        stable = []
+        with self.lock:
+            for path, (size, mtime, changed) in list(self.files.items()):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # file was removed or renamed before it was read
+                    del self.files[path]
+                    continue
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                    self.files[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif stat.st_size and now - changed >= stable_time:
+                    stable.append(path)
+                    del self.files[path]
+                elif not stat.st_size and now - changed >= empty_timeout:
+                    logging.warning('{} dropped, still empty after {} '
+                                    'seconds'.format(path, empty_timeout))
+                    del self.files[path]
+        return stable
 
 
 # Function to notify on new file
 class NewFileHandler(FileSystemEventHandler):
+    def __init__(self, pending):
+        self.pending = pending
+
+    def queue_file(self, path, log_unknown=False):
+        """Add report file to pending files, ignore other files such as
+           temporary files renamed to a report name when complete"""
+        filename = path.replace('\\', '/').split('/')[-1]
+        if process.is_report_source(filename):
+            self.pending.add(path)
+        elif log_unknown:
+            logging.info('{} ignored, not a Hall or ICP report'
+                         .format(filename))
+
     def on_created(self, event):
         """ Detect new file"""
-        process.reporttype_detect(event.src_path)
+        if not event.is_directory:
+            self.queue_file(event.src_path, log_unknown=True)
+
+    def on_modified(self, event):
+        """ Detect file that is still being written"""
+        if not event.is_directory:
+            self.queue_file(event.src_path)
+
+    def on_moved(self, event):
+        """ Detect file renamed from a temporary name"""
+        if not event.is_directory:
+            self.queue_file(event.dest_path)
+
+
+def settle(pending, ready, stop):
+    """Move completely written files from pending files to ready queue"""
+    while not stop.is_set():
+        for path in pending.pop_stable():
+            ready.put(path)
+        metrics.set_gauge('ingest_queue_depth', len(pending.files),
+                          queue='pending')
+        metrics.set_gauge('ingest_queue_depth', ready.qsize(),
+                          queue='ready')
+        time.sleep(poll_interval)
+
+
+def insert(paths):
+    """Insert reports of paths in micro batches, used to ingest claimed
+       files. Returns paths of the files and archives without inserted
+       reports and of these the paths to retry, not inserted because the
+       database was unavailable."""
+    unavailable = []
+    try:
+        inserted = {archives.source_of(path)
+                    for path in process.bulk_load(paths, batch_size,
+                                                  unavailable=unavailable)}
+    finally:
+        archives.discard(paths)
+    retry = {archives.source_of(path) for path in unavailable}
+    failed = [path for path in paths if path not in inserted]
+    return failed, [path for path in failed if path in retry]
+
+
+def load_batch(batch):
+    """Insert reports of batch of files. A batch that fails, such as while
+       the database is down and the spool is disabled, is logged and
+       counted, the worker goes on with the next batch. The watchdog does
+       not record ingested archives, their member counts are dropped."""
+    try:
+        process.bulk_load(batch, batch_size)
+    except Exception as batch_error:
+        logging.error('batch of {} files not inserted: {}'.format(
+            len(batch), batch_error))
+        metrics.failure('insert_batch', batch_error)
+    archives.discard(batch)
+
+
+def batch_worker(ready):
+    """Collect ready files into micro batches and insert them.
+       A None item stops the worker after its current batch."""
+    running = True
+    while running:
+        path = ready.get()
+        if path is None:
+            break
+        batch = [path]
+        deadline = time.monotonic() + flush_interval
+
+        # fill batch until it is full or the flush interval is over
+        while len(batch) < batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                path = ready.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if path is None:
+                running = False
+                break
+            batch.append(path)
+
+        # with claims files are inserted by the watchdog that claims them,
+        # if they cannot be registered the batch is inserted or spooled
+        # right away. Files claimed before an error are released or taken
+        # over once their lease expired, they are not inserted here.
+        if use_claims:
+            import claims
+            try:
+                claims.register(batch)
+            except Exception as claim_error:
+                logging.error('claims not registered, batch inserted '
+                              'directly: {}'.format(claim_error))
+                load_batch(batch)
+                continue
+            try:
+                claims.run(insert, wait=False)
+            except Exception as claim_error:
+                logging.error('claims: {}'.format(claim_error))
+            continue
+        load_batch(batch)
+
+
+def main(folder=folder_path):
+    """Watch folder and insert new reports until interrupted, used by
+       python watchdog_script.py and the watch command of ingest.py"""
+
+    process.setup_logging()
+
+    # import pandas and SQLAlchemy while the observer already watches
+    threading.Thread(target=process.preload, daemon=True).start()
+
+    # serve or write ingest metrics while the watchdog runs
+    metrics.start()
+
+    # insert reports spooled while the database was unavailable
+    process.start_spool_replay()
+
+    pending = PendingFiles()
+    ready = queue.Queue()
+    stop = threading.Event()
+
+    # start thread waiting for files to be written and worker pool
+    threads = [threading.Thread(target=settle, args=(pending, ready, stop))]
+    threads.extend(threading.Thread(target=batch_worker, args=(ready,))
+                   for _ in range(workers))
+
+    # renew leases of claimed files and take over files of crashed workers
+    if use_claims:
+        import claims
+        claims.start()
+        threads.append(threading.Thread(target=claims.poll,
+                                        args=(insert, stop)))
+    for thread in threads:
+        thread.start()
+
+    observer = Observer()  # create observer
+    event_handler = NewFileHandler(pending)  # create event handler
+
+    # set observer to use created handler in directory
+    observer.schedule(event_handler, path=folder,
+                      recursive=scanner.scan_recursive)
+    observer.start()
 
+    # sleep until keyboard interrupt, then stop + rejoin the observer
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
 
-observer = Observer()  # create observer
-event_handler = NewFileHandler()  # create event handler
+    observer.join()
 
-# set observer to use created handler in directory
-observer.schedule(event_handler, path=folder_path)
-observer.start()
+    # insert files that are already ready, then stop worker pool
+    stop.set()
+    threads[0].join()
+    for _ in range(workers):
+        ready.put(None)
+    for thread in threads[1:]:
+        thread.join()
+    if use_claims:
+        claims.stop()
+    process.stop_spool_replay()
+    metrics.stop()
 
-# sleep until keyboard interrupt, then stop + rejoin the observer
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    observer.stop()
 
-observer.join()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
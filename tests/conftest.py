@@ -0,0 +1,34 @@
+"""
+Shared fixtures of the tests. The scripts of the processing folder read
+config.ini, or the file of the LAB_CONFIG environment variable, when they
+are imported. Tests that need the database are skipped when the database
+of the configuration file can not be reached.
+"""
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'processing'),
+                os.path.join(ROOT, 'benchmark')]
+
+
+@pytest.fixture
+def reports(tmp_path):
+    """Return folder with 20 generated Hall and ICP reports"""
+    import generate_reports
+    folder = tmp_path / 'reports'
+    generate_reports.generate_reports(str(folder), 20)
+    return folder
+
+
+@pytest.fixture(scope='session')
+def engine():
+    """Return engine of the configured database, skip test if it is down"""
+    import processing as process
+    try:
+        process.probe_database()
+    except Exception as db_error:
+        pytest.skip('database not reachable: {}'.format(db_error))
+    return process.get_engine()
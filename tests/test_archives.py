@@ -0,0 +1,47 @@
+import struct
+import zipfile
+import pytest
+import archives
+
+NAMES = ['Hall-BMOUT-000001.txt', 'Hall-BMOUT-000002.txt',
+         'Hall-BMOUT-000003.txt']
+
+
+def damage_member(path, name, damage):
+    """Damage member name of zip archive path in place"""
+    data = bytearray(path.read_bytes())
+    with zipfile.ZipFile(str(path)) as zip_file:
+        info = zip_file.getinfo(name)
+
+    # central directory entry of the member
+    central = data.find(b'PK\x01\x02')
+    while data[central + 46:central + 46 + len(name)] != name.encode():
+        central = data.find(b'PK\x01\x02', central + 1)
+
+    if damage == 'corrupt':
+        local = info.header_offset
+        start = local + 30 + sum(struct.unpack_from('<HH', data, local + 26))
+        data[start:start + info.compress_size] = b'\xff' * info.compress_size
+    elif damage == 'encrypted':
+        flags, = struct.unpack_from('<H', data, central + 8)
+        struct.pack_into('<H', data, central + 8, flags | 0x1)
+    elif damage == 'deflate64':
+        struct.pack_into('<H', data, central + 10, 9)
+    path.write_bytes(bytes(data))
+
+
+@pytest.mark.parametrize('damage', ['corrupt', 'encrypted', 'deflate64'])
+def test_unreadable_member_is_skipped(tmp_path, damage):
+    """A member that cannot be read is skipped, the other members are read
+       and the archive is not recorded as fully read"""
+    path = tmp_path / 'reports.zip'
+    with zipfile.ZipFile(str(path), 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name in NAMES:
+            zip_file.writestr(name, 'Hall Measurement Report\n' * 50 + name)
+    damage_member(path, NAMES[1], damage)
+
+    read = list(archives.members(str(path), lambda name: 'HALL'))
+    assert [member for member, _, _ in read] == \
+        [str(path) + '/' + name for name in (NAMES[0], NAMES[2])]
+    assert read[1][2].endswith(NAMES[2].encode())
+    assert archives.member_counts.pop(str(path)) is None
@@ -0,0 +1,92 @@
+import configparser
+import json
+import os
+import subprocess
+import sys
+from sqlalchemy import text
+import generate_reports
+import settings
+from conftest import ROOT
+
+WORKERS = 4
+FILES = 200
+
+# tables of the test, the configured tables are not touched
+TABLES = {'hall_table': 'claims_test_hall', 'icp_table': 'claims_test_icp',
+          'claims_table': 'claims_test_claims',
+          'manifest_table': 'claims_test_manifest'}
+
+
+def drop_tables(engine):
+    with engine.begin() as conn:
+        for table in TABLES.values():
+            conn.execute(text('DROP TABLE IF EXISTS {}'.format(table)))
+
+
+def worker_config(tmp_path, folder, worker):
+    """Write configuration file of worker, returns its path"""
+    config = configparser.ConfigParser()
+    config.read_dict(settings.get())
+    sections = {'FolderPath': {'path': str(folder)},
+                'PostgresTables': TABLES,
+                'logfile': {'log_filename': str(
+                    tmp_path / 'worker-{}.log'.format(worker))},
+                'EventLog': {'enabled': 'true', 'file': str(
+                    tmp_path / 'events-{}.jsonl'.format(worker))},
+                'Claims': {'enabled': 'true', 'lease': '10',
+                           'claim_size': '10'},
+                'Manifest': {'enabled': 'true'},
+                'Upsert': {'on_conflict': 'error'},
+                'BulkLoad': {'enabled': 'true'},
+                'ParallelLoad': {'enabled': 'false'},
+                'Spool': {'enabled': 'false'},
+                'Lineage': {'enabled': 'false'},
+                'Snapshot': {'enabled': 'false'},
+                'Metrics': {'enabled': 'false'}}
+    for section, values in sections.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        config[section].update(values)
+    path = tmp_path / 'config-{}.ini'.format(worker)
+    with open(str(path), 'w') as out:
+        config.write(out)
+    return str(path)
+
+
+def test_workers_ingest_every_file_once(tmp_path, engine):
+    """Workers started together on one folder insert every file once"""
+    folder = tmp_path / 'reports'
+    generate_reports.generate_reports(str(folder), FILES)
+    ingest = os.path.join(ROOT, 'processing', 'ingest.py')
+    drop_tables(engine)
+    try:
+        workers = [subprocess.Popen(
+            [sys.executable, ingest, '--config',
+             worker_config(tmp_path, folder, worker), 'startup'])
+            for worker in range(WORKERS)]
+        assert [worker.wait(timeout=300) for worker in workers] == \
+            [0] * WORKERS
+
+        # every file was processed by exactly one worker and inserted
+        events = []
+        for worker in range(WORKERS):
+            with open(str(tmp_path / 'events-{}.jsonl'.format(worker))) as log:
+                events.extend(map(json.loads, log))
+        assert sorted(event['file'] for event in events) == \
+            sorted(os.listdir(str(folder)))
+        assert {event['outcome'] for event in events} == {'inserted'}
+
+        with engine.connect() as conn:
+            states = dict(conn.execute(text(
+                'SELECT state, count(*) FROM claims_test_claims '
+                'GROUP BY state')).fetchall())
+            reports = sum(conn.execute(text(
+                'SELECT count(*) FROM {}'.format(TABLES[table]))).scalar()
+                for table in ('hall_table', 'icp_table'))
+            manifest = conn.execute(text(
+                'SELECT count(*) FROM claims_test_manifest')).scalar()
+        assert states == {'done': FILES}
+        assert reports == FILES
+        assert manifest == FILES
+    finally:
+        drop_tables(engine)
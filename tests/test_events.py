@@ -0,0 +1,17 @@
+import json
+import events
+
+
+def test_rotated_files_are_read_oldest_first(tmp_path):
+    """Rotated files are read by number, events.jsonl.10 is the oldest"""
+    path = tmp_path / 'events.jsonl'
+    files = [path.with_name('events.jsonl.{}'.format(number))
+             for number in range(10, 0, -1)] + [path]
+    for time, log_path in enumerate(files):
+        log_path.write_text(json.dumps({'time': time}) + '\n')
+
+    assert events.rotated_files(str(path)) == [str(f) for f in files[:-1]]
+    assert [event['time'] for event in events.read_events(str(path))] == \
+        list(range(len(files)))
+    assert [event['time'] for event in events.read_events(str(path), 9)] == \
+        [9, 10]
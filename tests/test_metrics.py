@@ -0,0 +1,19 @@
+import metrics
+import processing as process
+
+
+def test_parallel_load_keeps_parent_metrics(reports, monkeypatch):
+    """Metrics of the parent are not counted again by forked workers"""
+    monkeypatch.setattr(process, 'insert_batches',
+                        lambda records, *args: range(len(records)))
+    metrics.snapshot()
+    metrics.count('ingest_files_total', 1000, report_type='HALL')
+
+    paths = sorted(str(path) for path in reports.iterdir())
+    inserted = process.parallel_load(paths, workers=4, chunk_size=2)
+
+    histograms, counters = metrics.snapshot()
+    assert len(inserted) == len(paths)
+    assert counters[('ingest_files_total', (('report_type', 'HALL'),))] \
+        == 1000 + 10
+    assert counters[('ingest_files_total', (('report_type', 'ICP'),))] == 10
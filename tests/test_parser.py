@@ -0,0 +1,69 @@
+import warnings
+import pytest
+import processing as process
+
+REPORT = '''Hall Measurement Report
+
+Material UID\t BMOUT-000000
+Measurement\t Hall
+Probe Resistance (ohm)\t 84.598
+Gas Flow Rate (sccm)\t 7.82
+Gas Type\t N2
+Probe Material\t Cu
+Current (mA)\t 1.369
+Field Strength (T)\t 1.071
+Sample Position\t 7
+Magnet Reversal\t False
+'''
+
+NUMBERS = '''Hall Measurement Report
+
+Material UID\t 12345
+Probe Resistance (ohm)\t 84.598
+Current (mA)\t 1.369
+'''
+
+CASES = {
+    'valid': REPORT,
+    'empty text value': REPORT.replace('Gas Type\t N2', 'Gas Type\t '),
+    'missing text value': REPORT.replace('Gas Type\t N2', 'Gas Type'),
+    'NA text value': REPORT.replace('Gas Type\t N2', 'Gas Type\t NA'),
+    'empty unit value': REPORT.replace('(ohm)\t 84.598', '(ohm)\t '),
+    'missing unit value': REPORT.replace('(ohm)\t 84.598', '(ohm)'),
+    'missing boolean value': REPORT.replace('Reversal\t False', 'Reversal'),
+    'blank line': REPORT.replace('Hall\n', 'Hall\n\n', 1),
+    'whitespace line': REPORT.replace('Hall\nProbe', 'Hall\n   \nProbe'),
+    'tab line': REPORT.replace('Hall\nProbe', 'Hall\n \t \nProbe'),
+    'three columns': REPORT.replace('(mA)\t 1.369', '(mA)\t 1.369\t x'),
+    'trailing tab': REPORT.replace('(mA)\t 1.369', '(mA)\t 1.369\t'),
+    'numeric uid': REPORT.replace('BMOUT-000000', '12345'),
+    'numeric values only': NUMBERS,
+    'missing uid value': REPORT.replace('UID\t BMOUT-000000', 'UID'),
+    }
+
+
+def parse(parser, path):
+    """Return processed DataFrame of parser, None if it rejects the file"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            return parser(str(path), 'HALL')
+        except Exception:
+            return None
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_parsers_agree(tmp_path, case):
+    """The single pass parser accepts and rejects the same reports as the
+       pandas pipeline and gives the same values and column types"""
+    path = tmp_path / 'Hall-BMOUT-000000.txt'
+    path.write_text(CASES[case])
+    df_ref = parse(process.process_report_pandas, path)
+    df_fast = parse(process.process_report, path)
+
+    assert (df_fast is None) == (df_ref is None)
+    if df_ref is not None:
+        assert df_fast.to_csv() == df_ref.to_csv()
+        assert list(df_fast.dtypes) == list(df_ref.dtypes)
+        assert [type(value) for value in df_fast.iloc[0]] == \
+            [type(value) for value in df_ref.iloc[0]]
@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import Table, Column, Float, String, MetaData, text
+import schema
+import processing as process
+
+SEEBECK_REPORT = '''Seebeck Measurement Report
+
+Material UID\t BMOUT-000001
+Measurement\t Seebeck
+Seebeck Coefficient (uV/K)\t 182.5
+Temperature (K)\t 300.0
+'''
+
+
+@pytest.fixture
+def seebeck(monkeypatch, tmp_path):
+    """Register a third report type and return path of one of its reports"""
+    table = Table(
+        'seebeck_measurement_test',
+        MetaData(),
+        Column('seeb_uid', String(length=20), primary_key=True,
+               nullable=False),
+        Column('material_uid', String(length=20), index=True),
+        Column('process_type', String(length=20)),
+        Column('measurement', String(length=10)),
+        Column('seebeck_coefficient', Float),
+        Column('temperature', Float),
+        Column('seebeck_coefficient_units', String(length=10)),
+        Column('temperature_units', String(length=10)),
+        )
+    monkeypatch.setattr(schema, 'REPORT_TABLES', dict(schema.REPORT_TABLES))
+    monkeypatch.setattr(schema, 'FIELD_SPECS', dict(schema.FIELD_SPECS))
+    monkeypatch.setitem(process.REPORT_PREFIXES, 'Seebeck', 'SEEB')
+    schema.add_report_type('SEEB', table)
+
+    path = tmp_path / 'Seebeck-BMOUT-000001.txt'
+    path.write_text(SEEBECK_REPORT)
+    return table, str(path)
+
+
+def test_parse_third_report_type(seebeck):
+    """Reports of a registered type are detected and batched"""
+    table, path = seebeck
+    assert process.get_reporttype('Seebeck-BMOUT-000001.txt') == 'SEEB'
+
+    records, errors, _ = process.parse_files(process.report_sources([path]))
+    assert errors == []
+    assert len(records['SEEB']) == 1
+    df = records['SEEB'].to_frame()
+    assert list(df.columns) == list(table.columns.keys())
+    assert df['seeb_uid'][0] == 'SEEB-BMOUT-000001'
+    assert df['seebeck_coefficient_units'][0] == 'uV/K'
+
+
+def test_insert_third_report_type(seebeck, engine):
+    """Reports of a registered type are inserted file by file and in bulk"""
+    table, path = seebeck
+    process._tables_ready.discard('SEEB')
+    try:
+        assert process.reporttype_detect(path) == 'SEEB-BMOUT-000001'
+        with engine.begin() as conn:
+            conn.execute(table.delete())
+        assert process.bulk_load([path]) == [path]
+        with engine.connect() as conn:
+            rows = conn.execute(text('SELECT seeb_uid, temperature FROM '
+                                     'seebeck_measurement_test')).fetchall()
+        assert [tuple(row) for row in rows] == [('SEEB-BMOUT-000001', 300.0)]
+    finally:
+        table.drop(engine, checkfirst=True)
+        process._tables_ready.discard('SEEB')
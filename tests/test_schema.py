@@ -0,0 +1,27 @@
+from sqlalchemy import Table, Column, Float, String, MetaData, inspect, text
+import schema
+
+
+def test_migrate_table_keeps_table_definition(engine):
+    """Migrating a table without primary key indexes the key columns in
+       the database and leaves the table definition unchanged"""
+    table = Table('schema_migrate_test', MetaData(),
+                  Column('uid', String(length=20), primary_key=True),
+                  Column('value', Float),
+                  Column('value_units', String(length=10)))
+    with engine.begin() as conn:
+        conn.execute(text('DROP TABLE IF EXISTS schema_migrate_test'))
+        conn.execute(text('CREATE TABLE schema_migrate_test '
+                          '(uid varchar(20), value float)'))
+    try:
+        for _ in range(3):
+            schema.migrate_table(engine, table)
+        assert len(table.indexes) == 0
+
+        insp = inspect(engine)
+        assert [index['column_names'] for index in
+                insp.get_indexes('schema_migrate_test')] == [['uid']]
+        assert 'value_units' in {column['name'] for column in
+                                 insp.get_columns('schema_migrate_test')}
+    finally:
+        table.drop(engine, checkfirst=True)
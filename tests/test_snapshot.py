@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+import snapshot
+
+pytest.importorskip('pyarrow')
+
+
+def reports(*uids):
+    return pd.DataFrame({'hall_uid': list(uids),
+                         'material_uid': [uid[5:] for uid in uids],
+                         'probe_resistance': [1.0] * len(uids)})
+
+
+def test_append_reports_reads_only_new_keys(tmp_path, monkeypatch):
+    """Existing keys are kept in memory, appends read only new parts"""
+    monkeypatch.setattr(snapshot, 'snapshot_dir', str(tmp_path))
+    monkeypatch.setattr(snapshot, 'compact_parts', 3)
+    monkeypatch.setattr(snapshot, '_keys', {})
+    table = snapshot.REPORT_TABLES['HALL']
+    snapshot.replace_table(table, reports('HALL-BMOUT-1', 'HALL-BMOUT-2'))
+
+    key_reads = []
+    read_part = snapshot.read_part
+
+    def read_keys(path, columns=None):
+        if columns == ['hall_uid']:
+            key_reads.append(path)
+        return read_part(path, columns)
+    monkeypatch.setattr(snapshot, 'read_part', read_keys)
+
+    # every append reads the keys of the part written since the last one,
+    # compacted parts hold the same keys and are not read again
+    for uids in [('HALL-BMOUT-2', 'HALL-BMOUT-3'), ('HALL-BMOUT-3',),
+                 ('HALL-BMOUT-4',), ('HALL-BMOUT-1', 'HALL-BMOUT-5'),
+                 ('HALL-BMOUT-6',)]:
+        del key_reads[:]
+        snapshot.append_reports(None, 'HALL', reports(*uids),
+                                skip_existing=True)
+        assert len(key_reads) <= 1
+
+    df = snapshot.read_table(table)
+    assert sorted(df['hall_uid']) == ['HALL-BMOUT-{}'.format(i)
+                                      for i in range(1, 7)]
+    assert snapshot.existing_keys(table, 'hall_uid') == set(df['hall_uid'])
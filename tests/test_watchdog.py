@@ -0,0 +1,101 @@
+import queue
+import zipfile
+import pytest
+from sqlalchemy import exc
+import archives
+import metrics
+import processing as process
+
+pytest.importorskip('watchdog')
+import watchdog_script  # noqa: E402
+
+
+def test_empty_file_is_dropped(tmp_path, monkeypatch, caplog):
+    """Files that stay empty are dropped after empty_timeout, written
+       files are returned once they are stable"""
+    monkeypatch.setattr(watchdog_script, 'stable_time', 0)
+    monkeypatch.setattr(watchdog_script, 'empty_timeout', 0)
+    empty = tmp_path / 'Hall-BMOUT-000001.txt'
+    empty.write_text('')
+    written = tmp_path / 'Hall-BMOUT-000002.txt'
+    written.write_text('Hall Measurement Report\n')
+
+    pending = watchdog_script.PendingFiles()
+    pending.add(str(empty))
+    pending.add(str(written))
+
+    # the first check records size and mtime, the second one decides
+    assert pending.pop_stable() == []
+    assert pending.pop_stable() == [str(written)]
+    assert pending.files == {}
+    assert 'still empty' in caplog.text
+
+
+def test_failed_batch_does_not_stop_worker(monkeypatch):
+    """A batch that raises is counted and the next batch is inserted"""
+    monkeypatch.setattr(watchdog_script, 'flush_interval', 0)
+    monkeypatch.setattr(watchdog_script, 'use_claims', False)
+    loaded = []
+
+    def bulk_load(paths, batch_size):
+        if not loaded:
+            loaded.append(None)
+            raise exc.OperationalError('CREATE TABLE', {},
+                                       Exception('database is down'))
+        loaded.append(paths)
+        return paths
+    monkeypatch.setattr(process, 'bulk_load', bulk_load)
+
+    ready = queue.Queue()
+    for item in ('Hall-BMOUT-000001.txt', 'Hall-BMOUT-000002.txt', None):
+        ready.put(item)
+    metrics.snapshot()
+    watchdog_script.batch_worker(ready)
+
+    assert loaded == [None, ['Hall-BMOUT-000002.txt']]
+    _, counters = metrics.snapshot()
+    assert counters[('ingest_failures_total',
+                     (('error', 'OperationalError'), ('report_type', ''),
+                      ('stage', 'insert_batch')))] == 1
+
+
+def test_unavailable_database_releases_claims(reports, monkeypatch):
+    """Claimed files not inserted because the database is unavailable are
+       pending again, files that cannot be parsed are failed"""
+    import claims
+    import spool
+    from sqlalchemy import create_engine
+    monkeypatch.setattr(spool, 'spool_enabled', False)
+    monkeypatch.setattr(process, 'prepare_table',
+                        lambda report_type: report_type.lower())
+    monkeypatch.setattr(process, 'get_engine', lambda: create_engine(
+        'postgresql://nobody@127.0.0.1:1/none'))
+    invalid = reports / 'Hall-BMOUT-999999.txt'
+    invalid.write_text('Hall Measurement Report\n')
+    paths = sorted(str(path) for path in reports.iterdir())
+    monkeypatch.setattr(claims, 'claim', lambda: paths)
+    states = {}
+    monkeypatch.setattr(claims, 'finish', lambda finished, state:
+                        states.update(dict.fromkeys(finished, state)))
+
+    assert claims.run(watchdog_script.insert, wait=False) == 1
+    assert states.pop(str(invalid)) == 'failed'
+    assert set(states.values()) == {'pending'}
+    assert len(states) == len(paths) - 1
+
+
+def test_member_counts_are_dropped(tmp_path, monkeypatch):
+    """Member counts of archives read by the watchdog do not pile up"""
+    monkeypatch.setattr(watchdog_script, 'flush_interval', 0)
+    monkeypatch.setattr(watchdog_script, 'use_claims', False)
+    monkeypatch.setattr(process, 'bulk_load', lambda paths, batch_size: [
+        path for path, _, _ in process.report_sources(paths)])
+    path = str(tmp_path / 'reports.zip')
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('Hall-BMOUT-000001.txt', 'Hall Measurement Report')
+
+    ready = queue.Queue()
+    ready.put(path)
+    ready.put(None)
+    watchdog_script.batch_worker(ready)
+    assert path not in archives.member_counts
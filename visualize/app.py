@@ -4,156 +4,566 @@ This script contains functions to visualize database data for X-materials
 @author: AK
 """
 # import libraries
-import psycopg2
-import pandas as pd
-import plotly.graph_objects as go
-import configparser
-from IPython.display import display_html
-from plotly.subplots import make_subplots
+import glob
+import hashlib
+import os
+import select
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# table definitions are shared with the processing scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'processing'))
+import settings  # noqa: E402
+
+# read config.ini next to the processing folder. pandas, numpy, psycopg2
+# and the table definitions are imported by the functions using them,
+# plotly and IPython when a figure or table is first displayed
+config = settings.get()
+
+# database settings, parsed once per process
+postgresql_dbname = config['PostgresDB']['db_name']
+postgresql_host = config['PostgresDB']['host']
+postgresql_port = config['PostgresDB']['port']
+postgresql_user = config['PostgresDB']['user']
+postgresql_pw = config['PostgresDB']['pw']
+
+# connection pool shared by all functions: pool_size idle connections are
+# kept, at most pool_size + max_overflow are open, checkout waits up to
+# pool_timeout seconds for a free connection. Connections older than
+# pool_recycle seconds are replaced, pool_pre_ping tests them on checkout.
+pool_size = config.getint('EnginePool', 'pool_size', fallback=5)
+pool_max_overflow = config.getint('EnginePool', 'max_overflow', fallback=10)
+pool_timeout = config.getfloat('EnginePool', 'pool_timeout', fallback=30.0)
+pool_recycle = config.getint('EnginePool', 'pool_recycle', fallback=1800)
+pool_pre_ping = config.getboolean('EnginePool', 'pool_pre_ping', fallback=True)
+
+# read merged tables from the material lineage table kept up to date by the
+# ingest path instead of joining all tables
+use_lineage = config.getboolean('Lineage', 'enabled', fallback=False)
+lineage_table = config.get('PostgresTables', 'lineage_table',
+                           fallback='material_lineage')
+hall_table = config.get('PostgresTables', 'hall_table',
+                        fallback='hall_measurement')
+icp_table = config.get('PostgresTables', 'icp_table',
+                       fallback='icp_measurement')
+
+# query result cache settings, see [Cache] section of config.ini
+cache_enabled = config.getboolean('Cache', 'enabled', fallback=False)
+cache_max_bytes = config.getint('Cache', 'max_mb', fallback=512) * 2 ** 20
+cache_disk_dir = settings.resolve(config.get('Cache', 'disk_dir',
+                                            fallback=''))
+cache_disk_max_bytes = config.getint('Cache', 'disk_max_mb',
+                                     fallback=2048) * 2 ** 20
+cache_check_interval = config.getfloat('Cache', 'check_interval',
+                                       fallback=2.0)
+cache_notify = config.getboolean('Cache', 'notify', fallback=False)
+
+# read tables from the Arrow snapshots written by processing/snapshot.py
+# instead of querying the database, requires pyarrow
+use_snapshot = config.getboolean('Snapshot', 'read', fallback=False)
+snapshot_dir = settings.resolve(config.get('Snapshot', 'dir',
+                                           fallback='../snapshot'))
+
+# getFigure draws markers with WebGL above webgl_points rows and reduces
+# every plot to max_points points above max_points rows
+figure_webgl_points = config.getint('Figure', 'webgl_points', fallback=1000)
+figure_max_points = config.getint('Figure', 'max_points', fallback=20000)
+
+# channel the ingest path notifies after inserting reports
+NOTIFY_CHANNEL = 'lab_data_changed'
+
+
+def fingerprint_tables():
+    """Return (table, unique id column) of every table, their row counts
+       and largest ids form the fingerprint of the data cached results
+       were read from"""
+    import schema
+    return [(table.name, table.primary_key.columns.values()[0].name)
+            for table in schema.meta.sorted_tables]
+
+
+class QueryCache:
+    """LRU cache of query result DataFrames limited by memory size with
+       an optional on-disk tier. Entries are keyed by name and data
+       fingerprint, results of changed data are never returned."""
+
+    def __init__(self, max_bytes, disk_dir='', disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def disk_path(self, key):
+        """Return file of entry in disk tier"""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_dir, digest + '.pkl')
+
+    def get(self, key):
+        """Return copy of cached DataFrame, None if not cached"""
+        import pandas as pd
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0].copy()
+        if self.disk_dir and os.path.exists(self.disk_path(key)):
+            df = pd.read_pickle(self.disk_path(key))
+            self.put(key, df, disk=False)
+            return df.copy()
+        return None
+
+    def put(self, key, df, disk=True):
+        """Add DataFrame to cache, least recently used entries are evicted
+           when the cache is larger than its maximum size"""
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (df.copy(), nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+        if disk and self.disk_dir:
+            df.to_pickle(self.disk_path(key))
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Remove least recently written files above disk size limit"""
+        files = [os.path.join(self.disk_dir, f)
+                 for f in os.listdir(self.disk_dir) if f.endswith('.pkl')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        while files and total > self.disk_max_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+    def clear(self, disk=False):
+        """Remove all entries from memory and optionally from disk"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if disk and self.disk_dir:
+            for f in os.listdir(self.disk_dir):
+                if f.endswith('.pkl'):
+                    os.remove(os.path.join(self.disk_dir, f))
+
+
+cache = QueryCache(cache_max_bytes, cache_disk_dir, cache_disk_max_bytes)
+
+# last data fingerprint, when it was checked and LISTEN connection
+_data_state = {'fingerprint': None, 'checked': 0.0, 'listen_conn': None}
+
+
+def data_changed_notified():
+    """Return True if the ingest path sent a notification since last call"""
+    import psycopg2
+    conn = _data_state['listen_conn']
+    if conn is None:
+        conn = get_sql_conn()
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+        _data_state['listen_conn'] = conn
+        return True
+    if select.select([conn], [], [], 0) != ([], [], []):
+        conn.poll()
+    notified = bool(conn.notifies)
+    del conn.notifies[:]
+    return notified
+
+
+def data_fingerprint():
+    """Return fingerprint of database tables.
+       Row counts and largest ids are checked at most every
+       check_interval seconds or right after an ingest notification."""
+
+    now = time.monotonic()
+    notified = cache_notify and not use_snapshot and data_changed_notified()
+    if not notified and _data_state['fingerprint'] is not None \
+            and now - _data_state['checked'] < cache_check_interval:
+        return _data_state['fingerprint']
+
+    # snapshot parts are never changed, only added or replaced
+    if use_snapshot:
+        state = sorted(glob.glob(os.path.join(snapshot_dir, '*',
+                                              'part-*.arrow')))
+    else:
+        query = 'Select ' + ', '.join(
+            '(Select count(*) from {0}), (Select max({1}) from {0})'.format(
+                table, uid) for table, uid in fingerprint_tables())
+        with sql_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(query)
+            state = cur.fetchone()
+    fingerprint = hashlib.sha1(repr(state).encode()).hexdigest()
+
+    # reports updated in place keep counts and ids, the notification
+    # tells that cached results are stale anyway
+    if notified and fingerprint == _data_state['fingerprint']:
+        cache.clear(disk=True)
+    elif fingerprint != _data_state['fingerprint']:
+        cache.clear()
+    _data_state['fingerprint'] = fingerprint
+    _data_state['checked'] = now
+    return fingerprint
+
+
+def read_sql_cached(query, conn, params=None):
+    """Return result of query from cache or database"""
+    import pandas as pd
+    if not cache_enabled:
+        return pd.read_sql_query(query, con=conn, params=params)
+    key = ('query', query, repr(params), data_fingerprint())
+    df = cache.get(key)
+    if df is None:
+        df = pd.read_sql_query(query, con=conn, params=params)
+        cache.put(key, df)
+    return df
+
+
+def read_snapshot(table):
+    """Read snapshot table memory-mapped from the snapshot folder, see
+       read_table of processing/snapshot.py"""
+    import snapshot
+    df = snapshot.read_table(table)
+    if df is None:
+        raise FileNotFoundError('no snapshot of {} in {}, run snapshot.py'
+                                .format(table, snapshot.snapshot_dir))
+    return df
+
+
+def snapshot_tables(ball_ids=None):
+    """Return material procurement, ball mill, hot press, Hall and ICP
+       tables from snapshots, with a list of ball-mill ids only the rows
+       of the lineage of these materials"""
+    import pandas as pd
+
+    df_mat = read_snapshot('material_procurement')
+    df_ball = read_snapshot('ball_milling')
+    df_hot = read_snapshot('hot_press')
+    df_hall = read_snapshot(hall_table)
+    df_icp = read_snapshot(icp_table)
+    if ball_ids is not None:
+        df_mat = df_mat[df_mat['ball_milling_uid'].isin(ball_ids)]
+        df_ball = df_ball[df_ball['uid'].isin(ball_ids)]
+        df_hot = df_hot[df_hot['uid'].isin(df_ball['hot_press_uid'])]
+        outputs = pd.concat([df_ball['output_material_uid'],
+                             df_hot['output_material_uid']])
+        df_hall = df_hall[df_hall['material_uid'].isin(outputs)]
+        df_icp = df_icp[df_icp['material_uid'].isin(outputs)]
+    return df_mat, df_ball, df_hot, df_hall, df_icp
 
 
 def get_sql_conn():
-    """Setup PostgreSQL DB connection"""
-
-    # get config information
-    config = configparser.ConfigParser()
-    config.sections()
-    config.read('../config.ini')
-    dbname = config['PostgresDB']['db_name']
-    host = config['PostgresDB']['host']
-    port = config['PostgresDB']['port']
-    user = config['PostgresDB']['user']
-    pw = config['PostgresDB']['pw']
+    """Setup PostgreSQL DB connection.
+       Opens a new connection, queries use the pooled sql_conn instead."""
+    import psycopg2
 
     # connect to the database
-    conn = psycopg2.connect(host=host, port=port, database=dbname,
-                            user=user, password=pw)
+    conn = psycopg2.connect(host=postgresql_host, port=postgresql_port,
+                            database=postgresql_dbname, user=postgresql_user,
+                            password=postgresql_pw)
     return conn
 
 
-def mat_section(ball_id='MATX-BM005'):
-    """Return material properties of unique ball-mill id"""
-
+class ConnectionPool:
+    """Thread safe pool of database connections with a maximum size,
+       checkout blocks while all connections are in use"""
+
+    def __init__(self, size, max_overflow, timeout, recycle, pre_ping):
+        from psycopg2.pool import ThreadedConnectionPool
+        self.pool = ThreadedConnectionPool(size, size + max_overflow,
+                                           host=postgresql_host,
+                                           port=postgresql_port,
+                                           database=postgresql_dbname,
+                                           user=postgresql_user,
+                                           password=postgresql_pw)
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.slots = threading.BoundedSemaphore(size + max_overflow)
+        # connection -> time it was first checked out
+        self.opened = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def healthy(self, conn):
+        """Return True if connection is open, young enough and answers"""
+        import psycopg2
+        if conn.closed:
+            return False
+        if self.recycle and \
+                time.monotonic() - self.opened[conn] > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        """Check out a healthy connection"""
+        import psycopg2.pool
+        if not self.slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(
+                'no free database connection after {} s'.format(self.timeout))
+        try:
+            while True:
+                conn = self.pool.getconn()
+                with self.lock:
+                    self.opened.setdefault(conn, time.monotonic())
+                if self.healthy(conn):
+                    return conn
+                self.discard(conn)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def discard(self, conn):
+        """Close connection and remove it from the pool"""
+        with self.lock:
+            self.opened.pop(conn, None)
+        self.pool.putconn(conn, close=True)
+
+    def putconn(self, conn, broken=False):
+        """Return connection, idle connections above size are closed"""
+        import psycopg2
+        try:
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if broken or conn.closed:
+                self.discard(conn)
+            else:
+                self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def closeall(self):
+        """Close all connections of the pool"""
+        self.pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return connection pool of this process, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(pool_size, pool_max_overflow, pool_timeout,
+                                   pool_recycle, pool_pre_ping)
+        return _pool
+
+
+@contextmanager
+def sql_conn():
+    """Check out a pooled connection for the enclosed block.
+       The connection is returned even when the block raises, a
+       connection with a database error is closed instead."""
+    import psycopg2
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
     try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken)
+
+
+# lineage of a list of ball-mill ids in one batched query instead of one
+# query per id: one row per ball-mill id with its ball milling and hot press
+# rows and its materials, Hall and ICP reports as JSON. psycopg2 fills in the
+# ids on the client, the query is not prepared on the server.
+MAT_SECTION_QUERY = '''
+    WITH ball AS (
+        SELECT * FROM ball_milling WHERE uid = ANY(%(ids)s)),
+    hot AS (
+        SELECT * FROM hot_press
+        WHERE uid IN (SELECT hot_press_uid FROM ball)),
+    outputs AS (
+        SELECT b.uid AS ball_milling_uid, b.output_material_uid AS material_uid
+        FROM ball b
+        UNION
+        SELECT b.uid, h.output_material_uid
+        FROM ball b JOIN hot h ON h.uid = b.hot_press_uid)
+    SELECT b.uid AS ball_milling_uid,
+        row_to_json(b) AS ball_milling,
+        row_to_json(h) AS hot_press,
+        (SELECT json_agg(m) FROM material_procurement m
+         WHERE m.ball_milling_uid = b.uid) AS materials,
+        (SELECT json_agg(r) FROM {hall} r
+         JOIN outputs o ON o.material_uid = r.material_uid
+         WHERE o.ball_milling_uid = b.uid) AS hall,
+        (SELECT json_agg(r) FROM {icp} r
+         JOIN outputs o ON o.material_uid = r.material_uid
+         WHERE o.ball_milling_uid = b.uid) AS icp
+    FROM ball b LEFT JOIN hot h ON h.uid = b.hot_press_uid
+    '''.format(hall=hall_table, icp=icp_table)
+
+
+def get_mat_sections(ball_ids):
+    """Return dict of ball-mill id to its material procurement, ball mill,
+       hot press, Hall and ICP rows as DataFrames.
+       All ids are read with a single query, unknown ids are left out."""
+    import pandas as pd
+
+    if use_snapshot:
+        return snapshot_mat_sections(ball_ids)
+
+    with sql_conn() as conn:
+        df_lineage = read_sql_cached(MAT_SECTION_QUERY, conn,
+                                     {'ids': list(ball_ids)})
+
+    sections = {}
+    for row in df_lineage.itertuples(index=False):
+        sections[row.ball_milling_uid] = {
+            'mat': pd.DataFrame(row.materials or [],
+                                columns=['uid', 'ball_milling_uid',
+                                         'material_name', 'mass_fraction']),
+            'ball': pd.DataFrame([row.ball_milling]),
+            'hot': pd.DataFrame([row.hot_press] if row.hot_press else []),
+            'hall': pd.DataFrame(row.hall or []),
+            'icp': pd.DataFrame(row.icp or [])}
+    return sections
+
+
+def snapshot_mat_sections(ball_ids):
+    """Return lineage rows of ball-mill ids like get_mat_sections, read
+       from the snapshots"""
+
+    df_mat, df_ball, df_hot, df_hall, df_icp = snapshot_tables(ball_ids)
+    sections = {}
+    for _, row in df_ball.iterrows():
+        outputs = [row['output_material_uid']]
+        df_row_hot = df_hot[df_hot['uid'] == row['hot_press_uid']]
+        outputs.extend(df_row_hot['output_material_uid'])
+        sections[row['uid']] = {
+            'mat': df_mat[df_mat['ball_milling_uid'] == row['uid']].copy(),
+            'ball': row.to_frame().T.reset_index(drop=True),
+            'hot': df_row_hot.reset_index(drop=True),
+            'hall': df_hall[df_hall['material_uid'].isin(outputs)
+                            ].reset_index(drop=True),
+            'icp': df_icp[df_icp['material_uid'].isin(outputs)
+                          ].reset_index(drop=True)}
+    return sections
 
-        # get connection
-        conn = get_sql_conn()
 
-        # intialize variables
-        hot_id = ''
-        ball_out_id = ''
-        hot_out_id = ''
-
-        # query material procurement table for given id value
-        query_mat = \
-            'Select * from material_procurement where ball_milling_uid = \'{}\''.format(str(ball_id))
-        df_mat = pd.read_sql_query(query_mat, con=conn)
-
-        # query ball mill table for given id value
-        query_ball = \
-            'Select * from ball_milling where uid = \'{}\''.format(ball_id)
-        df_ball = pd.read_sql_query(query_ball, con=conn)
-
-        # if valid entry for a material exists, get output material id and hot press id
-        if not df_ball.empty:
-            ball_out_id = df_ball.iloc[0]['output_material_uid']
-            hot_id = df_ball.iloc[0]['hot_press_uid']
-
-        # if valid hot press id exsists query hot press table
-        if hot_id:
-            query_hot = \
-                'Select * from hot_press where uid = \'{}\''.format(hot_id)
-            df_hot = pd.read_sql_query(query_hot, con=conn)
-
-        # get output material id from hot table
-        if not df_hot.empty:
-            hot_out_id = df_hot.iloc[0]['output_material_uid']
-
-        # get lab reports for ball mill and hot press material from hall measurement and icp measurement tables
-        if ball_out_id or hot_out_id:
-
-            query_hall = \
-                'Select * from hall_measurement where material_uid in (\'{}\', \'{}\')'.format(hot_out_id,
-                    ball_out_id)
-            df_hall = pd.read_sql_query(query_hall, con=conn)
-
-            query_icp = \
-                'Select * from icp_measurement where material_uid in (\'{}\', \'{}\')'.format(hot_out_id,
-                    ball_out_id)
-            df_icp = pd.read_sql_query(query_icp, con=conn)
-
-        # format materials table
-        df_mat = df_mat.drop(['uid', 'ball_milling_uid'], axis=1)
-
-        # format ball mill table
-        df_ball['milling_speed'] = df_ball['milling_speed'].astype(str) \
-            + ' ' + df_ball['milling_speed_units']
-        df_ball['milling_time'] = df_ball['milling_time'].astype(str) \
-            + ' ' + df_ball['milling_time_units']
-        df_ball = df_ball[['milling_speed', 'milling_time']]
-        df_ball = df_ball.T.reset_index()
-        df_ball = df_ball.rename(columns={'index': 'BALL MILLING', 0: ''
-                                 })
-
-        # format hot press table
-        df_hot['hot_press_temperature'] = df_hot['hot_press_temperature'
-                ].astype(str) + ' ' \
-            + df_hot['hot_press_temperature_units']
-        df_hot['hot_press_pressure'] = df_hot['hot_press_pressure'
-                ].astype(str) + ' ' + df_hot['hot_press_pressure_units']
-        df_hot['hot_press_time'] = df_hot['hot_press_time'].astype(str) \
-            + ' ' + df_hot['hot_press_time_units']
-        df_hot = df_hot[['hot_press_temperature', 'hot_press_pressure',
-                        'hot_press_time', 'output_material_name']]
-        df_hot = df_hot.T.reset_index()
-        df_hot = df_hot.rename(columns={'index': 'HOT PROCESS', 0: ''})
-
-        # format hall measurement table
-        df_hall['probe_resistance'] = df_hall['probe_resistance'
-                ].astype(str) + ' ' + df_hall['probe_resistance_units']
-        df_hall['current'] = df_hall['current'].astype(str) + ' ' \
-            + df_hall['current_units']
-        df_hall['field_strength'] = df_hall['field_strength'
-                ].astype(str) + ' ' + df_hall['field_strength_units']
-        df_hall = df_hall[['process_type', 'probe_resistance',
-                          'probe_material', 'current', 'field_strength'
-                          ]]
-        df_hall = df_hall.T.reset_index()
-        df_hall = df_hall.rename(columns={'index': 'HALL REPORT', 0: ''
-                                 , 1: ''})
-
-        # format icp measurement table
-        df_icp['gas_flow_rate'] = df_icp['gas_flow_rate'].astype(str) \
-            + ' ' + df_icp['gas_flow_rate_units']
-        df_icp['radio_frequency'] = df_icp['radio_frequency'
-                ].astype(str) + ' ' + df_icp['radio_frequency_units']
-        df_icp = df_icp[[
-            'process_type',
-            'pb_concentration',
-            'sn_concentration',
-            'o_concentration',
-            'gas_flow_rate',
-            'radio_frequency',
-            ]]
-        df_icp = df_icp.T.reset_index()
-        df_icp = df_icp.rename(columns={'index': 'ICP REPORT', 0: '',
-                               1: ''})
-
-        # create a side by side display of tables with a heading
-        display_html('<h1> Material Properties {} </h1>'.format(str(ball_id)),
-                     raw=True)
-
-        # function to print tables side by side
-        display_side_by_side(df_mat, df_ball, df_hot, df_hall, df_icp)
-
-        # close opened database connection
-        conn.close()
+def mat_section(ball_id='MATX-BM005'):
+    """Return material properties of unique ball-mill id.
+       A list of ball-mill ids is displayed one after another, their
+       lineage is read from the database in one query."""
+
+    ball_ids = [ball_id] if isinstance(ball_id, str) else list(ball_id)
+    try:
+        sections = get_mat_sections(ball_ids)
     except Exception:
         print ('error occured: Please check Ball Mill ID')
+        return
+
+    for ball_id in ball_ids:
+        try:
+            display_mat_section(ball_id, **sections[ball_id])
+        except Exception:
+            print ('error occured: Please check Ball Mill ID {}'.format(
+                ball_id))
+
+
+def display_mat_section(ball_id, mat, ball, hot, hall, icp):
+    """Format and display lineage tables of one ball-mill id"""
+    from IPython.display import display_html
+
+    df_mat, df_ball, df_hot, df_hall, df_icp = mat, ball, hot, hall, icp
+
+    # format materials table
+    df_mat = df_mat.drop(['uid', 'ball_milling_uid'], axis=1)
+
+    # format ball mill table
+    df_ball['milling_speed'] = df_ball['milling_speed'].astype(str) \
+        + ' ' + df_ball['milling_speed_units']
+    df_ball['milling_time'] = df_ball['milling_time'].astype(str) \
+        + ' ' + df_ball['milling_time_units']
+    df_ball = df_ball[['milling_speed', 'milling_time']]
+    df_ball = df_ball.T.reset_index()
+    df_ball = df_ball.rename(columns={'index': 'BALL MILLING', 0: ''
+                             })
+
+    # format hot press table
+    df_hot['hot_press_temperature'] = df_hot['hot_press_temperature'
+            ].astype(str) + ' ' \
+        + df_hot['hot_press_temperature_units']
+    df_hot['hot_press_pressure'] = df_hot['hot_press_pressure'
+            ].astype(str) + ' ' + df_hot['hot_press_pressure_units']
+    df_hot['hot_press_time'] = df_hot['hot_press_time'].astype(str) \
+        + ' ' + df_hot['hot_press_time_units']
+    df_hot = df_hot[['hot_press_temperature', 'hot_press_pressure',
+                    'hot_press_time', 'output_material_name']]
+    df_hot = df_hot.T.reset_index()
+    df_hot = df_hot.rename(columns={'index': 'HOT PROCESS', 0: ''})
+
+    # format hall measurement table
+    df_hall['probe_resistance'] = df_hall['probe_resistance'
+            ].astype(str) + ' ' + df_hall['probe_resistance_units']
+    df_hall['current'] = df_hall['current'].astype(str) + ' ' \
+        + df_hall['current_units']
+    df_hall['field_strength'] = df_hall['field_strength'
+            ].astype(str) + ' ' + df_hall['field_strength_units']
+    df_hall = df_hall[['process_type', 'probe_resistance',
+                      'probe_material', 'current', 'field_strength'
+                      ]]
+    df_hall = df_hall.T.reset_index()
+    df_hall = df_hall.rename(columns={'index': 'HALL REPORT', 0: ''
+                             , 1: ''})
+
+    # format icp measurement table
+    df_icp['gas_flow_rate'] = df_icp['gas_flow_rate'].astype(str) \
+        + ' ' + df_icp['gas_flow_rate_units']
+    df_icp['radio_frequency'] = df_icp['radio_frequency'
+            ].astype(str) + ' ' + df_icp['radio_frequency_units']
+    df_icp = df_icp[[
+        'process_type',
+        'pb_concentration',
+        'sn_concentration',
+        'o_concentration',
+        'gas_flow_rate',
+        'radio_frequency',
+        ]]
+    df_icp = df_icp.T.reset_index()
+    df_icp = df_icp.rename(columns={'index': 'ICP REPORT', 0: '',
+                           1: ''})
+
+    # create a side by side display of tables with a heading
+    display_html('<h1> Material Properties {} </h1>'.format(str(ball_id)),
+                 raw=True)
+
+    # function to print tables side by side
+    display_side_by_side(df_mat, df_ball, df_hot, df_hall, df_icp)
 
 
 def display_side_by_side(*args):
     """Print Pandas dataframes side by side in python notebook"""
+    from IPython.display import display_html
 
     html_string = ''
     for df in args:
@@ -162,15 +572,111 @@ def display_side_by_side(*args):
                  'table style="display:inline"'), raw=True)
 
 
-def merge_tables():
-    """Join all the tables in dataframe"""
+def merge_tables(ball_ids=None):
+    """Join all the tables in dataframe.
+       With a list of ball-mill ids only the rows of these materials are
+       read and joined. The result is cached until the data in the
+       database changes."""
+
+    if not cache_enabled:
+        return load_merged_tables(ball_ids)
+    ids_key = None if ball_ids is None else tuple(sorted(set(ball_ids)))
+    key = ('merge_tables', use_lineage, ids_key, data_fingerprint())
+    df_com = cache.get(key)
+    if df_com is None:
+        df_com = load_merged_tables(ball_ids)
+        cache.put(key, df_com)
+    return df_com
 
-    # get sql connection
-    conn = get_sql_conn()
 
-    # get all info from materials table
-    query_mat = 'Select * from material_procurement'
-    df_mat = pd.read_sql_query(query_mat, con=conn)
+def merge_queries(ball_ids=None):
+    """Return queries of load_merged_tables by table and their parameters.
+       With a list of ball-mill ids every query is filtered to the lineage
+       of these materials."""
+
+    # ball-mill ids are passed as one array parameter, psycopg2 quotes them
+    # into the query text
+    params = None
+    where_mat = where_ball = where_hot = where_report = where_lineage = ''
+    if ball_ids is not None:
+        params = {'ids': list(ball_ids)}
+        where_mat = ' where ball_milling_uid = ANY(%(ids)s)'
+        where_ball = ' where uid = ANY(%(ids)s)'
+        where_hot = (' where uid in (Select hot_press_uid from ball_milling'
+                     ' where uid = ANY(%(ids)s))')
+        where_report = (' where material_uid in ('
+                        'Select output_material_uid from ball_milling'
+                        ' where uid = ANY(%(ids)s)'
+                        ' union Select h.output_material_uid from hot_press h'
+                        ' join ball_milling b on h.uid = b.hot_press_uid'
+                        ' where b.uid = ANY(%(ids)s))')
+        where_lineage = ' where "BM-uid" = ANY(%(ids)s)'
+
+    queries = {'mat': 'Select * from material_procurement' + where_mat,
+               'ball': 'Select * from ball_milling' + where_ball,
+               'hot': 'Select * from hot_press' + where_hot,
+               'hall': 'Select * from {}{}'.format(hall_table, where_report),
+               'icp': 'Select * from {}{}'.format(icp_table, where_report),
+               'lineage': 'Select * from {}{}'.format(lineage_table,
+                                                      where_lineage)}
+    return queries, params
+
+
+def check_indexes(ball_ids=['MATX-BM001']):
+    """Print tables the filtered lineage queries of this module read
+       without an index. Returns list of (query, table, filter)."""
+    import schema
+
+    queries, params = merge_queries(ball_ids)
+    if not use_lineage:
+        del queries['lineage']
+    checked = [('mat_section', MAT_SECTION_QUERY, {'ids': list(ball_ids)})]
+    checked.extend(('merge_tables ' + name, sql, params)
+                   for name, sql in queries.items())
+    with sql_conn() as conn:
+        missing = schema.check_indexes(conn, checked)
+    for name, table, condition in missing:
+        print('{}: {} is scanned without index {}'.format(name, table,
+                                                         condition))
+    return missing
+
+
+def load_merged_tables(ball_ids=None):
+    """Read all the tables from database and join them in dataframe.
+       With a list of ball-mill ids every query is filtered in the
+       database so only the lineage of these materials is fetched."""
+    import pandas as pd
+
+    queries, params = merge_queries(ball_ids)
+
+    # snapshots are read instead of the database if enabled
+    if use_snapshot and use_lineage:
+        df_com = read_snapshot(lineage_table)
+        if ball_ids is not None:
+            df_com = df_com[df_com['BM-uid'].isin(ball_ids)]
+        return df_com.reset_index(drop=True)
+    if use_snapshot:
+        df_mat, df_ball, df_hot, df_hall, df_icp = snapshot_tables(ball_ids)
+        df_mat, df_ball, df_hot, df_hall, df_icp = [
+            df.reset_index(drop=True)
+            for df in (df_mat, df_ball, df_hot, df_hall, df_icp)]
+    else:
+
+        # get pooled sql connection
+        with sql_conn() as conn:
+
+            # material lineage table has the columns of the merged tables
+            if use_lineage:
+                return pd.read_sql_query(queries['lineage'], con=conn,
+                                         params=params)
+
+            # get all info from materials, ball mill, hot process, hall
+            # measurements and icp measurements tables
+            df_mat, df_ball, df_hot, df_hall, df_icp = [
+                pd.read_sql_query(queries[name], con=conn, params=params)
+                for name in ('mat', 'ball', 'hot', 'hall', 'icp')]
+
+    # one column per material
     df_mat = df_mat.drop(['uid'], axis=1)
     df_mat = df_mat.pivot(index='ball_milling_uid',
                           columns='material_name',
@@ -178,28 +684,10 @@ def merge_tables():
     df_mat = df_mat.reset_index()
     df_mat = df_mat.add_prefix('MT-')
 
-    # get all info from ball mill table
-    query_ball = 'Select * from ball_milling'
-    df_ball = pd.read_sql_query(query_ball, con=conn)
-
     # added prefix to distinctly identify a column
     df_ball = df_ball.add_prefix('BM-')
-
-    # get all info from hot process
-    query_hot = 'Select * from hot_press'
-    df_hot = pd.read_sql_query(query_hot, con=conn)
-
-    # added prefix to distinctly identify a column
     df_hot = df_hot.add_prefix('HP-')
 
-    # get all info from hall measurements table
-    query_hall = 'Select * from hall_measurement'
-    df_hall = pd.read_sql_query(query_hall, con=conn)
-
-    # get all info from icp measurements table
-    query_icp = 'Select * from icp_measurement'
-    df_icp = pd.read_sql_query(query_icp, con=conn)
-
     # Left merge tables in database starting from materials area to lab reports
     df_com = df_ball.merge(df_mat, how='left', left_on='BM-uid',
                            right_on='MT-ball_milling_uid')
@@ -218,9 +706,6 @@ def merge_tables():
                           left_on='HP-output_material_uid',
                           right_on='HP-ICP-material_uid')
 
-    # close connection
-    conn.close()
-
     # return complete db tables
     return df_com
 
@@ -233,11 +718,8 @@ def compare_materials(supList=['MATX-BM001', 'MATX-BM002', 'MATX-BM003'
    # check to catch any errors
     try:
 
-       # get complete merged table
-        df_com = merge_tables()
-
-       # filter for required fields
-        df_filtered = df_com[df_com['BM-uid'].isin(supList)]
+       # get merged table of the requested materials only
+        df_filtered = merge_tables(supList)
 
        # format table
         df_filtered = df_filtered.T
@@ -250,13 +732,65 @@ def compare_materials(supList=['MATX-BM001', 'MATX-BM002', 'MATX-BM003'
     return df_filtered
 
 
-def getFigure():
+def downsample(df, x_col, y_col, max_points):
+    """Return rows of df with the minimum and maximum y value of
+       max_points / 2 equal x ranges, rows without y value are left out"""
+    import numpy as np
+    import pandas as pd
+
+    y = pd.to_numeric(df[y_col], errors='coerce')
+    df, y = df[y.notna()], y[y.notna()]
+    if len(df) <= max_points:
+        return df
+    buckets = pd.cut(df[x_col], max_points // 2, labels=False).to_numpy()
+
+    # sort rows by range and y, first and last row of a range are kept
+    order = np.lexsort((y.to_numpy(), buckets))
+    sorted_buckets = buckets[order]
+    edge = sorted_buckets[1:] != sorted_buckets[:-1]
+    keep = order[np.r_[True, edge] | np.r_[edge, True]]
+    return df.iloc[np.sort(keep)]
+
+
+def trace_data(df, x_col, y_col, hover_cols, max_points):
+    """Return x, y and hover data of a scatter trace.
+       Hover columns are passed as customdata instead of formatted text."""
+
+    df = downsample(df[[x_col, y_col] + hover_cols], x_col, y_col,
+                    max_points)
+    return {'x': df[x_col], 'y': df[y_col],
+            'customdata': df[hover_cols].to_numpy()}
+
+
+def bucket_means(df, x_col, y_cols, max_points):
+    """Return mean of y columns in max_points equal x ranges,
+       x of every range is its first x value"""
+    import pandas as pd
+
+    if len(df) <= max_points:
+        return df
+    buckets = pd.cut(df[x_col], max_points, labels=False)
+    grouped = df[[x_col] + y_cols].groupby(buckets)
+    df_means = grouped[y_cols].mean()
+    df_means[x_col] = grouped[x_col].min()
+    return df_means
+
+
+def getFigure(max_points=figure_max_points, webgl_points=figure_webgl_points):
     """Plot quantifiable data in a subplot grid using Plotly's
-       interactive plotting tools"""
+       interactive plotting tools.
+       Above webgl_points rows markers are drawn with WebGL, above
+       max_points rows every plot is reduced to at most max_points
+       points, the minimum and maximum of equal index ranges."""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
 
     # get merged tables
     df_com = merge_tables()
 
+    # WebGL markers scale to many more points than SVG
+    scatter = go.Scattergl if len(df_com) > webgl_points else go.Scatter
+
     # list of selected parameters
     selectedlist = [
         'MT-Cu',
@@ -293,17 +827,19 @@ def getFigure():
         [{'rowspan': 1, 'colspan': 3}, None,None,{'rowspan': 1, 'colspan': 3},None, None,],
         [{'rowspan': 1, 'colspan': 3},None,None,{'rowspan': 1, 'colspan': 3},None,None,]], horizontal_spacing=0.1)
 
-    # Materials table data plotting
+    # Materials table data plotting, averaged when there are too many bars
     y_col1 = selectedlist[0]
     y_col2 = selectedlist[1]
     y_col3 = selectedlist[2]
-    fig.add_trace(go.Bar(x=df_com[x_col], y=df_com[y_col1],
+    df_bars = bucket_means(df_com, x_col, [y_col1, y_col2, y_col3],
+                           max_points)
+    fig.add_trace(go.Bar(x=df_bars[x_col], y=df_bars[y_col1],
                   marker_color='rgb(55, 83, 109)', name='Cu'), row=1,
                   col=1)  # ,offsetgroup=0
-    fig.add_trace(go.Bar(x=df_com[x_col], y=df_com[y_col2],
+    fig.add_trace(go.Bar(x=df_bars[x_col], y=df_bars[y_col2],
                   marker_color='rgb(26, 118, 255)', name='Se'), row=1,
                   col=1)
-    fig.add_trace(go.Bar(x=df_com[x_col], y=df_com[y_col3],
+    fig.add_trace(go.Bar(x=df_bars[x_col], y=df_bars[y_col3],
                   marker_color='rgb(0,191,255)', name='Zn'), row=1,
                   col=1)
     fig.update_xaxes(title_text='Index', showgrid=False, row=1, col=1)
@@ -312,13 +848,12 @@ def getFigure():
 
     # Ball milling table data plotting
     y_col = selectedlist[3]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-milling_time_units', 'BM-uid'], max_points),
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['BM-milling_time_units'], df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_size=7,
         marker_color='rgb(0,191,255)',
@@ -329,13 +864,12 @@ def getFigure():
     fig.update_yaxes(title_text='Ball Milling Time', row=2, col=1)
 
     y_col = selectedlist[4]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-milling_speed_units', 'BM-uid'], max_points),
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['BM-milling_speed_units'], df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(0,191,255)',
         marker_line_width=1,
@@ -347,15 +881,13 @@ def getFigure():
 
     # Hot process table data plotting
     y_col = selectedlist[5]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['HP-hot_press_temperature_units', 'BM-uid'], max_points),
         marker_symbol='square',
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['HP-hot_press_temperature_units'],
-              df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(55, 83, 109)',
         marker_line_width=1,
@@ -366,15 +898,13 @@ def getFigure():
     fig.update_yaxes(title_text='Hot Press Temperature', row=3, col=1)
 
     y_col = selectedlist[6]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['HP-hot_press_pressure_units', 'BM-uid'], max_points),
         marker_symbol='square',
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['HP-hot_press_pressure_units'], df_com['BM-uid'
-              ])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(55, 83, 109)',
         marker_line_width=1,
@@ -386,15 +916,13 @@ def getFigure():
 
 
     y_col = selectedlist[7]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['HP-hot_press_time_units', 'BM-uid'], max_points),
         marker_symbol='square',
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['HP-hot_press_time_units'], df_com['BM-uid'
-              ])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(55, 83, 109)',
         marker_line_width=1,
@@ -406,14 +934,12 @@ def getFigure():
 
     # Hall measurement table plots
     y_col = selectedlist[8]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-HA-probe_resistance_units', 'BM-uid'], max_points),
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['BM-HA-probe_resistance_units'],
-              df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(35,54,183)',
         marker_line_width=1,
@@ -424,15 +950,13 @@ def getFigure():
     fig.update_yaxes(title_text='Probe Resistance', row=4, col=1)
 
     y_col = selectedlist[9]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['HP-HA-probe_resistance_units', 'BM-uid'], max_points),
         marker_symbol='diamond',
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{}<br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['HP-HA-probe_resistance_units'],
-              df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(274,94,91)',
         marker_line_width=1,
@@ -442,14 +966,12 @@ def getFigure():
     
     # ICP measurement table plots
     y_col = selectedlist[10]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-ICP-radio_frequency_units', 'BM-uid'], max_points),
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['BM-ICP-radio_frequency_units'],
-              df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(35,54,183)',
         marker_line_width=1,
@@ -460,15 +982,13 @@ def getFigure():
     fig.update_yaxes(title_text='ICP Radio Frequency', row=4, col=4)
 
     y_col = selectedlist[11]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['HP-ICP-radio_frequency_units', 'BM-uid'], max_points),
         marker_symbol='diamond',
         mode='markers',
-        hovertemplate='<br>x: %{x}<br>' + 'y: %{y}' + '%{text}',
-        text=['{} <br>{}<br>'.format(i, j) for (i, j) in
-              zip(df_com['HP-ICP-radio_frequency_units'],
-              df_com['BM-uid'])],
+        hovertemplate='<br>x: %{x}<br>y: %{y}'
+        + '%{customdata[0]} <br>%{customdata[1]}<br>',
         marker_line_color='midnightblue',
         marker_color='rgb(274,94,91)',
         marker_line_width=1,
@@ -478,13 +998,12 @@ def getFigure():
     
     # ICP measurement table concentration plots
     y_col = selectedlist[12]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         marker_symbol='square',
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='pb',
         marker_line_color='midnightblue',
         marker_color='red',
@@ -496,13 +1015,12 @@ def getFigure():
                      col=1)
 
     y_col = selectedlist[13]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         marker_symbol='diamond',
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='sn',
         marker_line_color='midnightblue',
         marker_color='green',
@@ -511,12 +1029,11 @@ def getFigure():
         ), row=5, col=1)
 
     y_col = selectedlist[14]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='o',
         marker_line_color='midnightblue',
         marker_color='black',
@@ -525,13 +1042,12 @@ def getFigure():
         ), row=5, col=1)
 
     y_col = selectedlist[15]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         marker_symbol='square',
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='pb',
         marker_line_color='midnightblue',
         marker_color='red',
@@ -543,13 +1059,12 @@ def getFigure():
                      col=4)
 
     y_col = selectedlist[16]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         marker_symbol='diamond',
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='sn',
         marker_line_color='midnightblue',
         marker_color='green',
@@ -558,12 +1073,11 @@ def getFigure():
         ), row=5, col=4)
 
     y_col = selectedlist[17]
-    fig.add_trace(go.Scatter(
-        x=df_com[x_col],
-        y=df_com[y_col],
+    fig.add_trace(scatter(
+        **trace_data(df_com, x_col, y_col,
+                     ['BM-uid'], max_points),
         mode='markers',
-        hovertemplate='y: %{y}' + '<br>x: %{x}<br>' + '%{text}',
-        text=['<br>{}<br>'.format(i) for i in df_com['BM-uid']],
+        hovertemplate='y: %{y}<br>x: %{x}<br><br>%{customdata[0]}<br>',
         name='o',
         marker_line_color='midnightblue',
         marker_color='black',